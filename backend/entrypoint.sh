@@ -32,6 +32,30 @@ python manage.py makemigrations tasks
 python manage.py makemigrations
 python manage.py migrate
 
+# Compile the schedules of routines saved before the schedule columns existed
+echo "Compiling routine schedules..."
+python manage.py compile_routine_schedules
+
+# Link the tasks created by routines before tasks had a source routine
+echo "Linking routine tasks..."
+python manage.py link_routine_tasks
+
+# Move the category names stored on tasks and routines to the Category table
+echo "Linking categories..."
+python manage.py link_categories
+
+# Roll up the task history of the users without daily stats yet
+echo "Building daily task stats..."
+python manage.py backfill_task_stats
+
+# Fill the search vector of the tasks written before the search trigger existed
+echo "Indexing tasks for search..."
+python manage.py index_task_search
+
+# Delete the expired refresh tokens and their blacklist entries
+echo "Pruning expired tokens..."
+python manage.py prune_expired_tokens
+
 # Create superuser if it doesn't exist
 echo "Creating superuser..."
 python manage.py shell -c "
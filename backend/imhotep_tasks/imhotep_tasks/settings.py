@@ -69,6 +69,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # the trigram lookups of the autocomplete (see tasks/utils/task_suggestions.py)
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'rest_framework_simplejwt.token_blacklist',
@@ -80,7 +82,7 @@ INSTALLED_APPS = [
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'tasks.utils.user_cache.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -97,8 +99,21 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=30),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'tasks.utils.token_blacklist.CachedTokenRefreshSerializer',
 }
 
+# the authentication keeps the users it read in memory this many seconds (0 to read them on every
+# request), at most AUTH_USER_CACHE_SIZE of them per process; see tasks/utils/user_cache.py
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=30, cast=int)
+AUTH_USER_CACHE_SIZE = config('AUTH_USER_CACHE_SIZE', default=10000, cast=int)
+# the cache holding the users' stamps, changed by every save of a user so the other processes drop
+# their copy; it has to be shared by the processes (see CACHE_BACKEND) for them to see it
+AUTH_USER_CACHE_ALIAS = 'default'
+
+# blacklisted refresh tokens each process remembers, refusing them without a query; the expired
+# tokens are deleted by the prune_expired_tokens command (e.g. run nightly from cron)
+TOKEN_BLACKLIST_CACHE_SIZE = config('TOKEN_BLACKLIST_CACHE_SIZE', default=10000, cast=int)
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -179,6 +194,40 @@ DATABASES = {
     }
 }
 
+# Cache, used for the per-user page cache of the task / routine read endpoints.
+# Local memory by default, set CACHE_BACKEND / CACHE_LOCATION to use e.g. the file backend
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='imhotep-tasks'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    }
+}
+
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=300, cast=int)
+
+# rows inserted per bulk insert by the task import (tasks/import/ and the import_tasks command)
+TASK_IMPORT_BATCH_SIZE = config('TASK_IMPORT_BATCH_SIZE', default=1000, cast=int)
+
+# completed tasks done and due longer ago than this are moved to the archive by the archive_tasks
+# command (e.g. run nightly from cron); all_tasks lists them with include_archived
+TASK_ARCHIVE_AFTER_DAYS = config('TASK_ARCHIVE_AFTER_DAYS', default=90, cast=int)
+
+# set once the materialize_routines command runs every night (e.g. from cron right after midnight):
+# the today / next week pages then stop applying routines themselves once the day's run finished
+ROUTINES_MATERIALIZED = config('ROUTINES_MATERIALIZED', default=False, cast=bool)
+
+# how long the tombstones of deleted tasks and routines are kept for the delta sync pull (tasks/sync/pull/);
+# a client whose cursor is older has to resync in full. Pruned by the prune_sync_records command
+SYNC_TOMBSTONE_RETENTION_DAYS = config('SYNC_TOMBSTONE_RETENTION_DAYS', default=30, cast=int)
+
+# how long the results of sync mutations sent with a mutation_id are kept for retried batches,
+# also pruned by prune_sync_records
+SYNC_PROCESSED_MUTATION_TTL_DAYS = config('SYNC_PROCESSED_MUTATION_TTL_DAYS', default=7, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -241,6 +290,12 @@ CORS_ALLOWED_ORIGINS = [
     "https://imhoteptasks.pythonanywhere.com",
 ]
 
+# let the PWA / desktop app revalidate the read endpoints with the ETag they return
+from corsheaders.defaults import default_headers
+
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match')
+CORS_EXPOSE_HEADERS = ['ETag']
+
 # Add this configuration for Google OAuth
 GOOGLE_OAUTH2_CLIENT_ID = config('GOOGLE_CLIENT_ID', default='')
 GOOGLE_OAUTH2_CLIENT_SECRET = config('GOOGLE_CLIENT_SECRET', default='')
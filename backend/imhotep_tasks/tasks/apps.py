@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class TasksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tasks'
+
+    def ready(self):
+        from .utils.task_search import install_search_trigger
+        from .utils.task_suggestions import install_trigram_indexes
+        from .utils.user_cache import forget_cached_user
+        from .utils.token_blacklist import remember_blacklisted
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+        from .models import User
+        post_migrate.connect(install_search_trigger, sender=self)
+        post_migrate.connect(install_trigram_indexes, sender=self)
+        # profile, password and is_active changes reach the cached authentication
+        post_save.connect(forget_cached_user, sender=User)
+        post_delete.connect(forget_cached_user, sender=User)
+        post_save.connect(remember_blacklisted, sender=BlacklistedToken)
@@ -9,6 +9,9 @@ from django.template.loader import render_to_string
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from tasks.utils.otp_utils import generate_otp, is_otp_valid, OTP_VALIDITY_MINUTES
+from tasks.utils.data_version import bump_data_version
+from tasks.utils.daily_stats import rebuild_daily_stats
+from tasks.utils.user_time import valid_timezone
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -22,6 +25,7 @@ def get_profile(request):
         'first_name': user.first_name,
         'last_name': user.last_name,
         'email_verify': user.email_verify,
+        'timezone': user.timezone,
         'date_joined': user.date_joined,
     })
 
@@ -35,9 +39,11 @@ def update_profile(request):
         last_name = request.data.get('last_name', '').strip()
         username = request.data.get('username', '').strip()
         email = request.data.get('email', '').strip()
+        user_timezone = request.data.get('timezone', '').strip()
 
         messages = []
         errors = []
+        timezone_changed = False
 
         # Update first name and last name directly
         if first_name != user.first_name:
@@ -61,6 +67,15 @@ def update_profile(request):
                     user.username = username
                     messages.append("Username updated")
 
+        # Validate and update the time zone the user's days are counted in
+        if user_timezone and user_timezone != user.timezone:
+            if not valid_timezone(user_timezone):
+                errors.append("Unknown time zone, use a name like Africa/Cairo")
+            else:
+                user.timezone = user_timezone
+                timezone_changed = True
+                messages.append("Time zone updated")
+
         # Validate and handle email update
         if email and email != user.email:
             # Check if email contains '@'
@@ -127,6 +142,11 @@ def update_profile(request):
         # Save user if there are no errors
         if not errors:
             user.save()
+            # the username is part of the cached task and routine pages, and the time zone decides their day
+            bump_data_version(user.id)
+            if timezone_changed:
+                # the days the daily stats count the created tasks on are the user's days
+                rebuild_daily_stats(user.id)
             if not messages:
                 messages.append("Profile updated successfully!")
 
@@ -145,6 +165,7 @@ def update_profile(request):
                 'first_name': user.first_name,
                 'last_name': user.last_name,
                 'email_verify': user.email_verify,
+                'timezone': user.timezone,
             }
         }
         
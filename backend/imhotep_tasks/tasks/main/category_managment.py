@@ -0,0 +1,38 @@
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from ..models import Category
+from ..utils.categories import category_facets, clean_category_name, rename_category
+from ..utils.response_cache import cached_on_data_version
+
+#the user's categories with their total and pending task counts
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@cached_on_data_version
+def show_categories(request):
+    categories = category_facets(request.user.id)
+    return Response({
+        "success": True,
+        "username": request.user.username,
+        "categories": categories,
+    }, status=status.HTTP_200_OK)
+
+#rename a category; renaming it to another category's name merges the two
+@api_view(['POST', 'PATCH'])
+@permission_classes([IsAuthenticated])
+def rename_category_view(request, category_id):
+    category = get_object_or_404(Category, id=category_id, user=request.user)
+    name = clean_category_name(request.data.get("name"))
+    if not name:
+        return Response(
+            {'error': 'name is required and cannot be empty', 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    category = rename_category(category, name)
+    return Response({
+        "success": True,
+        "category": {"id": category.id, "name": category.name},
+    }, status=status.HTTP_200_OK)
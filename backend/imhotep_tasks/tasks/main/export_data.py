@@ -0,0 +1,116 @@
+import csv
+import json
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from ..models import Tasks, TaskArchive, Routines
+
+# rows read per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+
+# the keys of every exported record, and the CSV header; tasks and routines share the file
+EXPORT_COLUMNS = (
+    'type',
+    'id',
+    'title',
+    'details',
+    'category',
+    'due_date',
+    'status',
+    'done_date',
+    'creation_date',
+    'routine_type',
+    'routine_dates',
+)
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+def _task_records(model, user_id):
+    tasks = model.objects.filter(created_by_id=user_id).order_by('id').values_list(
+        'id', 'task_title', 'task_details', 'category__name', 'due_date', 'status', 'done_date', 'creation_date'
+    )
+    for task_id, title, details, category, due_date, task_status, done_date, creation_date in tasks.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'type': 'task',
+            'id': task_id,
+            'title': title,
+            'details': details,
+            'category': category or '',
+            'due_date': _iso(due_date),
+            'status': bool(task_status),
+            'done_date': _iso(done_date),
+            'creation_date': _iso(creation_date),
+            'routine_type': None,
+            'routine_dates': None,
+        }
+
+def _routine_records(user_id):
+    routines = Routines.objects.filter(created_by_id=user_id).order_by('id').values_list(
+        'id', 'routines_title', 'category__name', 'status', 'routine_type', 'routines_dates'
+    )
+    for routine_id, title, category, routine_status, routine_type, routines_dates in routines.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'type': 'routine',
+            'id': routine_id,
+            'title': title,
+            'details': None,
+            'category': category or 'general',
+            'due_date': None,
+            'status': bool(routine_status),
+            'done_date': None,
+            'creation_date': None,
+            'routine_type': routine_type,
+            'routine_dates': routines_dates,
+        }
+
+def _records(user_id):
+    yield from _task_records(Tasks, user_id)
+    # the archived tasks (see utils/task_archive.py) are exported like the others
+    yield from _task_records(TaskArchive, user_id)
+    yield from _routine_records(user_id)
+
+def _ndjson_lines(user_id):
+    for record in _records(user_id):
+        yield json.dumps(record) + '\n'
+
+class _Echo:
+    # a file-like object for csv.writer that hands the written line back
+    def write(self, value):
+        return value
+
+def _csv_lines(user_id):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for record in _records(user_id):
+        record['routine_dates'] = json.dumps(record['routine_dates']) if record['routine_dates'] is not None else None
+        record['status'] = 'true' if record['status'] else 'false'
+        yield writer.writerow([record[column] for column in EXPORT_COLUMNS])
+
+EXPORT_FORMATS = {
+    'ndjson': (_ndjson_lines, 'application/x-ndjson'),
+    'csv': (_csv_lines, 'text/csv'),
+}
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_data(request):
+    """
+    Stream every task and routine of the user as NDJSON (default) or CSV.
+    ?file_type=ndjson|csv
+    """
+    file_type = request.GET.get('file_type', 'ndjson').lower()
+    if file_type not in EXPORT_FORMATS:
+        return Response(
+            {'error': 'file_type must be ndjson or csv', 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    lines, content_type = EXPORT_FORMATS[file_type]
+    response = StreamingHttpResponse(lines(request.user.id), content_type=content_type)
+    filename = f"imhotep-tasks-export-{timezone.now().date()}.{file_type}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
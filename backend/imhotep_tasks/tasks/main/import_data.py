@@ -0,0 +1,50 @@
+import io
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from ..utils.task_import import IMPORT_FILE_TYPES, import_rows, iter_rows
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_data(request):
+    """
+    Import tasks and routines from an uploaded NDJSON or CSV file (multipart field "file").
+    The type comes from ?file_type= / the file_type field, or from the file extension.
+    Responds with the import counts and a per-row error report.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response(
+            {'error': 'file is required', 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    file_type = (request.GET.get('file_type') or request.data.get('file_type') or upload.name.rsplit('.', 1)[-1]).lower()
+    if file_type not in IMPORT_FILE_TYPES:
+        return Response(
+            {'error': 'file_type must be ndjson or csv', 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    batch_size = None
+    if request.data.get('batch_size'):
+        try:
+            batch_size = max(1, int(request.data.get('batch_size')))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'batch_size must be a number', 'success': False},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    # read the upload line by line instead of loading it whole
+    lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        report = import_rows(request.user, iter_rows(lines, file_type), batch_size)
+    except UnicodeDecodeError:
+        return Response(
+            {'error': 'file must be UTF-8 encoded', 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response({'success': True, **report}, status=status.HTTP_200_OK)
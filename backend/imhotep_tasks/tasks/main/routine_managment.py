@@ -1,50 +1,63 @@
 from django.shortcuts import get_object_or_404
 from ..models import Routines
-from datetime import date
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import transaction
 from ..utils.apply_routines import apply_routines
 from ..utils.validate_yearly_dates import validate_yearly_dates
+from ..utils.cursor_pagination import paginate_by_cursor
+from ..utils.data_version import bump_data_version
+from ..utils.delta_sync import record_deletions
+from ..utils.routine_materialization import apply_written_routine
+from ..utils.response_cache import cached_on_data_version
+from ..utils.routines_utils import ROUTINE_FIELDS, serialize_routine, serialize_routine_row
+from ..utils.user_time import user_today
+from ..utils.categories import resolve_category
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
+ROUTINES_PER_PAGE = 20
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_on_data_version
 def show_routines(request):
-    today = date.today()
-    user_routines_all = Routines.objects.filter(created_by=request.user)
-    paginator = Paginator(user_routines_all, 20)
-    page = request.GET.get('page', 1)
-    try:
-        user_routines = paginator.page(page)
-    except PageNotAnInteger:
-        user_routines = paginator.page(1)
-    except EmptyPage:
-        user_routines = paginator.page(paginator.num_pages)
+    user_routines_all = Routines.objects.filter(created_by=request.user).order_by('id').values(*ROUTINE_FIELDS)
 
-    routines_list = [
-        {
-            "id": r.id,
-            "routines_title": r.routines_title,
-            "routines_dates": r.routines_dates,
-            "routine_type": r.routine_type,
-            "routine_category": r.routine_category or "general",
-            "status": r.status,
-            "created_by": r.created_by.id,
+    # cursor mode (send an empty cursor for the first page), the page number still works for old clients
+    if 'cursor' in request.GET:
+        page_routines, next_cursor, prev_cursor = paginate_by_cursor(
+            user_routines_all, ('id',), request.GET.get('cursor'), ROUTINES_PER_PAGE
+        )
+        pagination = {
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+            "per_page": ROUTINES_PER_PAGE,
         }
-        for r in user_routines.object_list
-    ]
-    return Response({
-        "success": True,
-        "username": request.user.username,
-        "user_routines": routines_list,
-        "pagination": {
+    else:
+        paginator = Paginator(user_routines_all, ROUTINES_PER_PAGE)
+        page = request.GET.get('page', 1)
+        try:
+            user_routines = paginator.page(page)
+        except PageNotAnInteger:
+            user_routines = paginator.page(1)
+        except EmptyPage:
+            user_routines = paginator.page(paginator.num_pages)
+        page_routines = user_routines.object_list
+        pagination = {
             "page": user_routines.number,
             "num_pages": paginator.num_pages,
             "per_page": paginator.per_page,
             "total": paginator.count,
         }
+
+    routines_list = [serialize_routine_row(r) for r in page_routines]
+    return Response({
+        "success": True,
+        "username": request.user.username,
+        "user_routines": routines_list,
+        "pagination": pagination,
     })
 
 @api_view(['POST'])
@@ -83,13 +96,16 @@ def add_routine(request):
             )
 
     if routine_type in ["yearly", "monthly", "weekly"]:
-        routine = Routines.objects.create(
-            routines_title=routines_title,
-            routine_type=routine_type,
-            routines_dates=routines_dates,
-            routine_category=routine_category,
-            created_by=request.user,
-        )
+        with transaction.atomic():
+            routine = Routines.objects.create(
+                routines_title=routines_title,
+                routine_type=routine_type,
+                routines_dates=routines_dates,
+                category=resolve_category(request.user.id, routine_category),
+                created_by=request.user,
+            )
+            bump_data_version(request.user.id)
+        apply_written_routine(request.user)
     else:
         return Response(
             {'error': 'routine type must be yearly, monthly, or weekly'}, 
@@ -98,15 +114,7 @@ def add_routine(request):
 
     return Response({
         "success": True,
-        "routine": {
-            "id": routine.id,
-            "routines_title": routine.routines_title,
-            "routines_dates": routine.routines_dates,
-            "routine_type": routine.routine_type,
-            "routine_category": routine.routine_category or "general",
-            "status": routine.status,
-            "created_by": routine.created_by.id,
-        }
+        "routine": serialize_routine(routine),
     })
 
 @api_view(['POST'])
@@ -141,28 +149,26 @@ def update_routine(request, routine_id):
         routine.routines_dates = routines_dates
     if routine_type is not None:
         routine.routine_type = routine_type
-    if routine_category is not None:
-        routine.routine_category = routine_category
-
-    routine.save()
+    with transaction.atomic():
+        if routine_category is not None:
+            routine.category = resolve_category(request.user.id, routine_category)
+        routine.save()
+        bump_data_version(request.user.id)
+    apply_written_routine(request.user)
     return Response({
         "success": True,
-        "routine": {
-            "id": routine.id,
-            "routines_title": routine.routines_title,
-            "routines_dates": routine.routines_dates,
-            "routine_type": routine.routine_type,
-            "routine_category": routine.routine_category or "general",
-            "status": routine.status,
-            "created_by": routine.created_by.id,
-        }
+        "routine": serialize_routine(routine),
     })
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def delete_routine(request, routine_id):
     routine = get_object_or_404(Routines, id=routine_id, created_by=request.user)
-    routine.delete()
+    routine_id = routine.id
+    with transaction.atomic():
+        routine.delete()
+        bump_data_version(request.user.id)
+        record_deletions(request.user.id, 'routine', [routine_id])
     return Response({"success": True, "message": "Routine deleted"})
 
 @api_view(['POST'])
@@ -170,22 +176,18 @@ def delete_routine(request, routine_id):
 def update_routine_status(request, routine_id):
     routine = get_object_or_404(Routines, id=routine_id, created_by=request.user)
     routine.status = not routine.status
-    routine.save()
+    with transaction.atomic():
+        routine.save()
+        bump_data_version(request.user.id)
+    apply_written_routine(request.user)
     return Response({
         "success": True,
-        "routine": {
-            "id": routine.id,
-            "routines_title": routine.routines_title,
-            "routines_dates": routine.routines_dates,
-            "routine_category": routine.routine_category or "general",
-            "status": routine.status,
-            "created_by": routine.created_by.id,
-        }
+        "routine": serialize_routine(routine),
     })
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def apply_routines_view(request):
-    today = date.today()
+    today = user_today(request.user)
     apply_routines(request, today, True)
     return Response({"success": True, "message": "Routines applied successfully!"})
@@ -1,10 +1,13 @@
-from django.utils import timezone
+from django.db import IntegrityError, transaction
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from ..models import Tasks
-from ..utils import tasks_managements_utils
+from ..utils import tasks_managements_utils, task_changes, delta_sync, sync_batch, idempotency
+from ..utils.routines_utils import ROUTINE_FIELDS, serialize_routine_row
+from ..utils.user_time import user_today
+from ..utils.categories import resolve_category
 
 
 @api_view(['POST'])
@@ -17,6 +20,8 @@ def sync_mutations(request):
     - Groups mutations by task_id
     - For each task_id, keeps only the mutation with the latest client_timestamp
     - Processes mutations in order: creates first, then updates, then deletes
+    - A mutation sent with a mutation_id is applied once: a retried batch gets the
+      stored result back (with "replayed": true) instead of applying it again
     
     Request body:
     {
@@ -28,6 +33,7 @@ def sync_mutations(request):
                 "method": "POST" | "PATCH" | "DELETE",
                 "payload": {...},
                 "task_id": 42,            // optional, for updates/deletes
+                "mutation_id": "...",     // optional, client generated (e.g. a UUID), max 64 chars
                 "client_timestamp": "..."  // ISO 8601 timestamp
             }
         ]
@@ -45,6 +51,13 @@ def sync_mutations(request):
     if not mutations:
         return Response({'success': True, 'processed': 0, 'results': []})
     
+    bad_id = idempotency.invalid_mutation_id(mutations)
+    if bad_id is not None:
+        return Response(
+            {'error': f'mutation_id must be at most {idempotency.MAX_MUTATION_ID_LENGTH} characters', 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
     #remove duplicates  
     deduplicated = _deduplicate_mutations(mutations)
     
@@ -61,30 +74,28 @@ def sync_mutations(request):
     }
     deduplicated.sort(key=lambda m: action_order.get(m.get('action', ''), 99))
     
-    #Process each mutation
-    results = []
     temp_id_map = {}  # Maps client temp_ids to server IDs (for creates)
-    
-    for mutation in deduplicated:
-        action = mutation.get('action', '')
-        payload = mutation.get('payload', {})
-        task_id = mutation.get('task_id')
-        
+    for attempt in range(2):
+        #mutations applied by an earlier try of this batch get their stored result back
+        replayed = idempotency.processed_results(request.user.id, deduplicated)
+        fresh = [m for m in deduplicated if idempotency.mutation_id(m) not in replayed]
         try:
-            result = _process_mutation(request, action, payload, task_id, temp_id_map)
-            results.append({
-                'action': action,
-                'task_id': task_id,
-                'success': True,
-                **result,
-            })
-        except Exception as e:
-            results.append({
-                'action': action,
-                'task_id': task_id,
-                'success': False,
-                'error': str(e),
-            })
+            with transaction.atomic():
+                fresh_results = _process_batch(request, fresh, temp_id_map)
+                idempotency.remember_results(request.user.id, fresh, fresh_results)
+            break
+        except IntegrityError:
+            # a concurrent try of the same batch stored its ids first and everything
+            # done here was rolled back; read its results on the second attempt
+            if attempt:
+                raise
+    
+    fresh_results = iter(fresh_results)
+    results = [
+        {**replayed[idempotency.mutation_id(m)], 'replayed': True}
+        if idempotency.mutation_id(m) in replayed else next(fresh_results)
+        for m in deduplicated
+    ]
     
     return Response({
         'success': True,
@@ -94,15 +105,138 @@ def sync_mutations(request):
     }, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_pull(request):
+    """
+    Return the tasks, routines and categories created, changed or deleted since the sync cursor.
+
+    ?cursor=<the cursor of the previous pull>, leave it out for the first pull (everything).
+    Call again with the returned cursor while has_more is true; keep the last cursor for
+    the next pull. A row can come back more than once, apply rows by id.
+
+    Response:
+    {
+        "tasks": [...], "routines": [...],        // upsert by id, with updated_at
+        "categories": [...],                       // id and name, upsert by id; tasks and
+                                                   // routines point to them by category_id
+        "deleted": {"tasks": [ids], "routines": [ids], "categories": [ids]},
+        "cursor": "...",
+        "has_more": false,
+        "full_resync": false                       // true: the cursor is too old, pull
+                                                   // again without it and replace local data
+    }
+    """
+    cursor = request.GET.get('cursor')
+    positions = None
+    if cursor:
+        positions = delta_sync.decode_sync_cursor(cursor)
+        if positions is None:
+            return Response(
+                {'error': 'invalid cursor', 'success': False},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if delta_sync.needs_full_resync(positions):
+            return Response({
+                'success': True,
+                'full_resync': True,
+                'tasks': [],
+                'routines': [],
+                'categories': [],
+                'deleted': {'tasks': [], 'routines': [], 'categories': []},
+                'cursor': None,
+                'has_more': False,
+            }, status=status.HTTP_200_OK)
+
+    tasks, routines, categories, tombstones, positions, has_more = delta_sync.pull_changes(
+        request.user.id, tasks_managements_utils.TASK_FIELDS, ROUTINE_FIELDS, positions
+    )
+
+    return Response({
+        'success': True,
+        'full_resync': False,
+        'tasks': [
+            {**tasks_managements_utils.serialize_task_row(row), 'updated_at': row['updated_at'].isoformat()}
+            for row in tasks
+        ],
+        'routines': [
+            {**serialize_routine_row(row), 'updated_at': row['updated_at'].isoformat()}
+            for row in routines
+        ],
+        'categories': [
+            {**row, 'updated_at': row['updated_at'].isoformat()}
+            for row in categories
+        ],
+        'deleted': {
+            'tasks': [record_id for record_type, record_id in tombstones if record_type == 'task'],
+            'routines': [record_id for record_type, record_id in tombstones if record_type == 'routine'],
+            'categories': [record_id for record_type, record_id in tombstones if record_type == 'category'],
+        },
+        'cursor': delta_sync.encode_sync_cursor(positions),
+        'has_more': has_more,
+    }, status=status.HTTP_200_OK)
+
+
+def _process_batch(request, mutations, temp_id_map):
+    """Process the whole batch set-based: one read, one write per kind of change."""
+    if not mutations:
+        return []
+    try:
+        return sync_batch.execute(request.user, mutations)
+    except Exception:
+        # the batch write failed as a whole (nothing was written), run the mutations
+        # one by one so only the ones at fault fail
+        return _process_one_by_one(request, mutations, temp_id_map)
+
+
+def _process_one_by_one(request, mutations, temp_id_map):
+    """Process each mutation in its own savepoint of one transaction."""
+    results = []
+    
+    with transaction.atomic():
+        for mutation in mutations:
+            action = mutation.get('action', '')
+            payload = mutation.get('payload', {})
+            task_id = mutation.get('task_id')
+            
+            try:
+                # each mutation commits (or rolls back) together with its counter updates
+                with transaction.atomic():
+                    result = _process_mutation(request, action, payload, task_id, temp_id_map)
+                results.append({
+                    'action': action,
+                    'task_id': task_id,
+                    'success': True,
+                    **result,
+                })
+            except Exception as e:
+                results.append({
+                    'action': action,
+                    'task_id': task_id,
+                    'success': False,
+                    'error': str(e),
+                })
+    
+    return results
+
+
 def _deduplicate_mutations(mutations):
     """
     For each task_id, keep only the mutation with the latest client_timestamp.
     Mutations without a task_id (e.g., creates) are always kept.
+    A mutation_id sent more than once in the batch is kept once.
     """
     without_task_id = []
     by_task_id = {}
+    seen_ids = set()
     
     for mutation in mutations:
+        mutation_id = idempotency.mutation_id(mutation)
+        if mutation_id is not None:
+            if mutation_id in seen_ids:
+                continue
+            seen_ids.add(mutation_id)
+        
         task_id = mutation.get('task_id')
         
         if not task_id:
@@ -155,7 +289,7 @@ def _process_mutation(request, action, payload, task_id, temp_id_map):
 
 
 def _handle_add_task(request, payload, url_call):
-    today = timezone.now().date()
+    today = user_today(request.user)
     due_date = tasks_managements_utils._parse_date_input(payload.get('due_date')) or today
     
     task = Tasks.objects.create(
@@ -163,37 +297,42 @@ def _handle_add_task(request, payload, url_call):
         task_details=payload.get('task_details'),
         due_date=due_date,
         created_by=request.user,
-        task_category=payload.get('task_category', 'general'),
+        category=resolve_category(request.user.id, payload.get('task_category', 'general')),
     )
+    task_changes.record_task_changes(request.user.id, after=[task_changes.task_snapshot(task)])
     
     return {'task': tasks_managements_utils.serialize_task(task), 'server_id': task.id}
 
 
 def _handle_update_task(request, payload, task_id, url_call):
     try:
-        task = Tasks.objects.get(id=task_id, created_by=request.user)
+        task = Tasks.objects.select_for_update().get(id=task_id, created_by=request.user)
     except Tasks.DoesNotExist:
         raise ValueError(f'Task {task_id} not found')
+    before = task_changes.task_snapshot(task)
     
     if 'task_title' in payload:
         task.task_title = payload['task_title']
     if 'task_details' in payload:
         task.task_details = payload['task_details']
     if 'task_category' in payload:
-        task.task_category = payload['task_category']
+        task.category = resolve_category(request.user.id, payload['task_category'])
     if 'due_date' in payload and payload['due_date'] is not None:
         parsed = tasks_managements_utils._parse_date_input(payload['due_date'])
         if parsed:
             task.due_date = parsed
     
     task.save()
+    task_changes.record_task_changes(request.user.id, [before], [task_changes.task_snapshot(task)])
     return {'task': tasks_managements_utils.serialize_task(task)}
 
 
 def _handle_delete_task(request, task_id, url_call):
     try:
-        task = Tasks.objects.get(id=task_id, created_by=request.user)
+        task = Tasks.objects.select_for_update().get(id=task_id, created_by=request.user)
+        before = task_changes.task_snapshot(task)
         task.delete()
+        task_changes.record_task_changes(request.user.id, before=[before])
         return {'message': 'Task deleted'}
     except Tasks.DoesNotExist:
         # Already deleted — that's fine
@@ -202,32 +341,41 @@ def _handle_delete_task(request, task_id, url_call):
 
 def _handle_toggle_complete(request, task_id, url_call):
     try:
-        task = Tasks.objects.get(id=task_id, created_by=request.user)
+        task = Tasks.objects.select_for_update().get(id=task_id, created_by=request.user)
     except Tasks.DoesNotExist:
         raise ValueError(f'Task {task_id} not found')
+    before = task_changes.task_snapshot(task)
     
     task.status = not task.status
-    task.done_date = timezone.now().date() if task.status else None
+    task.done_date = user_today(request.user) if task.status else None
     task.save()
+    task_changes.record_task_changes(request.user.id, [before], [task_changes.task_snapshot(task)])
     
     return {'task': tasks_managements_utils.serialize_task(task)}
 
 
 def _handle_bulk_delete(request, payload, url_call):
     task_ids = payload.get('task_ids', [])
-    deleted_count = Tasks.objects.filter(id__in=task_ids, created_by=request.user).delete()[0]
+    tasks_qs = Tasks.objects.filter(id__in=task_ids, created_by=request.user)
+    before = task_changes.queryset_snapshots(tasks_qs.select_for_update())
+    deleted_count = tasks_qs.delete()[0]
+    task_changes.record_task_changes(request.user.id, before=before)
     return {'deleted_count': deleted_count}
 
 
 def _handle_bulk_complete(request, payload, url_call):
     task_ids = payload.get('task_ids', [])
-    tasks_qs = Tasks.objects.filter(id__in=task_ids, created_by=request.user)
+    tasks = list(Tasks.objects.filter(id__in=task_ids, created_by=request.user).select_for_update())
+    before = [task_changes.task_snapshot(t) for t in tasks]
+    today = user_today(request.user)
     
-    for t in tasks_qs:
+    for t in tasks:
         t.status = not t.status
-        t.done_date = timezone.now().date() if t.status else None
+        t.done_date = today if t.status else None
     
-    Tasks.objects.bulk_update(tasks_qs, ['status', 'done_date'])
+    task_changes.touch(tasks)
+    Tasks.objects.bulk_update(tasks, ['status', 'done_date', 'updated_at'])
+    task_changes.record_task_changes(request.user.id, before, [task_changes.task_snapshot(t) for t in tasks])
     return {'updated_count': len(task_ids)}
 
 
@@ -239,12 +387,15 @@ def _handle_bulk_update_date(request, payload, url_call):
         raise ValueError('due_date is required')
     
     parsed = tasks_managements_utils._parse_date_input(due_date_raw)
-    tasks_qs = Tasks.objects.filter(id__in=task_ids, created_by=request.user)
+    tasks = list(Tasks.objects.filter(id__in=task_ids, created_by=request.user).select_for_update())
+    before = [task_changes.task_snapshot(t) for t in tasks]
     
-    for t in tasks_qs:
+    for t in tasks:
         t.due_date = parsed
     
-    Tasks.objects.bulk_update(tasks_qs, ['due_date'])
+    task_changes.touch(tasks)
+    Tasks.objects.bulk_update(tasks, ['due_date', 'updated_at'])
+    task_changes.record_task_changes(request.user.id, before, [task_changes.task_snapshot(t) for t in tasks])
     return {'updated_count': len(task_ids)}
 
 
@@ -255,10 +406,14 @@ def _handle_bulk_update_category(request, payload, url_call):
     if not category:
         raise ValueError('task_category is required')
     
-    tasks_qs = Tasks.objects.filter(id__in=task_ids, created_by=request.user)
+    tasks = list(Tasks.objects.filter(id__in=task_ids, created_by=request.user).select_for_update())
+    before = [task_changes.task_snapshot(t) for t in tasks]
+    category = resolve_category(request.user.id, category)
     
-    for t in tasks_qs:
-        t.task_category = category
+    for t in tasks:
+        t.category = category
     
-    Tasks.objects.bulk_update(tasks_qs, ['task_category'])
+    task_changes.touch(tasks)
+    Tasks.objects.bulk_update(tasks, ['category', 'updated_at'])
+    task_changes.record_task_changes(request.user.id, before, [task_changes.task_snapshot(t) for t in tasks])
     return {'updated_count': len(task_ids)}
@@ -1,34 +1,71 @@
 from django.shortcuts import get_object_or_404
-from datetime import date, timedelta
-from django.utils import timezone
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db import transaction
 from tasks.utils.apply_routines import apply_routines
+from tasks.utils.routine_materialization import routines_materialized
+from tasks.utils.user_time import user_today
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from ..models import Tasks
-from ..utils import tasks_managements_utils
+from ..utils import tasks_managements_utils, task_changes, task_search, task_suggestions
+from ..utils.categories import resolve_category
+from ..utils.cursor_pagination import paginate_by_cursor
+from ..utils.task_archive import TasksThenArchive, paginate_with_archive
+from ..utils.response_cache import cached_on_data_version
 from django.views.decorators.csrf import csrf_exempt
 
+TASKS_PER_PAGE = 20
+
+# one page of tasks, by cursor when the client sends one (empty for the first page), else by page number
+# archived_qs, when given, is listed after the tasks and only read by the pages past them
+def _paginate_tasks(request, user_tasks_qs, total, archived_qs=None):
+    if 'cursor' in request.GET:
+        if archived_qs is None:
+            page_tasks, next_cursor, prev_cursor = paginate_by_cursor(
+                user_tasks_qs, tasks_managements_utils.TASKS_ORDERING, request.GET.get('cursor'), TASKS_PER_PAGE
+            )
+        else:
+            page_tasks, next_cursor, prev_cursor = paginate_with_archive(
+                user_tasks_qs, archived_qs, tasks_managements_utils.TASKS_ORDERING, request.GET.get('cursor'), TASKS_PER_PAGE
+            )
+        return page_tasks, {
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+            "per_page": TASKS_PER_PAGE,
+            "total": total,
+        }
+
+    if archived_qs is not None:
+        user_tasks_qs = TasksThenArchive(user_tasks_qs, archived_qs)
+    paginator = Paginator(user_tasks_qs, TASKS_PER_PAGE)
+    page_num = request.GET.get('page', 1)
+    try:
+        page_obj = paginator.page(page_num)
+    except (PageNotAnInteger, EmptyPage):
+        page_obj = paginator.page(1)
+
+    return page_obj.object_list, {
+        "page": page_obj.number,
+        "num_pages": paginator.num_pages,
+        "per_page": paginator.per_page,
+        "total": paginator.count,
+    }
+
 #the user today_tasks function
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_on_data_version
 def today_tasks(request):
-    today = date.today()
-    apply_routines(request, today)
+    today = user_today(request.user)
+    if not routines_materialized(today):
+        apply_routines(request, today)
 
-    user_tasks_qs = Tasks.objects.filter(
-        created_by=request.user
-    ).filter(
-        Q(due_date__date=today) |
-        Q(due_date__date__lt=today, status=False)
-    ).order_by('status', 'due_date').all()
+    user_tasks_qs = tasks_managements_utils.today_tasks_queryset(request.user, today)
 
-    tasks_list = [tasks_managements_utils.serialize_task(t) for t in user_tasks_qs]
-    completed_tasks_count = user_tasks_qs.filter(status=True).count()
-    total_number_tasks = user_tasks_qs.count()
+    tasks_list = [tasks_managements_utils.serialize_task_row(t) for t in user_tasks_qs.values(*tasks_managements_utils.TASK_FIELDS)]
+    total_number_tasks, completed_tasks_count, pending_tasks = tasks_managements_utils.tasks_count("today-tasks", request)
 
     response_data = {
         'success': True,
@@ -36,90 +73,147 @@ def today_tasks(request):
         "user_tasks": tasks_list,
         "total_number_tasks": total_number_tasks,
         "completed_tasks_count": completed_tasks_count,
-        "pending_tasks": total_number_tasks - completed_tasks_count,
+        "pending_tasks": pending_tasks,
     }
     return Response(response_data, status=status.HTTP_200_OK)
 
 #the user all_tasks function
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_on_data_version
 def all_tasks(request):
-    user_tasks_qs = Tasks.objects.filter(created_by=request.user).order_by('status', 'due_date').all()
+    user_tasks_qs = tasks_managements_utils.all_tasks_queryset(request.user)
+    # include_archived=true lists the archived tasks after the others
+    archived_qs = None
+    if request.GET.get('include_archived', '').lower() in ('true', '1', 'yes'):
+        archived_qs = tasks_managements_utils.archived_tasks_queryset(request.user).values(
+            *tasks_managements_utils.ARCHIVED_TASK_FIELDS
+        )
 
-    paginator = Paginator(user_tasks_qs, 20)
-    page_num = request.GET.get('page', 1)
-    try:
-        page_obj = paginator.page(page_num)
-    except (PageNotAnInteger, EmptyPage):
-        page_obj = paginator.page(1)
+    # the counts include the archived tasks either way
+    total_number_tasks, completed_tasks_count, pending_tasks = tasks_managements_utils.tasks_count("all", request)
+    page_tasks, pagination = _paginate_tasks(
+        request, user_tasks_qs.values(*tasks_managements_utils.TASK_FIELDS), total_number_tasks, archived_qs
+    )
 
-    tasks_list = [tasks_managements_utils.serialize_task(t) for t in page_obj.object_list]
-    completed_tasks_count = user_tasks_qs.filter(status=True).count()
-    total_number_tasks = user_tasks_qs.count()
+    tasks_list = [tasks_managements_utils.serialize_task_row(t) for t in page_tasks]
 
     response_data = {
         "success": True,
         "username": request.user.username,
         "user_tasks": tasks_list,
-        "pagination": {
-            "page": page_obj.number,
-            "num_pages": paginator.num_pages,
-            "per_page": paginator.per_page,
-            "total": paginator.count,
-        },
+        "pagination": pagination,
         "total_number_tasks": total_number_tasks,
         "completed_tasks_count": completed_tasks_count,
-        "pending_tasks": total_number_tasks - completed_tasks_count,
+        "pending_tasks": pending_tasks,
     }
     return Response(response_data, status=status.HTTP_200_OK)
 
 #the next_week_tasks function
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_on_data_version
 def next_week_tasks(request):
-    today = date.today()
-    apply_routines(request, today)
-    week_later = today + timedelta(days=7)
+    today = user_today(request.user)
+    if not routines_materialized(today):
+        apply_routines(request, today)
 
-    user_tasks_qs = Tasks.objects.filter(
-        created_by=request.user,
-        due_date__date__gte=today,
-        due_date__date__lte=week_later
-    ).order_by('status', 'due_date').all()
+    user_tasks_qs = tasks_managements_utils.next_week_tasks_queryset(request.user, today)
 
-    paginator = Paginator(user_tasks_qs, 20)
-    page_num = request.GET.get('page', 1)
-    try:
-        page_obj = paginator.page(page_num)
-    except (PageNotAnInteger, EmptyPage):
-        page_obj = paginator.page(1)
+    total_number_tasks, completed_tasks_count, pending_tasks = tasks_managements_utils.tasks_count("next-week", request)
+    page_tasks, pagination = _paginate_tasks(request, user_tasks_qs.values(*tasks_managements_utils.TASK_FIELDS), total_number_tasks)
 
-    tasks_list = [tasks_managements_utils.serialize_task(t) for t in page_obj.object_list]
-    completed_tasks_count = user_tasks_qs.filter(status=True).count()
-    total_number_tasks = user_tasks_qs.count()
+    tasks_list = [tasks_managements_utils.serialize_task_row(t) for t in page_tasks]
 
     response_data = {
         "success": True,
         "username": request.user.username,
         "user_tasks": tasks_list,
-        "pagination": {
-            "page": page_obj.number,
-            "num_pages": paginator.num_pages,
-            "per_page": paginator.per_page,
-            "total": paginator.count,
-        },
+        "pagination": pagination,
         "total_number_tasks": total_number_tasks,
         "completed_tasks_count": completed_tasks_count,
-        "pending_tasks": total_number_tasks - completed_tasks_count,
+        "pending_tasks": pending_tasks,
     }
     return Response(response_data, status=status.HTTP_200_OK)
 
+#search the user's tasks by title and details, best match first, paginated by cursor
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@cached_on_data_version
+def search_tasks(request):
+    text = request.GET.get('q', '').strip()
+    if not text or len(text) > task_search.MAX_QUERY_LENGTH:
+        return Response(
+            {'success': False, 'error': f'q is required, up to {task_search.MAX_QUERY_LENGTH} characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # optional filters: status=completed|pending and category=<name>
+    status_filter = request.GET.get('status')
+    if status_filter not in (None, 'completed', 'pending'):
+        return Response(
+            {'success': False, 'error': 'status must be completed or pending'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    task_status = None if status_filter is None else status_filter == 'completed'
+
+    cursor = None
+    if request.GET.get('cursor'):
+        cursor = task_search.decode_search_cursor(request.GET['cursor'])
+        if cursor is None:
+            return Response({'success': False, 'error': 'invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows, next_cursor = task_search.search_tasks(
+        request.user.id,
+        text,
+        tasks_managements_utils.TASK_FIELDS,
+        task_status=task_status,
+        category=request.GET.get('category'),
+        cursor=cursor,
+    )
+
+    return Response({
+        "success": True,
+        "username": request.user.username,
+        "user_tasks": [
+            {**tasks_managements_utils.serialize_task_row(row), "rank": row["rank"]}
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+        "per_page": task_search.SEARCH_PAGE_SIZE,
+    }, status=status.HTTP_200_OK)
+
+#suggest the user's own task titles or categories for what was typed so far
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def autocomplete(request):
+    text = request.GET.get('q', '').strip()
+    field = request.GET.get('field', 'title')
+    if not text or len(text) > task_suggestions.MAX_PREFIX_LENGTH:
+        return Response(
+            {'success': False, 'error': f'q is required, up to {task_suggestions.MAX_PREFIX_LENGTH} characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if field not in task_suggestions.SUGGESTION_FIELDS:
+        return Response(
+            {'success': False, 'error': 'field must be title or category'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = int(request.GET.get('limit', task_suggestions.DEFAULT_SUGGESTIONS))
+    except ValueError:
+        limit = task_suggestions.DEFAULT_SUGGESTIONS
+    limit = min(max(limit, 1), task_suggestions.MAX_SUGGESTIONS)
+
+    suggestions = task_suggestions.suggest(request.user.id, field, text, limit)
+    return Response({"success": True, "field": field, "suggestions": suggestions}, status=status.HTTP_200_OK)
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_task(request):
     try:
-        today = timezone.now().date()
+        today = user_today(request.user)
 
         url_call = request.data.get("url_call", "all")
         task_title = request.data.get("task_title")
@@ -128,13 +222,15 @@ def add_task(request):
         task_category = request.data.get("task_category", "general")
         due_date = tasks_managements_utils._parse_date_input(due_date_raw) or today
 
-        task = Tasks.objects.create(
-            task_title=task_title,
-            task_details=task_details,
-            due_date=due_date,
-            created_by=request.user,
-            task_category=task_category
-        )
+        with transaction.atomic():
+            task = Tasks.objects.create(
+                task_title=task_title,
+                task_details=task_details,
+                due_date=due_date,
+                created_by=request.user,
+                category=resolve_category(request.user.id, task_category),
+            )
+            task_changes.record_task_changes(request.user.id, after=[task_changes.task_snapshot(task)])
 
         task_data = tasks_managements_utils.serialize_task(task)
 
@@ -162,21 +258,26 @@ def add_task(request):
 def update_task(request, task_id):
     try:
         url_call = request.data.get("url_call", "all")
-        task = get_object_or_404(Tasks, id=task_id, created_by=request.user)
 
-        task_title = request.data.get("task_title", task.task_title)
-        task_details = request.data.get("task_details", task.task_details)
-        due_date_raw = request.data.get("due_date", None)
-        task_category = request.data.get("task_category", "general")
-    
-        task.task_title = task_title
-        task.task_details = task_details
-        task.task_category = task_category
-        if due_date_raw is not None:
-            parsed = tasks_managements_utils._parse_date_input(due_date_raw)
-            task.due_date = parsed
+        with transaction.atomic():
+            # locked so a concurrent write can't change it between the snapshot and the save
+            task = get_object_or_404(Tasks.objects.select_for_update(), id=task_id, created_by=request.user)
+            before = task_changes.task_snapshot(task)
 
-        task.save()
+            task_title = request.data.get("task_title", task.task_title)
+            task_details = request.data.get("task_details", task.task_details)
+            due_date_raw = request.data.get("due_date", None)
+            task_category = request.data.get("task_category", "general")
+
+            task.task_title = task_title
+            task.task_details = task_details
+            task.category = resolve_category(request.user.id, task_category)
+            if due_date_raw is not None:
+                parsed = tasks_managements_utils._parse_date_input(due_date_raw)
+                task.due_date = parsed
+
+            task.save()
+            task_changes.record_task_changes(request.user.id, [before], [task_changes.task_snapshot(task)])
 
         task_data = tasks_managements_utils.serialize_task(task)
 
@@ -219,13 +320,20 @@ def multiple_update_task_dates(request):
                             status=status.HTTP_404_NOT_FOUND)
 
         due_date_raw = request.data.get("due_date", None)
-        if due_date_raw is not None:
+        if due_date_raw is None:
+            tasks = list(tasks_qs)
+        else:
             parsed = tasks_managements_utils._parse_date_input(due_date_raw)
-            for t in tasks_qs:
-                t.due_date = parsed
-            Tasks.objects.bulk_update(tasks_qs, ['due_date'])
-
-        tasks_data = [tasks_managements_utils.serialize_task(t) for t in tasks_qs]
+            with transaction.atomic():
+                tasks = list(tasks_qs.select_for_update().order_by('id'))
+                before = [task_changes.task_snapshot(t) for t in tasks]
+                for t in tasks:
+                    t.due_date = parsed
+                task_changes.touch(tasks)
+                Tasks.objects.bulk_update(tasks, ['due_date', 'updated_at'])
+                task_changes.record_task_changes(request.user.id, before, [task_changes.task_snapshot(t) for t in tasks])
+
+        tasks_data = tasks_managements_utils.serialize_tasks(tasks)
         total, completed, pending = tasks_managements_utils.tasks_count(url_call, request)
 
         return Response({
@@ -263,11 +371,17 @@ def multiple_update_task_category(request):
             return Response({"error": "task_category is required", "success": False},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        for t in tasks_qs:
-            t.task_category = task_category
-        Tasks.objects.bulk_update(tasks_qs, ['task_category'])
-
-        tasks_data = [tasks_managements_utils.serialize_task(t) for t in tasks_qs]
+        with transaction.atomic():
+            tasks = list(tasks_qs.select_for_update().order_by('id'))
+            before = [task_changes.task_snapshot(t) for t in tasks]
+            category = resolve_category(request.user.id, task_category)
+            for t in tasks:
+                t.category = category
+            task_changes.touch(tasks)
+            Tasks.objects.bulk_update(tasks, ['category', 'updated_at'])
+            task_changes.record_task_changes(request.user.id, before, [task_changes.task_snapshot(t) for t in tasks])
+
+        tasks_data = tasks_managements_utils.serialize_tasks(tasks)
         total, completed, pending = tasks_managements_utils.tasks_count(url_call, request)
 
         return Response({
@@ -285,10 +399,13 @@ def multiple_update_task_category(request):
 @permission_classes([IsAuthenticated])
 def delete_task(request, task_id):
     try:
-        task = get_object_or_404(Tasks, id=task_id, created_by=request.user)
         url_call = request.data.get("url_call", "all")
 
-        task.delete()
+        with transaction.atomic():
+            task = get_object_or_404(Tasks.objects.select_for_update(), id=task_id, created_by=request.user)
+            before = task_changes.task_snapshot(task)
+            task.delete()
+            task_changes.record_task_changes(request.user.id, before=[before])
         total, completed, pending = tasks_managements_utils.tasks_count(url_call, request)
         return Response({
             "success": True,
@@ -315,7 +432,10 @@ def multiple_delete_task(request):
                             status=status.HTTP_400_BAD_REQUEST)
         tasks_qs = Tasks.objects.filter(id__in=task_ids, created_by=request.user)
 
-        tasks_qs.delete()
+        with transaction.atomic():
+            before = task_changes.queryset_snapshots(tasks_qs.select_for_update())
+            tasks_qs.delete()
+            task_changes.record_task_changes(request.user.id, before=before)
         total, completed, pending = tasks_managements_utils.tasks_count(url_call, request)
         return Response({
             "success": True,
@@ -333,10 +453,14 @@ def multiple_delete_task(request):
 def task_complete(request, task_id):
     try:
         url_call = request.data.get("url_call", "all")
-        task = get_object_or_404(Tasks, id=task_id, created_by=request.user)
-        task.status = not task.status  # simplified toggle
-        task.done_date = timezone.now().date() if task.status else None
-        task.save()
+        with transaction.atomic():
+            # locked, two toggles at once must not both read the same status
+            task = get_object_or_404(Tasks.objects.select_for_update(), id=task_id, created_by=request.user)
+            before = task_changes.task_snapshot(task)
+            task.status = not task.status  # simplified toggle
+            task.done_date = user_today(request.user) if task.status else None
+            task.save()
+            task_changes.record_task_changes(request.user.id, [before], [task_changes.task_snapshot(task)])
 
         task_data = tasks_managements_utils.serialize_task(task)
         total, completed, pending = tasks_managements_utils.tasks_count(url_call, request)
@@ -360,14 +484,20 @@ def multiple_task_complete(request):
         if not isinstance(task_ids, list):
             return Response({"error": "task_ids should be a list of IDs", "success": False},
                             status=status.HTTP_400_BAD_REQUEST)
-        tasks_qs = Tasks.objects.filter(id__in=task_ids, created_by=request.user)
-        
-        for t in tasks_qs:
-            t.status = not t.status
-            t.done_date = timezone.now().date() if t.status else None
-        
-        Tasks.objects.bulk_update(tasks_qs, ['status', 'done_date'])
-        tasks_data = [tasks_managements_utils.serialize_task(t) for t in tasks_qs]
+        today = user_today(request.user)
+
+        with transaction.atomic():
+            tasks = list(
+                Tasks.objects.filter(id__in=task_ids, created_by=request.user).select_for_update().order_by('id')
+            )
+            before = [task_changes.task_snapshot(t) for t in tasks]
+            for t in tasks:
+                t.status = not t.status
+                t.done_date = today if t.status else None
+            task_changes.touch(tasks)
+            Tasks.objects.bulk_update(tasks, ['status', 'done_date', 'updated_at'])
+            task_changes.record_task_changes(request.user.id, before, [task_changes.task_snapshot(t) for t in tasks])
+        tasks_data = tasks_managements_utils.serialize_tasks(tasks)
         total, completed, pending = tasks_managements_utils.tasks_count(url_call, request)
         return Response({
             "success": True,
@@ -0,0 +1,30 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from ..utils.categories import clean_category_name
+from ..utils.daily_stats import STATS_PERIODS, ensure_daily_stats, stats_series
+from ..utils.response_cache import cached_on_data_version
+from ..utils.user_time import user_today
+
+#the created, completed and overdue tasks of the last week or month (per day) or year (per month)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@cached_on_data_version
+def task_stats(request):
+    period = request.query_params.get('period', 'week')
+    if period not in STATS_PERIODS:
+        return Response(
+            {'error': f"period must be one of {', '.join(STATS_PERIODS)}", 'success': False},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    category = clean_category_name(request.query_params.get('category')) or None
+
+    ensure_daily_stats(request.user.id)
+    stats = stats_series(request.user.id, period, user_today(request.user), category)
+    return Response({
+        "success": True,
+        "username": request.user.username,
+        "period": period,
+        **stats,
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,40 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from ...utils.task_archive import archivable_tasks, archive_age, archive_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the completed tasks done and due more than TASK_ARCHIVE_AFTER_DAYS ago to the "
+        "archive, in id ranges, one transaction per range"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='archive the tasks older than this (default TASK_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='task ids per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='count the tasks to archive without moving them')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 1:
+            raise CommandError("--days must be at least 1")
+        age = timedelta(days=options['days']) if options['days'] is not None else archive_age()
+        cutoff = timezone.now() - age
+        tasks = archivable_tasks(cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f"{tasks.count()} task(s) completed and due before {cutoff:%Y-%m-%d} would be archived")
+            return
+
+        bounds = tasks.aggregate(first=Min('id'), last=Max('id'))
+        archived = 0
+        if bounds['first'] is not None:
+            chunk_size = options['chunk_size']
+            # by id range, so every transaction locks and moves a bounded set of rows
+            for first_id in range(bounds['first'], bounds['last'] + 1, chunk_size):
+                archived += archive_tasks(tasks.filter(id__gte=first_id, id__lt=first_id + chunk_size))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} task(s) completed and due before {cutoff:%Y-%m-%d}"
+        ))
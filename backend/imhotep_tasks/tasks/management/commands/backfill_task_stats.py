@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...models import TaskCounters, User
+from ...utils.daily_stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the daily task stats of the users whose history isn't rolled up yet "
+        "(or of every user with --rebuild), one user per transaction"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='only build the stats of this username')
+        parser.add_argument('--rebuild', action='store_true', help='also rebuild the users already built')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options.get('user'):
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f"User {options['user']} not found")
+
+        user_ids = users.values_list('id', flat=True)
+        if not options['rebuild']:
+            built = TaskCounters.objects.filter(daily_stats_built=True).values('user_id')
+            user_ids = user_ids.exclude(id__in=built)
+
+        built_count = 0
+        for user_id in list(user_ids):
+            rebuild_daily_stats(user_id)
+            built_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Built the daily task stats of {built_count} user(s)"))
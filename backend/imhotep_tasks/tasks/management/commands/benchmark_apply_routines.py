@@ -0,0 +1,90 @@
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from ...models import Routines, User
+from ...utils.apply_routines import apply_user_routines
+from ...utils.routine_schedule import DAY_NAMES
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure apply_routines for users with many routines: queries and time of the first "
+        "application of a day and of the repeated (page view) calls. Everything it creates is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routines', type=int, default=200, help='routines per user')
+        parser.add_argument('--users', type=int, default=1, help='users to benchmark')
+        parser.add_argument('--days', type=int, default=7, help='consecutive days to apply')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['routines'], options['users'], options['days'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, routine_count, user_count, days):
+        users = [
+            User.objects.create(username=f'benchmark-apply-routines-{index}')
+            for index in range(user_count)
+        ]
+        routines = []
+        for user in users:
+            for index in range(routine_count):
+                routine_type = ('weekly', 'monthly', 'yearly')[index % 3]
+                if routine_type == 'weekly':
+                    routine_dates = DAY_NAMES[index % 7:] + DAY_NAMES[:index % 3]
+                elif routine_type == 'monthly':
+                    routine_dates = [str(day) for day in range(1 + index % 4, 32, 4)]
+                else:
+                    routine_dates = [
+                        (date(2024, 1, 1) + timedelta(days=offset)).strftime('%m-%d')
+                        for offset in range(index % 5, 366, 5)
+                    ]
+                routines.append(Routines(
+                    routines_title=f'Routine {index}',
+                    routine_type=routine_type,
+                    routines_dates=routine_dates,
+                    created_by=user,
+                ))
+        for routine in routines:
+            routine.compile_schedule()
+        Routines.objects.bulk_create(routines)
+        Routines.store_yearly_days(routines)
+
+        first_queries = first_time = repeat_queries = repeat_time = created = 0
+        start = date.today()
+        for offset in range(days):
+            target_date = start + timedelta(days=offset)
+            for user in users:
+                queries, elapsed, tasks = self._measure(user, target_date)
+                first_queries += queries
+                first_time += elapsed
+                created += len(tasks)
+
+                queries, elapsed, _ = self._measure(user, target_date)
+                repeat_queries += queries
+                repeat_time += elapsed
+
+        runs = days * user_count
+        self.stdout.write(f"{user_count} user(s) x {routine_count} routines x {days} day(s), {created} tasks created")
+        self.stdout.write(self.style.SUCCESS(
+            f"first apply of a day: {first_queries / runs:.1f} queries, {first_time / runs * 1000:.1f} ms per user"
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f"repeated apply:       {repeat_queries / runs:.1f} queries, {repeat_time / runs * 1000:.1f} ms per user"
+        ))
+
+    def _measure(self, user, target_date):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            tasks = apply_user_routines(user, target_date)
+        return len(queries), time.perf_counter() - started, tasks
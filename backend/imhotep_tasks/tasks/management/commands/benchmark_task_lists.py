@@ -0,0 +1,142 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from ...models import Category, Routines, Tasks, User
+from ...utils.data_version import bump_data_version
+from ...utils.routines_utils import ROUTINE_FIELDS, serialize_routine_row
+from ...utils.task_filters import day_start
+from ...utils.tasks_managements_utils import TASK_FIELDS, serialize_task_row, today_tasks_queryset
+from ...utils.user_time import user_today
+
+# the list endpoints measured, by name
+LIST_URLS = {
+    'today_tasks': '/api/tasks/today_tasks/',
+    'next_week_tasks': '/api/tasks/next_week_tasks/',
+    'all_tasks': '/api/tasks/all_tasks/',
+    'routines': '/api/routines/',
+}
+
+# a host ALLOWED_HOSTS accepts, the test client's 'testserver' isn't one
+HOST = 'localhost'
+
+
+class _Rollback(Exception):
+    pass
+
+
+# the serializers as they were before the projected rows: a model instance per row, and the
+# user row loaded for each of them to read its id
+def _serialize_task_before(task):
+    return {
+        "id": task.id,
+        "task_title": task.task_title,
+        "task_details": task.task_details,
+        "due_date": task.due_date.isoformat() if task.due_date else None,
+        "task_category": task.task_category or "",
+        "status": bool(task.status),
+        "done_date": task.done_date.isoformat() if task.done_date else None,
+        "created_by": getattr(task.created_by, "id", None),
+    }
+
+def _serialize_routine_before(routine):
+    return {
+        "id": routine.id,
+        "routines_title": routine.routines_title,
+        "routines_dates": routine.routines_dates,
+        "routine_type": routine.routine_type,
+        "routine_category": routine.routine_category or "general",
+        "status": routine.status,
+        "created_by": routine.created_by.id,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the task and routine serialization for a user with many tasks due today and many "
+        "routines, the model instance path before against the projected rows, then the queries and "
+        "time of the list endpoints. Everything it creates is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1000, help='tasks due today')
+        parser.add_argument('--routines', type=int, default=100, help='routines (inactive, so none is applied)')
+        parser.add_argument('--runs', type=int, default=5, help='runs per measure, the best one is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['tasks'], options['routines'], options['runs'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, task_count, routine_count, runs):
+        user = User.objects.create(username='benchmark-task-lists')
+        category = Category.objects.create(user=user, name='benchmark')
+        today = user_today(user)
+        Tasks.objects.bulk_create([
+            Tasks(task_title=f'Task {index}', created_by=user, category=category, due_date=day_start(today), status=index % 2 == 0)
+            for index in range(task_count)
+        ])
+        routines = [
+            Routines(routines_title=f'Routine {index}', created_by=user, category=category, status=False, routines_dates=['monday'])
+            for index in range(routine_count)
+        ]
+        for routine in routines:
+            routine.compile_schedule()
+        Routines.objects.bulk_create(routines)
+
+        self.stdout.write(f"{task_count} tasks due today, {routine_count} routines, best of {runs} run(s)")
+
+        # .all() in each run, so every run queries instead of reading a cached result
+        tasks = today_tasks_queryset(user, today)
+        user_routines = Routines.objects.filter(created_by=user).order_by('id')
+        self.stdout.write("serializing every row (before: model instances, after: projected rows)")
+        for name, before, after in (
+            (
+                'tasks',
+                lambda: [_serialize_task_before(task) for task in tasks.all()],
+                lambda: [serialize_task_row(row) for row in tasks.values(*TASK_FIELDS)],
+            ),
+            (
+                'routines',
+                lambda: [_serialize_routine_before(routine) for routine in user_routines.all()],
+                lambda: [serialize_routine_row(row) for row in user_routines.values(*ROUTINE_FIELDS)],
+            ),
+        ):
+            for label, serialize in (('before', before), ('after', after)):
+                queries, elapsed = self._best(serialize, runs)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{name:<16} {label:<6} {queries:>5} queries {elapsed * 1000:>8.1f} ms"
+                ))
+
+        client = APIClient()
+        client.force_authenticate(user)
+        self.stdout.write("list endpoints (first page, page cache bypassed)")
+        for name, url in LIST_URLS.items():
+            status_codes = set()
+
+            def get():
+                # a new data version, so the page cache can't answer
+                bump_data_version(user.id)
+                status_codes.add(client.get(url, HTTP_HOST=HOST).status_code)
+
+            queries, elapsed = self._best(get, runs)
+            if status_codes != {200}:
+                self.stderr.write(f"{name}: status {', '.join(map(str, sorted(status_codes)))}")
+                continue
+            self.stdout.write(self.style.SUCCESS(f"{name:<16} {queries:>12} queries {elapsed * 1000:>8.1f} ms"))
+
+    def _best(self, measured, runs):
+        """(queries, seconds) of the fastest of runs calls of measured"""
+        best = None
+        for _ in range(runs):
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                measured()
+            elapsed = time.perf_counter() - started
+            if best is None or elapsed < best[1]:
+                best = (len(queries), elapsed)
+        return best
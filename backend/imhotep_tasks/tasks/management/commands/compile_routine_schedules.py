@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...models import Routines
+from ...utils.routine_schedule import SCHEDULE_VERSION
+
+
+class Command(BaseCommand):
+    help = "Compile the schedule columns of the routines saved before they existed (or of all routines with --all)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='recompile every routine, not only the stale ones')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='routines compiled per transaction')
+
+    def handle(self, *args, **options):
+        routines = Routines.objects.order_by('id')
+        if not options['all']:
+            routines = routines.filter(schedule_version__lt=SCHEDULE_VERSION)
+
+        compiled = 0
+        last_id = 0
+        while True:
+            chunk = list(routines.filter(id__gt=last_id)[:options['chunk_size']])
+            if not chunk:
+                break
+            for routine in chunk:
+                routine.compile_schedule()
+            # a schedule compile isn't a change of the routine, updated_at stays as it is
+            with transaction.atomic():
+                Routines.objects.bulk_update(chunk, ['weekday_mask', 'monthday_mask', 'schedule_version'])
+                Routines.store_yearly_days(chunk)
+            compiled += len(chunk)
+            last_id = chunk[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Compiled the schedules of {compiled} routine(s)"))
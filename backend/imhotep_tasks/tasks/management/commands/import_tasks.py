@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...models import User
+from ...utils.task_import import IMPORT_FILE_TYPES, import_rows, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Import tasks and routines for a user from an NDJSON or CSV file (e.g. a tasks/export/ backup)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='the user the rows are imported for')
+        parser.add_argument('path', help='the NDJSON or CSV file to import')
+        parser.add_argument('--file-type', choices=IMPORT_FILE_TYPES, help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, help='rows inserted per bulk insert')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} not found")
+
+        path = options['path']
+        file_type = (options.get('file_type') or path.rsplit('.', 1)[-1]).lower()
+        if file_type not in IMPORT_FILE_TYPES:
+            raise CommandError("Can't tell the file type from the extension, pass --file-type")
+
+        with open(path, encoding='utf-8-sig', newline='') as lines:
+            report = import_rows(user, iter_rows(lines, file_type), options.get('batch_size'))
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        if report['errors_truncated']:
+            self.stderr.write(f"... and {report['failed_rows'] - len(report['errors'])} more failed rows")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {report['rows']} rows: {report['imported_tasks']} tasks and "
+            f"{report['imported_routines']} routines imported, {report['failed_rows']} rows failed"
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, Min
+from ...models import Tasks
+from ...utils.task_search import search_supported
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the search vector of the tasks written before the search trigger existed, "
+        "in id ranges (PostgreSQL only)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='task ids per update')
+
+    def handle(self, *args, **options):
+        if not search_supported():
+            self.stdout.write("Full-text search needs PostgreSQL, nothing to index")
+            return
+
+        bounds = Tasks.objects.filter(search_vector__isnull=True).aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write(self.style.SUCCESS("Every task is indexed for search"))
+            return
+
+        indexed = 0
+        chunk_size = options['chunk_size']
+        for first_id in range(bounds['first'], bounds['last'] + 1, chunk_size):
+            # rewriting the title fires the trigger, which computes the vector;
+            # nothing else changes, so updated_at stays as it is
+            indexed += Tasks.objects.filter(
+                id__gte=first_id, id__lt=first_id + chunk_size, search_vector__isnull=True
+            ).update(task_title=F('task_title'))
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} task(s) for search"))
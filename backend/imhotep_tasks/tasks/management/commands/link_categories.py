@@ -0,0 +1,65 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...models import Category, Routines, Tasks, User
+from ...utils.categories import clean_category_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the category names stored on tasks and routines before the Category table "
+        "into per-user Category rows, linking the tasks and routines to them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='users linked per transaction')
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+        chunk_size = options['chunk_size']
+        linked = 0
+
+        for start in range(0, len(user_ids), chunk_size):
+            with transaction.atomic():
+                linked += self._link_chunk(user_ids[start:start + chunk_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} task(s) and routine(s) to their category"))
+
+    def _link_chunk(self, user_ids):
+        # the legacy names still to move: (model, user column, legacy column) -> {(user_id, raw name)}
+        sources = (
+            (Tasks, 'created_by_id', 'task_category'),
+            (Routines, 'created_by_id', 'routine_category'),
+        )
+        pending = {}
+        for model, user_column, legacy_column in sources:
+            pending[model] = set(
+                model.objects.filter(**{f'{user_column}__in': user_ids, 'category__isnull': True})
+                .exclude(**{legacy_column: ''}).exclude(**{f'{legacy_column}__isnull': True})
+                .values_list(user_column, legacy_column).distinct()
+            )
+
+        names = defaultdict(set)
+        for pairs in pending.values():
+            for user_id, raw in pairs:
+                if clean_category_name(raw):
+                    names[user_id].add(clean_category_name(raw))
+        Category.objects.bulk_create(
+            [Category(user_id=user_id, name=name) for user_id, user_names in names.items() for name in user_names],
+            ignore_conflicts=True,
+        )
+        category_ids = {
+            (user_id, name): category_id
+            for category_id, user_id, name in Category.objects.filter(
+                user_id__in=names.keys(), name__in={name for user_names in names.values() for name in user_names}
+            ).values_list('id', 'user_id', 'name')
+        }
+
+        linked = 0
+        for model, user_column, legacy_column in sources:
+            for user_id, raw in pending[model]:
+                # a name that is only spaces has no category; it is emptied all the same
+                linked += model.objects.filter(
+                    **{user_column: user_id, 'category__isnull': True, legacy_column: raw}
+                ).update(category_id=category_ids.get((user_id, clean_category_name(raw))), **{legacy_column: ''})
+        return linked
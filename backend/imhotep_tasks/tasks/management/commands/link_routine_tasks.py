@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from ...models import Routines, Tasks, User
+
+ROUTINE_TYPES = ('weekly', 'monthly', 'yearly')
+
+
+class Command(BaseCommand):
+    help = (
+        "Link the tasks created by routines before tasks had a source routine, matching them by "
+        "title and the 'Created from <type> routine:' details, one task per routine and day"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='users linked per transaction')
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            User.objects.filter(routines__isnull=False).distinct().order_by('id').values_list('id', flat=True)
+        )
+        chunk_size = options['chunk_size']
+        linked = 0
+
+        for start in range(0, len(user_ids), chunk_size):
+            with transaction.atomic():
+                linked += self._link_chunk(user_ids[start:start + chunk_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} task(s) to their routine"))
+
+    def _link_chunk(self, user_ids):
+        # the first routine of a user with a title and type gets the tasks, like apply_routines used to
+        routine_ids = {}
+        for routine_id, user_id, title, routine_type in Routines.objects.filter(
+            created_by_id__in=user_ids
+        ).order_by('id').values_list('id', 'created_by_id', 'routines_title', 'routine_type'):
+            routine_ids.setdefault((user_id, title, routine_type), routine_id)
+
+        taken = set(
+            Tasks.objects.filter(created_by_id__in=user_ids, source_routine__isnull=False)
+            .values_list('source_routine_id', 'occurrence_date')
+        )
+
+        to_link = []
+        candidates = Tasks.objects.filter(
+            created_by_id__in=user_ids,
+            source_routine__isnull=True,
+            task_details__startswith="Created from ",
+        ).annotate(due_day=TruncDate('due_date')).order_by('id').values_list(
+            'id', 'created_by_id', 'task_title', 'task_details', 'due_day'
+        )
+        for task_id, user_id, title, details, due_day in candidates:
+            routine_type = next(
+                (t for t in ROUTINE_TYPES if details.startswith(f"Created from {t} routine:")), None
+            )
+            routine_id = routine_ids.get((user_id, title, routine_type))
+            # duplicates of a routine's day (from before the constraint) stay unlinked
+            if routine_id is None or (routine_id, due_day) in taken:
+                continue
+            taken.add((routine_id, due_day))
+            to_link.append(Tasks(id=task_id, source_routine_id=routine_id, occurrence_date=due_day))
+
+        Tasks.objects.bulk_update(to_link, ['source_routine', 'occurrence_date'], batch_size=1000)
+        return len(to_link)
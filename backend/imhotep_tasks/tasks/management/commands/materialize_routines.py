@@ -0,0 +1,89 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from ...models import RoutineMaterialization
+from ...utils.routine_materialization import MATERIALIZED_KEY, materialize_range, user_id_ranges
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the routine tasks of every user for a day, in user id ranges spread over a process pool. "
+        "Run it every night right after midnight (e.g. from cron); an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='the day to materialize, YYYY-MM-DD (defaults to today in TIME_ZONE)')
+        parser.add_argument('--workers', type=int, default=1, help='worker processes (1 runs in this process)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='user ids per range, for a new run')
+        parser.add_argument('--restart', action='store_true', help='start over even if the day was done')
+
+    def handle(self, *args, **options):
+        try:
+            target_date = date.fromisoformat(options['date']) if options.get('date') else timezone.localdate()
+        except ValueError:
+            raise CommandError(f"Invalid date: {options['date']}")
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("--workers and --chunk-size must be at least 1")
+
+        run, created = RoutineMaterialization.objects.get_or_create(
+            target_date=target_date, defaults={'chunk_size': options['chunk_size']}
+        )
+        if not created and options['restart']:
+            run.chunks.all().delete()
+            run.chunk_size = options['chunk_size']
+            run.started_at = timezone.now()
+            run.finished_at = None
+            run.save()
+        elif run.finished_at is not None:
+            self.stdout.write(self.style.SUCCESS(f"Routines for {target_date} were materialized at {run.finished_at}"))
+            return
+        elif not created:
+            self.stdout.write(f"Resuming the run for {target_date} (user id ranges of {run.chunk_size})")
+
+        done = set(run.chunks.values_list('first_user_id', flat=True))
+        ranges = [r for r in user_id_ranges(run.chunk_size) if r[0] not in done]
+        self.stdout.write(f"{len(ranges)} user id range(s) to materialize, {len(done)} already done")
+
+        failed = self._materialize(run, target_date, ranges, options['workers'])
+        if failed:
+            raise CommandError(f"{failed} range(s) failed, run the command again to resume")
+
+        run.finished_at = timezone.now()
+        run.save(update_fields=['finished_at'])
+        cache.delete(MATERIALIZED_KEY.format(date=target_date))
+        self.stdout.write(self.style.SUCCESS(f"Routines for {target_date} materialized"))
+
+    def _materialize(self, run, target_date, ranges, workers):
+        failed = 0
+        if workers == 1:
+            for first_id, last_id in ranges:
+                try:
+                    self._report(first_id, last_id, materialize_range(run.id, target_date, first_id, last_id))
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"users {first_id}-{last_id}: {e}")
+            return failed
+
+        # the forked workers must not share this process's database connections, each opens its own
+        connections.close_all()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {
+                pool.submit(materialize_range, run.id, target_date, first_id, last_id): (first_id, last_id)
+                for first_id, last_id in ranges
+            }
+            for future in as_completed(futures):
+                first_id, last_id = futures[future]
+                try:
+                    self._report(first_id, last_id, future.result())
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"users {first_id}-{last_id}: {e}")
+        return failed
+
+    def _report(self, first_id, last_id, result):
+        users, tasks_created = result
+        self.stdout.write(f"users {first_id}-{last_id}: {users} user(s), {tasks_created} task(s) created")
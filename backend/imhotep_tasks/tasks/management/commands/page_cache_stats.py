@@ -0,0 +1,35 @@
+from importlib import import_module
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...utils.response_cache import page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show the hit/miss counters of the per-user page cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        # importing the URLconf imports every view, which registers the cached ones
+        import_module(settings.ROOT_URLCONF)
+
+        total_hits = total_misses = 0
+        for view_name, stats in page_cache_stats().items():
+            hits, misses = stats['hits'], stats['misses']
+            total_hits += hits
+            total_misses += misses
+            self.stdout.write(f"{view_name}: {hits} hits, {misses} misses{self._ratio(hits, misses)}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"total: {total_hits} hits, {total_misses} misses{self._ratio(total_hits, total_misses)}"
+        ))
+
+        if options['reset']:
+            reset_page_cache_stats()
+            self.stdout.write("Counters reset")
+
+    def _ratio(self, hits, misses):
+        if not hits + misses:
+            return ""
+        return f" ({hits / (hits + misses):.1%} hit rate)"
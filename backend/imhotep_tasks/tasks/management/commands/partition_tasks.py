@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from ...utils.task_partitions import partitioning_supported, rebuild_tasks_table, tasks_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Hash partition the Tasks table by user in --partitions partitions, or turn it back into "
+        "a plain table with --revert (PostgreSQL only). The table is locked while its rows are copied, "
+        "and afterwards every unique constraint and index added to Tasks must include created_by"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, help='number of partitions, at least 2')
+        parser.add_argument('--revert', action='store_true', help='turn the table back into a plain table')
+
+    def handle(self, *args, **options):
+        if options['partitions'] is None and not options['revert']:
+            raise CommandError("Pass --partitions N to partition the Tasks table or --revert to undo it")
+        if options['partitions'] is not None and options['revert']:
+            raise CommandError("--partitions and --revert can't be used together")
+        if not partitioning_supported():
+            self.stdout.write("Partitioning needs PostgreSQL, nothing to do")
+            return
+
+        if options['revert']:
+            partitions = 0
+        else:
+            partitions = options['partitions']
+            if partitions < 2:
+                raise CommandError("--partitions must be at least 2")
+
+        with connection.cursor() as cursor:
+            current = tasks_partitions(cursor)
+        if current == partitions:
+            self.stdout.write(self.style.SUCCESS(
+                f"The Tasks table already has {partitions} partitions" if partitions else "The Tasks table isn't partitioned"
+            ))
+            return
+
+        try:
+            rebuild_tasks_table(partitions)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Partitioned the Tasks table by user in {partitions} partitions" if partitions
+            else "Turned the Tasks table back into a plain table"
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...utils.token_blacklist import expired_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the expired refresh tokens from the outstanding token list, "
+        "with their blacklist entries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='tokens deleted per statement')
+        parser.add_argument('--dry-run', action='store_true', help='only count the expired tokens')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['dry_run']:
+            self.stdout.write(f"{expired_tokens(now).count()} expired tokens")
+            return
+
+        deleted = blacklisted = 0
+        # delete in chunks by id so no statement holds locks on the whole table
+        while True:
+            ids = list(expired_tokens(now).order_by('expires_at').values_list('id', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            _, counts = expired_tokens(now).filter(id__in=ids).delete()
+            deleted += counts.get('token_blacklist.OutstandingToken', 0)
+            blacklisted += counts.get('token_blacklist.BlacklistedToken', 0)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} expired tokens ({blacklisted} blacklisted) expired before {now:%Y-%m-%d %H:%M}"
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...models import Tombstone, ProcessedMutation
+from ...utils.delta_sync import tombstone_retention
+from ...utils.idempotency import processed_mutation_ttl
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS and the stored "
+        "mutation results older than SYNC_PROCESSED_MUTATION_TTL_DAYS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='rows deleted per statement')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        for model, date_field, max_age in (
+            (Tombstone, 'deleted_at', tombstone_retention()),
+            (ProcessedMutation, 'created_at', processed_mutation_ttl()),
+        ):
+            cutoff = now - max_age
+            deleted = self._prune(model, date_field, cutoff, options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Deleted {deleted} {model._meta.verbose_name_plural} older than {cutoff:%Y-%m-%d %H:%M}"
+            ))
+
+    def _prune(self, model, date_field, cutoff, chunk_size):
+        deleted = 0
+        # delete in chunks by id so no statement holds locks on the whole table
+        while True:
+            ids = list(
+                model.objects.filter(**{f'{date_field}__lt': cutoff})
+                .order_by(date_field)
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return deleted
+            deleted += model.objects.filter(id__in=ids).delete()[0]
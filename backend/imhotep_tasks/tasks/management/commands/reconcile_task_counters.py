@@ -0,0 +1,86 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ...models import TaskCounters, User
+from ...utils.task_counters import COUNTER_FIELDS, count_tasks
+from ...utils.user_time import user_today
+
+
+class Command(BaseCommand):
+    help = "Recount every user's task counters from the Tasks table and repair any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='only reconcile this username')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='users recounted per grouped query')
+        parser.add_argument('--dry-run', action='store_true', help='report drift without repairing it')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options.get('user'):
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f"User {options['user']} not found")
+
+        user_ids = list(users.values_list('id', flat=True))
+        chunk_size = options['chunk_size']
+        drifted = 0
+
+        for start in range(0, len(user_ids), chunk_size):
+            drifted += self._reconcile_chunk(user_ids[start:start + chunk_size], options['dry_run'])
+
+        verb = "would be repaired" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {len(user_ids)} user(s), {drifted} counter row(s) {verb}"
+        ))
+
+    def _reconcile_chunk(self, user_ids, dry_run):
+        # the day buckets are counted for each user's own today, one grouped query per distinct day
+        todays = {user.id: user_today(user) for user in User.objects.filter(id__in=user_ids).only('id', 'timezone')}
+        users_by_day = defaultdict(list)
+        for user_id, today in todays.items():
+            users_by_day[today].append(user_id)
+
+        with transaction.atomic():
+            # lock the rows first so live writes wait until the recount is stored
+            existing = {
+                c.user_id: c
+                for c in TaskCounters.objects.select_for_update().filter(user_id__in=user_ids)
+            }
+            actual = {}
+            for today, day_user_ids in users_by_day.items():
+                actual.update(count_tasks(day_user_ids, today))
+
+            to_create, to_update = [], []
+            drifted = 0
+            for user_id in user_ids:
+                today = todays[user_id]
+                counts = actual.get(user_id, {})
+                expected = {field: counts.get(field, 0) for field in COUNTER_FIELDS}
+                counters = existing.get(user_id)
+
+                if counters is None:
+                    to_create.append(TaskCounters(user_id=user_id, bucket_date=today, **expected))
+                    continue
+
+                # day buckets counted for another day are stale, not drifted
+                compared = COUNTER_FIELDS if counters.bucket_date == today else ('total', 'completed')
+                drift = [
+                    f"{field} {getattr(counters, field)} -> {expected[field]}"
+                    for field in compared
+                    if getattr(counters, field) != expected[field]
+                ]
+                if drift:
+                    drifted += 1
+                    self.stdout.write(f"user {user_id}: {', '.join(drift)}")
+
+                if drift or counters.bucket_date != today:
+                    for field, value in expected.items():
+                        setattr(counters, field, value)
+                    counters.bucket_date = today
+                    to_update.append(counters)
+
+            if not dry_run:
+                TaskCounters.objects.bulk_create(to_create)
+                TaskCounters.objects.bulk_update(to_update, list(COUNTER_FIELDS) + ['bucket_date'])
+
+        return drifted
@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
 from django.utils import timezone
+from .utils.routine_schedule import SCHEDULE_VERSION, compile_schedule
+from .utils.user_time import validate_timezone
 
 #a class to define a table to save the poll questions in them
 class Tasks(models.Model):
@@ -18,7 +21,13 @@ class Tasks(models.Model):
     # the date where this poll was created
     creation_date = models.DateTimeField(auto_now_add=True)
 
-    # task category (optional)
+    # the category of the task (optional), its name is read through the Category row
+    category = models.ForeignKey(
+        'Category', on_delete=models.SET_NULL, null=True, blank=True, default=None, related_name='tasks'
+    )
+
+    # the category name as it was stored before the Category table, only read by the
+    # link_categories command, which moves it to category and empties it
     task_category = models.CharField(max_length=200, null=True, blank=True, default='')
 
     # the date where this tasks is due by (optional)
@@ -29,6 +38,56 @@ class Tasks(models.Model):
 
     done_date = models.DateTimeField(null=True, blank=True, default=None)
 
+    # the last time the task was written, the delta sync pull reads the changes from it
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    # the routine that created the task and the day it was created for (see utils/apply_routines.py)
+    source_routine = models.ForeignKey(
+        'Routines', on_delete=models.SET_NULL, null=True, blank=True, default=None, related_name='generated_tasks'
+    )
+    occurrence_date = models.DateField(null=True, blank=True, default=None)
+
+    # the words of the title and details, filled by a PostgreSQL trigger and GIN indexed there (see utils/task_search.py)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    # The table can be hash partitioned by created_by (the partition_tasks command, see
+    # utils/task_partitions.py). Every unique constraint and index added here must then include
+    # created_by: PostgreSQL rejects a unique one without the partition key, so the migration
+    # makemigrations generates for it fails on the partitioned table, and an index without
+    # it is scanned in every partition. Check new ones against a partitioned table
+    # (TaskPartitionTests run on PostgreSQL in CI).
+    class Meta:
+        constraints = [
+            # a routine creates one task per day, whatever races to create it
+            models.UniqueConstraint(
+                fields=['source_routine', 'occurrence_date'],
+                condition=models.Q(source_routine__isnull=False),
+                name='tasks_routine_occurrence_unique',
+            ),
+        ]
+        indexes = [
+            # serves the delta sync pull, read by (updated_at, id) per user
+            models.Index(fields=['created_by', 'updated_at', 'id'], name='tasks_user_updated_idx'),
+            # serves the per-user lists ordered by ('status', 'due_date', 'id') and the status counts
+            models.Index(fields=['created_by', 'status', 'due_date', 'id'], name='tasks_user_status_due_idx'),
+            # serves the due date windows (today / next week)
+            models.Index(fields=['created_by', 'due_date'], name='tasks_user_due_idx'),
+            # only the pending rows, for the overdue branch of today tasks
+            models.Index(
+                fields=['created_by', 'due_date'],
+                condition=models.Q(status=False),
+                name='tasks_user_pending_due_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # like auto_now, but with a default so the column can be added to existing rows;
+        # bulk_update doesn't call save(), the bulk paths stamp it themselves (see task_changes.touch)
+        self.updated_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.task_title
 
@@ -37,10 +96,69 @@ class User(AbstractUser):
 
     email_verify = models.BooleanField(default=False)
 
+    # the IANA time zone the user's days are counted in (see utils/user_time.py)
+    timezone = models.CharField(max_length=64, default='UTC', validators=[validate_timezone])
+
     def __str__(self):
         return self.username
 
 
+# a category of a user's tasks and routines; they reference it, so renaming it is one row
+class Category(models.Model):
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='categories')
+    name = models.CharField(max_length=200)
+    created_at = models.DateTimeField(default=timezone.now)
+    # the delta sync pull reads the renamed categories from it
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='category_user_name_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id'], name='category_user_updated_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # see Tasks.save
+        self.updated_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+# a completed task moved out of Tasks by the archive_tasks command once it's old (see
+# utils/task_archive.py); it keeps the id it had, the task counts and daily stats still count it
+class TaskArchive(models.Model):
+
+    # the id of the task it was
+    id = models.BigIntegerField(primary_key=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_tasks')
+    task_title = models.CharField(max_length=200)
+    task_details = models.CharField(max_length=2000, null=True, blank=True, default=None)
+    creation_date = models.DateTimeField()
+    category = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True, default=None, related_name='archived_tasks'
+    )
+    due_date = models.DateTimeField()
+    status = models.BooleanField(default=True)
+    done_date = models.DateTimeField(null=True, blank=True, default=None)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # serves the archived pages of all_tasks, in the order of the tasks pages
+            models.Index(fields=['created_by', 'status', 'due_date', 'id'], name='archive_user_status_due_idx'),
+        ]
+
+    def __str__(self):
+        return self.task_title
+
+
 class Routines(models.Model):
     # the title it self with max 200 char
     routines_title = models.CharField(max_length=200)
@@ -55,16 +173,226 @@ class Routines(models.Model):
     routines_dates = models.JSONField(default=list)
 
     # the category of tasks this routine creates
-    routine_category = models.CharField(max_length=100, default='general')
+    category = models.ForeignKey(
+        'Category', on_delete=models.SET_NULL, null=True, blank=True, default=None, related_name='routines'
+    )
+
+    # the category name before the Category table, see Tasks.task_category
+    routine_category = models.CharField(max_length=100, blank=True, default='')
 
     #to set the current status of the routine if active or not
     status = models.BooleanField(default=True)
 
     last_applied = models.DateTimeField(null=True, blank=True, default=None)
 
+    # the last time the routine was written, the delta sync pull reads the changes from it
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    # routines_dates compiled on save, see utils/routine_schedule.py (the yearly days are RoutineYearlyDay rows)
+    weekday_mask = models.IntegerField(default=0)
+    monthday_mask = models.IntegerField(default=0)
+    # 0 until the schedule columns are compiled
+    schedule_version = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_by', 'updated_at', 'id'], name='routines_user_updated_idx'),
+            # the active routines of a user, matched against a date by their schedule columns
+            models.Index(fields=['created_by', 'status'], name='routines_user_active_idx'),
+        ]
+
+    def compile_schedule(self):
+        """Set the schedule columns from routines_dates (bulk_create callers then call store_yearly_days)"""
+        self.weekday_mask, self.monthday_mask, _ = compile_schedule(self.routine_type, self.routines_dates)
+        self.schedule_version = SCHEDULE_VERSION
+
+    @staticmethod
+    def store_yearly_days(routines):
+        """Replace the RoutineYearlyDay rows of the (saved) routines with their current schedule"""
+        RoutineYearlyDay.objects.filter(routine__in=routines).delete()
+        RoutineYearlyDay.objects.bulk_create([
+            RoutineYearlyDay(routine=routine, month_day=month_day)
+            for routine in routines
+            for month_day in compile_schedule(routine.routine_type, routine.routines_dates)[2]
+        ])
+
+    def save(self, *args, **kwargs):
+        # see Tasks.save
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        recompile = update_fields is None or bool({'routines_dates', 'routine_type'} & set(update_fields))
+        if recompile:
+            self.compile_schedule()
+        if update_fields is not None:
+            schedule_fields = {'weekday_mask', 'monthday_mask', 'schedule_version'} if recompile else set()
+            kwargs['update_fields'] = {*update_fields, 'updated_at', *schedule_fields}
+        super().save(*args, **kwargs)
+        if recompile:
+            Routines.store_yearly_days([self])
+
     def __str__(self):
         return self.routines_title
 
+# a day of the year a yearly routine falls on, as month * 100 + day (see utils/routine_schedule.py)
+class RoutineYearlyDay(models.Model):
+
+    routine = models.ForeignKey(Routines, on_delete=models.CASCADE, related_name='yearly_days')
+    month_day = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['routine', 'month_day'], name='routine_yearly_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.routine_id} on {self.month_day:04d}"
+
+# denormalized per-user task counts, kept up to date by every task write (see utils/task_counters.py)
+class TaskCounters(models.Model):
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='task_counters')
+
+    # all of the user's tasks
+    total = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+
+    # the day the today / next week buckets below were counted for
+    bucket_date = models.DateField(null=True, blank=True, default=None)
+
+    # tasks on the today page (due today or overdue and pending)
+    today_total = models.IntegerField(default=0)
+    today_completed = models.IntegerField(default=0)
+
+    # tasks due within the next seven days
+    next_week_total = models.IntegerField(default=0)
+    next_week_completed = models.IntegerField(default=0)
+
+    # whether DailyTaskStats holds the user's whole history; until then the first task write builds it
+    daily_stats_built = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Task counters for {self.user_id}"
+
+# per-user, per-day and per-category rollups of the task history, kept up to date by every
+# task write (see utils/daily_stats.py); the stats endpoint reads its series from them
+class DailyTaskStats(models.Model):
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_task_stats')
+    day = models.DateField()
+    # None for the tasks without a category
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, default=None, related_name='daily_stats')
+
+    # tasks created on the day (the user's day)
+    created = models.IntegerField(default=0)
+    # tasks completed on the day
+    completed = models.IntegerField(default=0)
+    # tasks due on the day that weren't completed by it
+    overdue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # one row per day and category, the no category row included; they also serve the range reads
+            models.UniqueConstraint(
+                fields=['user', 'day', 'category'],
+                condition=models.Q(category__isnull=False),
+                name='daily_stats_user_day_category_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'day'],
+                condition=models.Q(category__isnull=True),
+                name='daily_stats_user_day_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Stats of {self.user_id} on {self.day}"
+
+# bumped by every write to the user's tasks or routines, the ETag of the read endpoints is built from it
+class UserDataVersion(models.Model):
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='data_version')
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Data version {self.version} for {self.user_id}"
+
+# left behind by a deleted task or routine so the delta sync pull can report the deletion
+# (see utils/delta_sync.py), pruned after SYNC_TOMBSTONE_RETENTION_DAYS
+class Tombstone(models.Model):
+    RECORD_TYPE_CHOICES = [
+        ('task', 'Task'),
+        ('routine', 'Routine'),
+        ('category', 'Category'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    record_type = models.CharField(max_length=20, choices=RECORD_TYPE_CHOICES)
+    record_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_user_deleted_idx'),
+            # the prune command deletes by age across all users
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.record_type} {self.record_id} of {self.user_id}"
+
+# the result of a sync mutation sent with a mutation_id, so a retried batch gets it back
+# instead of running the mutation twice (see utils/idempotency.py); pruned after
+# SYNC_PROCESSED_MUTATION_TTL_DAYS
+class ProcessedMutation(models.Model):
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    mutation_id = models.CharField(max_length=64)
+    result = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'mutation_id'], name='processed_mutation_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='processed_mutation_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Mutation {self.mutation_id} of {self.user_id}"
+
+# a run of the materialize_routines command, creating the routine tasks of every user for a day
+class RoutineMaterialization(models.Model):
+
+    target_date = models.DateField(unique=True)
+
+    # the width of the user id ranges the run is split in, kept so a resumed run splits the same way
+    chunk_size = models.PositiveIntegerField()
+
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        return f"Routine materialization for {self.target_date}"
+
+# a user id range a materialization run is done with, an interrupted run resumes after the done ones
+class MaterializedChunk(models.Model):
+
+    run = models.ForeignKey(RoutineMaterialization, on_delete=models.CASCADE, related_name='chunks')
+    first_user_id = models.BigIntegerField()
+    users = models.IntegerField(default=0)
+    tasks_created = models.IntegerField(default=0)
+    completed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'first_user_id'], name='materialized_chunk_unique'),
+        ]
+
+    def __str__(self):
+        return f"Users from {self.first_user_id} of {self.run}"
+
 class PendingOTP(models.Model):
     OTP_TYPE_CHOICES = [
         ('registration', 'Registration'),
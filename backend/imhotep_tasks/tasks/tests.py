@@ -1,3 +1,1861 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Q, Sum
+from django.test import TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .main.export_data import EXPORT_COLUMNS
+from .models import (
+    Category, DailyTaskStats, MaterializedChunk, ProcessedMutation, RoutineMaterialization, Routines, TaskCounters,
+    TaskArchive, Tasks, Tombstone, User,
+)
+from .utils import delta_sync, idempotency, tasks_managements_utils, user_time
+from .utils.apply_routines import apply_user_routines, due_on_filter, routine_matches
+from .utils.cursor_pagination import encode_cursor, keyset_filter
+from .utils.daily_stats import period_start, rebuild_daily_stats
+from .utils.data_version import bump_data_version
+from .utils.response_cache import page_cache_stats, reset_page_cache_stats
+from .utils.routine_materialization import materialize_range, routines_materialized, user_id_ranges
+from .utils.routine_schedule import DAY_NAMES, SCHEDULE_VERSION, compile_schedule
+from .utils.routines_utils import ROUTINE_FIELDS
+from .utils.task_counters import COUNTER_FIELDS, count_tasks, get_task_counts
+from .utils.task_archive import ARCHIVE_CURSOR_PREFIX
+from .utils.task_filters import day_start, day_window, next_week_tasks_filter, today_tasks_filter
+from .utils.task_partitions import rebuild_tasks_table, tasks_partitions
+from .utils.task_search import decode_search_cursor, encode_search_cursor
+from .utils.task_suggestions import recent_suggestions
+from .utils.token_blacklist import CachedRefreshToken, RevokedTokens, revoked_tokens
+from .utils.user_cache import CachedJWTAuthentication, recent_users, restamp_user
+from .utils.user_time import user_today
 
-# Create your tests here.
+
+# the default hasher is made slow on purpose, the tests only need the users to exist
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TasksTestCase(APITestCase):
+    """A user with an authenticated API client, every cache starting empty"""
+
+    def setUp(self):
+        # the page cache outlives the rolled back rows, and the ids of a test's users come back
+        caches['default'].clear()
+        self.user = self.make_user('alice')
+        self.client.force_authenticate(self.user)
+        self.today = user_today(self.user)
+
+    def make_user(self, username):
+        return User.objects.create_user(username=username, email=f'{username}@example.com', password='Secret-pass-123')
+
+    def make_task(self, user=None, **fields):
+        """A task written straight to the table, past the counters and the stats"""
+        fields.setdefault('task_title', 'task')
+        return Tasks.objects.create(created_by=user or self.user, **fields)
+
+    def age(self, minutes=5):
+        """Move every row and tombstone of the user back in time, out of the pull overlap"""
+        moment = timezone.now() - timedelta(minutes=minutes)
+        Tasks.objects.filter(created_by=self.user).update(updated_at=moment)
+        Routines.objects.filter(created_by=self.user).update(updated_at=moment)
+        Category.objects.filter(user=self.user).update(updated_at=moment)
+        Tombstone.objects.filter(user=self.user).update(deleted_at=moment)
+        return delta_sync.encode_sync_cursor({stream: (moment + timedelta(seconds=1), 0) for stream in delta_sync.STREAMS})
+
+
+# Query plans
+
+# plan lines that mean the query read the whole table or sorted the rows itself
+BAD_PLAN_PATTERNS = {
+    'postgresql': [
+        ('sequential scan', re.compile(r'Seq Scan on tasks_(tasks|taskarchive)(_p\d+)?\b')),
+        ('explicit sort', re.compile(r'(^|->)\s*(Incremental )?Sort\s+\(', re.MULTILINE)),
+    ],
+    'sqlite': [
+        ('sequential scan', re.compile(r'SCAN tasks_(tasks|taskarchive)\b(?! USING)')),
+        ('explicit sort', re.compile(r'USE TEMP B-TREE FOR ORDER BY')),
+    ],
+}
+
+# a due date range read from an index
+DUE_DATE_RANGE = {
+    'postgresql': re.compile(r'Index Cond: .*due_date >'),
+    'sqlite': re.compile(r'USING INDEX \w+ \(created_by_id=\? AND due_date>\?'),
+}
+
+
+class QueryPlanTests(TasksTestCase):
+    """Every task query shape the views run is served by an index, without sorting the user's rows"""
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor not in BAD_PLAN_PATTERNS:
+            self.skipTest(f"no plan patterns for {connection.vendor}")
+        for offset in range(-3, 10):
+            self.make_task(due_date=day_start(self.today + timedelta(days=offset)), status=offset % 2 == 0)
+
+    def explain(self, queryset, allow_sort):
+        if connection.vendor == 'postgresql':
+            # a few test rows make the planner prefer scans and sorts anyway, turn them off
+            # so the plan shows whether an index can serve the query (rolled back with the test)
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"SET LOCAL enable_sort = {'on' if allow_sort else 'off'}")
+        return queryset.explain()
+
+    def assertServedByIndex(self, queryset, allow_sort=False):
+        plan = self.explain(queryset, allow_sort)
+        for label, pattern in BAD_PLAN_PATTERNS[connection.vendor]:
+            if label == 'explicit sort' and allow_sort:
+                continue
+            self.assertIsNone(pattern.search(plan), f"{label}:\n{plan}")
+        return plan
+
+    def assertSortedWindow(self, queryset):
+        # The today / next week pages may be sorted: they read a due date range of the
+        # (user, due_date) indexes, a few days of tasks, and sorting those few rows is
+        # cheaper than walking all the user's rows in (status, due_date, id) order to skip
+        # the ones outside of the window. The range is what keeps the sort small, so a plan
+        # that sorts must read one.
+        plan = self.assertServedByIndex(queryset, allow_sort=True)
+        sort = dict(BAD_PLAN_PATTERNS[connection.vendor])['explicit sort']
+        if sort.search(plan):
+            self.assertRegex(plan, DUE_DATE_RANGE[connection.vendor])
+
+    def test_today_tasks(self):
+        queryset = tasks_managements_utils.today_tasks_queryset(self.user, self.today)
+        self.assertSortedWindow(queryset)
+        self.assertServedByIndex(queryset.filter(status=True).order_by())
+
+    def test_next_week_tasks(self):
+        queryset = tasks_managements_utils.next_week_tasks_queryset(self.user, self.today)
+        self.assertSortedWindow(queryset)
+        self.assertServedByIndex(queryset.filter(status=True).order_by())
+
+    def test_all_tasks(self):
+        queryset = tasks_managements_utils.all_tasks_queryset(self.user)
+        self.assertServedByIndex(queryset)
+        self.assertServedByIndex(queryset.filter(status=True).order_by())
+        self.assertServedByIndex(queryset.filter(keyset_filter(
+            tasks_managements_utils.TASKS_ORDERING, [False, timezone.now(), 0]
+        ))[:21])
+
+    def test_archived_tasks_page(self):
+        self.assertServedByIndex(tasks_managements_utils.archived_tasks_queryset(self.user).filter(keyset_filter(
+            tasks_managements_utils.TASKS_ORDERING, [True, timezone.now(), 0]
+        ))[:21])
+
+    def test_overdue_pending_tasks(self):
+        self.assertServedByIndex(Tasks.objects.filter(
+            created_by=self.user, status=False, due_date__lt=day_start(self.today)
+        ).order_by('due_date'))
+
+    def test_delta_sync_pull(self):
+        self.assertServedByIndex(Tasks.objects.filter(created_by=self.user).filter(keyset_filter(
+            ('updated_at', 'id'), [timezone.now(), 0]
+        )).order_by('updated_at', 'id')[:501])
+
+
+# Task counters
+
+class TaskCounterTests(TasksTestCase):
+    """Every task write keeps the user's counters equal to a recount of their tasks"""
+
+    def assertCountersMatch(self):
+        counters = TaskCounters.objects.get(user=self.user)
+        counts = count_tasks([self.user.id], self.today).get(self.user.id, dict.fromkeys(COUNTER_FIELDS, 0))
+        self.assertEqual({field: getattr(counters, field) for field in COUNTER_FIELDS}, counts)
+
+    def add_task(self, days, **data):
+        response = self.client.post('/api/tasks/add_task/', {
+            'task_title': 'task', 'due_date': str(self.today + timedelta(days=days)), **data,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['task']['id']
+
+    def test_writes_keep_counters(self):
+        ids = [self.add_task(days) for days in (-2, 0, 0, 3, 7, 20)]
+        self.assertCountersMatch()
+
+        response = self.client.post(f'/api/tasks/task_complete/{ids[1]}/', {'url_call': 'today-tasks'}, format='json')
+        self.assertEqual(
+            (response.data['total_number_tasks'], response.data['completed_tasks_count']), (3, 1)
+        )
+        self.assertCountersMatch()
+
+        self.client.patch(f'/api/tasks/update_task/{ids[0]}/', {'due_date': str(self.today + timedelta(days=1))}, format='json')
+        self.assertCountersMatch()
+        self.client.post('/api/tasks/multiple_task_complete/', {'task_ids': ids[:4]}, format='json')
+        self.assertCountersMatch()
+        self.client.patch('/api/tasks/multiple_update_task_dates/', {
+            'task_ids': ids[2:5], 'due_date': str(self.today - timedelta(days=1)),
+        }, format='json')
+        self.assertCountersMatch()
+        self.client.patch('/api/tasks/multiple_update_task_category/', {'task_ids': ids, 'task_category': 'Work'}, format='json')
+        self.assertCountersMatch()
+        self.client.delete(f'/api/tasks/delete_task/{ids[0]}/', format='json')
+        self.assertCountersMatch()
+        response = self.client.delete('/api/tasks/multiple_delete_task/', {'task_ids': ids[1:3]}, format='json')
+        self.assertCountersMatch()
+        self.assertEqual(response.data['total_number_tasks'], 3)
+
+    def test_toggle_twice_restores_counters(self):
+        task_id = self.add_task(0)
+        before = TaskCounters.objects.values(*COUNTER_FIELDS).get(user=self.user)
+        for _ in range(2):
+            self.client.post(f'/api/tasks/task_complete/{task_id}/', format='json')
+        self.assertEqual(TaskCounters.objects.values(*COUNTER_FIELDS).get(user=self.user), before)
+
+    def test_new_day_rebuckets(self):
+        self.add_task(1)
+        TaskCounters.objects.filter(user=self.user).update(bucket_date=self.today - timedelta(days=1))
+        total, completed, pending = get_task_counts(self.user, 'today-tasks')
+        self.assertEqual((total, completed, pending), (0, 0, 0))
+        self.assertCountersMatch()
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_writes_lock_the_rows_they_snapshot(self):
+        # the snapshot the counter delta is computed from must be read locked, in the write's transaction
+        task_id = self.add_task(0)
+        writes = [
+            ('patch', f'/api/tasks/update_task/{task_id}/', {'task_title': 'x'}),
+            ('post', f'/api/tasks/task_complete/{task_id}/', {}),
+            ('post', '/api/tasks/multiple_task_complete/', {'task_ids': [task_id]}),
+            ('patch', '/api/tasks/multiple_update_task_dates/', {'task_ids': [task_id], 'due_date': str(self.today)}),
+            ('patch', '/api/tasks/multiple_update_task_category/', {'task_ids': [task_id], 'task_category': 'home'}),
+            ('delete', f'/api/tasks/delete_task/{task_id}/', {}),
+        ]
+        for method, url, data in writes:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                getattr(self.client, method)(url, data, format='json')
+            task_reads = [
+                query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith('SELECT') and 'FROM "tasks_tasks"' in query['sql']
+            ]
+            self.assertTrue(task_reads, url)
+            self.assertIn('FOR UPDATE', task_reads[0], url)
+
+
+# Cursor pagination
+
+class CursorPaginationTests(TasksTestCase):
+    """Pages read by cursor list every row once, in the page order, whatever is written between them"""
+
+    def setUp(self):
+        super().setUp()
+        # several tasks per due date and status, so the id has to break the ties
+        for number in range(45):
+            self.make_task(
+                task_title=f'task {number}',
+                due_date=day_start(self.today + timedelta(days=number % 4)),
+                status=number % 3 == 0,
+            )
+
+    def read_pages(self, url, key='user_tasks', cursor=''):
+        pages = []
+        while cursor is not None:
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            cursor = response.data['pagination']['next_cursor']
+        return pages
+
+    def test_all_tasks_pages(self):
+        pages = self.read_pages('/api/tasks/all_tasks/')
+        self.assertEqual([len(page['user_tasks']) for page in pages], [20, 20, 5])
+        ids = [task['id'] for page in pages for task in page['user_tasks']]
+        expected = list(tasks_managements_utils.all_tasks_queryset(self.user).values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertIsNone(pages[0]['pagination']['prev_cursor'])
+
+    def test_prev_cursor_reads_the_page_before(self):
+        pages = self.read_pages('/api/tasks/all_tasks/')
+        response = self.client.get('/api/tasks/all_tasks/', {'cursor': pages[2]['pagination']['prev_cursor']})
+        self.assertEqual(response.data['user_tasks'], pages[1]['user_tasks'])
+        response = self.client.get('/api/tasks/all_tasks/', {'cursor': response.data['pagination']['prev_cursor']})
+        self.assertEqual(response.data['user_tasks'], pages[0]['user_tasks'])
+        self.assertIsNone(response.data['pagination']['prev_cursor'])
+
+    def test_writes_between_pages_dont_shift_them(self):
+        first = self.client.get('/api/tasks/all_tasks/', {'cursor': ''}).data
+        # a row sorting before the page edge would shift every OFFSET page after it
+        self.client.post('/api/tasks/add_task/', {'task_title': 'early', 'due_date': str(self.today)}, format='json')
+        rest = self.read_pages('/api/tasks/all_tasks/', cursor=first['pagination']['next_cursor'])
+        seen = [task['id'] for page in [first, *rest] for task in page['user_tasks']]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), 45)
+
+    def test_malformed_cursor_reads_the_first_page(self):
+        first = self.client.get('/api/tasks/all_tasks/', {'cursor': ''}).data
+        for cursor in ('not-a-cursor', 'e30', encode_cursor({'id': 1}, ('id',), 'next')):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/tasks/all_tasks/', {'cursor': cursor})
+                self.assertEqual(response.data['user_tasks'], first['user_tasks'])
+
+    def test_next_week_pages(self):
+        pages = self.read_pages('/api/tasks/next_week_tasks/')
+        ids = [task['id'] for page in pages for task in page['user_tasks']]
+        expected = tasks_managements_utils.next_week_tasks_queryset(self.user, self.today).values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_routine_pages(self):
+        Routines.objects.bulk_create([
+            Routines(routines_title=f'routine {number}', created_by=self.user, routines_dates=['monday'])
+            for number in range(25)
+        ])
+        pages = self.read_pages('/api/routines/', cursor='')
+        ids = [routine['id'] for page in pages for routine in page['user_routines']]
+        self.assertEqual(ids, list(Routines.objects.filter(created_by=self.user).order_by('id').values_list('id', flat=True)))
+        self.assertEqual(len(pages), 2)
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get('/api/tasks/all_tasks/', {'page': 3})
+        self.assertEqual(response.data['pagination']['page'], 3)
+        self.assertEqual(len(response.data['user_tasks']), 5)
+
+
+# Projected serializers
+
+class ListQueryCountTests(TasksTestCase):
+    """The list endpoints run as many queries for many rows as for one"""
+
+    def add_rows(self, count):
+        category = Category.objects.create(user=self.user, name=f'category {count}')
+        Tasks.objects.bulk_create([
+            Tasks(task_title='task', created_by=self.user, category=category, due_date=day_start(self.today))
+            for _ in range(count)
+        ])
+        Routines.objects.bulk_create([
+            Routines(routines_title='routine', created_by=self.user, category=category, status=False)
+            for _ in range(count)
+        ])
+
+    def count_queries(self, url):
+        # a new data version, so the page cache can't answer
+        bump_data_version(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_counts_dont_grow_with_rows(self):
+        urls = ('/api/tasks/today_tasks/', '/api/tasks/next_week_tasks/', '/api/tasks/all_tasks/', '/api/routines/')
+        self.add_rows(1)
+        for url in urls:
+            # the first read of the day applies the routines and counts the tasks
+            self.count_queries(url)
+        few = {url: self.count_queries(url) for url in urls}
+        self.add_rows(15)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), few[url])
+
+    def test_rows_are_serialized_with_their_category(self):
+        self.add_rows(2)
+        tasks = self.client.get('/api/tasks/all_tasks/').data['user_tasks']
+        self.assertEqual({task['task_category'] for task in tasks}, {'category 2'})
+        self.assertEqual({task['created_by'] for task in tasks}, {self.user.id})
+        routines = self.client.get('/api/routines/').data['user_routines']
+        self.assertEqual({routine['routine_category'] for routine in routines}, {'category 2'})
+
+
+# ETags
+
+class ETagTests(TasksTestCase):
+    """The read endpoints answer 304 while the user's data version hasn't moved"""
+
+    def test_unchanged_pages_are_not_modified(self):
+        self.make_task()
+        for url in ('/api/tasks/today_tasks/', '/api/tasks/all_tasks/', '/api/tasks/next_week_tasks/', '/api/routines/'):
+            with self.subTest(url=url):
+                # the first read of the day may apply routines, which moves the version
+                self.client.get(url)
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+    def test_task_and_routine_writes_change_the_etag(self):
+        etag = self.client.get('/api/tasks/all_tasks/')['ETag']
+        self.client.post('/api/tasks/add_task/', {'task_title': 'new'}, format='json')
+        response = self.client.get('/api/tasks/all_tasks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.client.post('/api/add_routine/', {
+            'routines_title': 'gym', 'routine_type': 'weekly', 'routines_dates': ['monday'],
+        }, format='json')
+        self.assertEqual(self.client.get('/api/tasks/all_tasks/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_the_path_and_the_user(self):
+        etag = self.client.get('/api/tasks/all_tasks/')['ETag']
+        self.assertNotEqual(self.client.get('/api/tasks/all_tasks/', {'page': 2})['ETag'], etag)
+        self.client.force_authenticate(self.make_user('bob'))
+        self.assertEqual(self.client.get('/api/tasks/all_tasks/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+# Page cache
+
+class PageCacheTests(TasksTestCase):
+    """The read endpoints answer from the cache until the user's data version moves"""
+
+    def setUp(self):
+        super().setUp()
+        reset_page_cache_stats()
+
+    def stats(self, view_name):
+        return page_cache_stats()[view_name]
+
+    def test_repeated_reads_are_cache_hits(self):
+        self.make_task(due_date=day_start(self.today))
+        first = self.client.get('/api/tasks/today_tasks/')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/tasks/today_tasks/')
+        self.assertEqual(second.data, first.data)
+        # only the data version is read, the view doesn't run
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.stats('today_tasks'), {'hits': 1, 'misses': 1})
+
+    def test_writes_invalidate_the_pages(self):
+        self.client.get('/api/tasks/all_tasks/')
+        self.client.post('/api/tasks/add_task/', {'task_title': 'new'}, format='json')
+        response = self.client.get('/api/tasks/all_tasks/')
+        self.assertEqual([task['task_title'] for task in response.data['user_tasks']], ['new'])
+        self.assertEqual(self.stats('all_tasks'), {'hits': 0, 'misses': 2})
+
+    def test_users_dont_share_pages(self):
+        self.make_task(task_title='mine')
+        self.client.get('/api/tasks/all_tasks/')
+        self.client.force_authenticate(self.make_user('bob'))
+        self.assertEqual(self.client.get('/api/tasks/all_tasks/').data['user_tasks'], [])
+
+    def test_page_written_while_the_view_ran_is_not_cached(self):
+        # the first read of the day applies this routine, which moves the version while the view runs
+        self.client.post('/api/add_routine/', {
+            'routines_title': 'daily', 'routine_type': 'weekly', 'routines_dates': list(DAY_NAMES),
+        }, format='json')
+        Tasks.objects.filter(created_by=self.user).delete()
+        Routines.objects.filter(created_by=self.user).update(last_applied=None)
+
+        first = self.client.get('/api/tasks/today_tasks/')
+        self.assertNotIn('ETag', first)
+        self.assertEqual([task['task_title'] for task in first.data['user_tasks']], ['daily'])
+        self.client.get('/api/tasks/today_tasks/')
+        self.client.get('/api/tasks/today_tasks/')
+        self.assertEqual(self.stats('today_tasks'), {'hits': 1, 'misses': 2})
+
+
+# Export
+
+class ExportTests(TasksTestCase):
+    """The export streams every task and routine of the user, and only theirs"""
+
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(user=self.user, name='work')
+        self.task = self.make_task(task_title='report', task_details='q3', category=category, status=True)
+        self.routine = Routines.objects.create(
+            routines_title='gym', created_by=self.user, routine_type='weekly', routines_dates=['monday']
+        )
+        self.make_task(user=self.make_user('bob'), task_title='not mine')
+
+    def export(self, file_type):
+        response = self.client.get('/api/tasks/export/', {'file_type': file_type})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        records = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual([(record['type'], record['title']) for record in records], [('task', 'report'), ('routine', 'gym')])
+        task, routine = records
+        self.assertEqual(set(task), set(EXPORT_COLUMNS))
+        self.assertEqual((task['category'], task['details'], task['status']), ('work', 'q3', True))
+        self.assertEqual(task['due_date'], self.task.due_date.isoformat())
+        self.assertEqual((routine['routine_type'], routine['routine_dates']), ('weekly', ['monday']))
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+        self.assertEqual([(row['type'], row['title']) for row in rows], [('task', 'report'), ('routine', 'gym')])
+        self.assertEqual(rows[0]['status'], 'true')
+        self.assertEqual(json.loads(rows[1]['routine_dates']), ['monday'])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/api/tasks/export/', {'file_type': 'xml'}).status_code, 400)
+
+
+# Import
+
+class ImportTests(TasksTestCase):
+    """The import inserts the valid rows in batches and reports every invalid one by row number"""
+
+    def upload(self, content, name='tasks.ndjson', **data):
+        return self.client.post('/api/tasks/import/', {
+            'file': SimpleUploadedFile(name, content.encode()), **data,
+        }, format='multipart')
+
+    def test_error_report(self):
+        lines = [
+            json.dumps({'type': 'task', 'title': 'one', 'due_date': '2030-01-02', 'status': 'done', 'category': 'Work'}),
+            '{not json',
+            json.dumps({'type': 'task', 'title': ''}),
+            '',
+            json.dumps(['a list']),
+            json.dumps({'type': 'task', 'title': 'two', 'status': 'maybe'}),
+            json.dumps({'type': 'note', 'title': 'three'}),
+            json.dumps({'type': 'routine', 'title': 'gym', 'routine_type': 'weekly', 'routine_dates': ['monday']}),
+            json.dumps({'type': 'routine', 'title': 'bad', 'routine_type': 'daily', 'routine_dates': ['monday']}),
+            json.dumps({'task_title': 'aliased', 'task_category': 'home'}),
+        ]
+        response = self.upload('\n'.join(lines), batch_size='2')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual((data['rows'], data['imported_tasks'], data['imported_routines'], data['failed_rows']), (9, 2, 1, 6))
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3, 5, 6, 7, 9])
+        self.assertIn('title is required', data['errors'][1]['error'])
+        self.assertFalse(data['errors_truncated'])
+
+        task = Tasks.objects.get(created_by=self.user, task_title='one')
+        self.assertEqual((task.category.name, task.status, task.due_date.date()), ('Work', True, date(2030, 1, 2)))
+        self.assertEqual(Tasks.objects.get(created_by=self.user, task_title='aliased').category.name, 'home')
+        self.assertEqual(Routines.objects.get(created_by=self.user).weekday_mask, 1)
+
+    def test_non_string_types(self):
+        lines = [
+            json.dumps({'type': 5, 'title': 'number'}),
+            json.dumps({'type': ['task'], 'title': 'list'}),
+            json.dumps({'type': 'routine', 'title': 'gym', 'routine_type': {'weekly': True}, 'routine_dates': ['monday']}),
+            json.dumps({'title': 'kept'}),
+        ]
+        data = self.upload('\n'.join(lines)).data
+        self.assertEqual((data['imported_tasks'], data['imported_routines'], data['failed_rows']), (1, 0, 3))
+        self.assertEqual([error['row'] for error in data['errors']], [1, 2, 3])
+        self.assertIn('type must be a string', data['errors'][0]['error'])
+        self.assertIn('routine_type must be a string', data['errors'][2]['error'])
+
+    def test_counters_follow_the_batches(self):
+        lines = [json.dumps({'title': f'task {number}', 'status': number % 2 == 0}) for number in range(7)]
+        self.upload('\n'.join(lines), batch_size='3')
+        counters = TaskCounters.objects.get(user=self.user)
+        self.assertEqual((counters.total, counters.completed), (7, 4))
+
+    def test_export_round_trip(self):
+        self.make_task(task_title='exported', task_details='details', status=True, done_date=day_start(self.today))
+        Routines.objects.create(routines_title='gym', created_by=self.user, routine_type='monthly', routines_dates=['1', '15'])
+        export = b''.join(self.client.get('/api/tasks/export/', {'file_type': 'csv'}).streaming_content).decode()
+
+        self.client.force_authenticate(self.make_user('bob'))
+        data = self.upload(export, name='export.csv').data
+        self.assertEqual((data['imported_tasks'], data['imported_routines'], data['failed_rows']), (1, 1, 0))
+        task = Tasks.objects.get(created_by__username='bob')
+        self.assertEqual((task.task_title, task.task_details, task.status), ('exported', 'details', True))
+
+    def test_error_report_is_bounded(self):
+        with mock.patch('tasks.utils.task_import.MAX_REPORTED_ERRORS', 3):
+            data = self.upload('\n'.join(['{}'] * 5)).data
+        self.assertEqual((data['failed_rows'], len(data['errors']), data['errors_truncated']), (5, 3, True))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.post('/api/tasks/import/', {}, format='multipart').status_code, 400)
+        self.assertEqual(self.upload('x', name='tasks.xml').status_code, 400)
+        self.assertEqual(self.upload('{}', batch_size='many').status_code, 400)
+        response = self.client.post('/api/tasks/import/', {
+            'file': SimpleUploadedFile('tasks.csv', b'title\n\xff\xfe'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+# Delta sync pull
+
+class SyncPullTests(TasksTestCase):
+    """A pull returns what changed and what was deleted since the cursor"""
+
+    def pull(self, cursor=None):
+        response = self.client.get('/api/tasks/sync/pull/', {'cursor': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_first_pull_returns_everything(self):
+        ids = [self.client.post('/api/tasks/add_task/', {'task_title': f't{n}', 'task_category': 'work'}, format='json').data['task']['id'] for n in range(3)]
+        self.client.delete(f'/api/tasks/delete_task/{ids[0]}/', format='json')
+        data = self.pull()
+        self.assertEqual(sorted(task['id'] for task in data['tasks']), ids[1:])
+        self.assertEqual([category['name'] for category in data['categories']], ['work'])
+        self.assertEqual(data['deleted'], {'tasks': [], 'routines': [], 'categories': []})
+        self.assertFalse(data['has_more'])
+
+    def test_pull_since_cursor(self):
+        ids = [self.client.post('/api/tasks/add_task/', {'task_title': f't{n}'}, format='json').data['task']['id'] for n in range(3)]
+        cursor = self.age()
+        self.assertEqual(self.pull(cursor)['tasks'], [])
+
+        self.client.patch(f'/api/tasks/update_task/{ids[0]}/', {'task_title': 'changed'}, format='json')
+        self.client.delete(f'/api/tasks/delete_task/{ids[1]}/', format='json')
+        data = self.pull(cursor)
+        self.assertEqual([task['task_title'] for task in data['tasks']], ['changed'])
+        self.assertEqual(data['deleted']['tasks'], [ids[1]])
+
+    def test_pages_cover_every_change(self):
+        for number in range(5):
+            self.make_task(task_title=f't{number}')
+        seen, positions = [], None
+        while True:
+            tasks, _, _, _, positions, has_more = delta_sync.pull_changes(
+                self.user.id, tasks_managements_utils.TASK_FIELDS, ROUTINE_FIELDS, positions, limit=2
+            )
+            seen += [task['id'] for task in tasks]
+            if not has_more:
+                break
+        self.assertEqual(sorted(seen), sorted(Tasks.objects.filter(created_by=self.user).values_list('id', flat=True)))
+
+    def test_bad_and_expired_cursors(self):
+        response = self.client.get('/api/tasks/sync/pull/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        expired = delta_sync.encode_sync_cursor({
+            stream: (timezone.now() - delta_sync.tombstone_retention() - timedelta(days=1), 0)
+            for stream in delta_sync.STREAMS
+        })
+        self.assertTrue(self.pull(expired)['full_resync'])
+
+    def test_prune_sync_records(self):
+        self.make_task()
+        Tombstone.objects.create(user=self.user, record_type='task', record_id=1)
+        Tombstone.objects.create(user=self.user, record_type='task', record_id=2)
+        Tombstone.objects.filter(record_id=1).update(
+            deleted_at=timezone.now() - delta_sync.tombstone_retention() - timedelta(days=1)
+        )
+        call_command('prune_sync_records', stdout=io.StringIO())
+        self.assertEqual(list(Tombstone.objects.values_list('record_id', flat=True)), [2])
+
+
+# Set-based sync batches
+
+class SyncBatchTests(TasksTestCase):
+    """A sync batch is applied in one transaction, with a fixed number of queries"""
+
+    def sync(self, mutations):
+        response = self.client.post('/api/tasks/sync/', {'mutations': mutations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def assertCountersMatch(self):
+        counters = TaskCounters.objects.values(*COUNTER_FIELDS).get(user=self.user)
+        self.assertEqual(counters, count_tasks([self.user.id], self.today)[self.user.id])
+
+    def test_mixed_batch(self):
+        ids = [self.sync([{'action': 'add_task', 'payload': {'task_title': f't{n}'}}])[0]['server_id'] for n in range(4)]
+        other = self.make_task(user=self.make_user('bob'))
+        results = self.sync([
+            {'action': 'add_task', 'payload': {'task_title': 'new', 'task_category': 'Home'}, 'client_timestamp': '1'},
+            {'action': 'update_task', 'task_id': ids[0], 'payload': {'task_title': 'renamed'}, 'client_timestamp': '1'},
+            {'action': 'toggle_complete', 'task_id': ids[1], 'client_timestamp': '1'},
+            {'action': 'bulk_update_date', 'payload': {'task_ids': ids[2:], 'due_date': str(self.today + timedelta(days=2))}},
+            {'action': 'delete_task', 'task_id': ids[3], 'client_timestamp': '1'},
+            {'action': 'update_task', 'task_id': other.id, 'payload': {'task_title': 'not mine'}},
+            {'action': 'bulk_update_date', 'payload': {'task_ids': ids}},
+            {'action': 'explode', 'payload': {}},
+        ])
+        # results come in processing order: adds, updates, ..., deletes
+        self.assertEqual(
+            [(result['action'], result['success']) for result in results],
+            [
+                ('add_task', True),
+                ('update_task', True),
+                ('update_task', False),
+                ('toggle_complete', True),
+                ('bulk_update_date', True),
+                ('bulk_update_date', False),
+                ('delete_task', True),
+                ('explode', False),
+            ],
+        )
+        self.assertEqual(results[0]['task']['task_category'], 'Home')
+        self.assertEqual(Tasks.objects.get(id=ids[0]).task_title, 'renamed')
+        self.assertTrue(Tasks.objects.get(id=ids[1]).status)
+        self.assertEqual(Tasks.objects.get(id=ids[2]).due_date, day_start(self.today + timedelta(days=2)))
+        self.assertFalse(Tasks.objects.filter(id=ids[3]).exists())
+        self.assertEqual(Tasks.objects.get(id=other.id).task_title, 'task')
+        self.assertCountersMatch()
+
+    def test_latest_mutation_of_a_task_wins(self):
+        task_id = self.sync([{'action': 'add_task', 'payload': {'task_title': 'a'}}])[0]['server_id']
+        results = self.sync([
+            {'action': 'update_task', 'task_id': task_id, 'payload': {'task_title': 'late'}, 'client_timestamp': '2025-01-02T00:00:00Z'},
+            {'action': 'update_task', 'task_id': task_id, 'payload': {'task_title': 'early'}, 'client_timestamp': '2025-01-01T00:00:00Z'},
+        ])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(Tasks.objects.get(id=task_id).task_title, 'late')
+
+    def test_queries_dont_grow_with_the_batch(self):
+        def batch(size):
+            ids = list(Tasks.objects.filter(created_by=self.user).values_list('id', flat=True)[:size])
+            return [
+                *({'action': 'add_task', 'payload': {'task_title': 'new'}} for _ in range(size)),
+                *({'action': 'toggle_complete', 'task_id': task_id} for task_id in ids),
+            ]
+
+        for _ in range(20):
+            self.make_task(due_date=day_start(self.today))
+        self.sync(batch(1))
+        with CaptureQueriesContext(connection) as small:
+            self.sync(batch(2))
+        with CaptureQueriesContext(connection) as large:
+            self.sync(batch(10))
+        self.assertEqual(len(large), len(small))
+
+    def test_failed_write_falls_back_to_one_by_one(self):
+        task_id = self.sync([{'action': 'add_task', 'payload': {'task_title': 'a'}}])[0]['server_id']
+        with mock.patch('tasks.utils.sync_batch._Batch.write', side_effect=DatabaseError('boom')):
+            results = self.sync([
+                {'action': 'toggle_complete', 'task_id': task_id},
+                {'action': 'add_task', 'payload': {'task_title': 'b'}},
+            ])
+        self.assertEqual([result['success'] for result in results], [True, True])
+        self.assertTrue(Tasks.objects.get(id=task_id).status)
+        self.assertEqual(Tasks.objects.filter(created_by=self.user).count(), 2)
+        self.assertCountersMatch()
+
+
+# Sync idempotency keys
+
+class SyncIdempotencyTests(TasksTestCase):
+    """A retried batch gets the stored results of the mutations it already applied"""
+
+    def sync(self, mutations, status_code=200):
+        response = self.client.post('/api/tasks/sync/', {'mutations': mutations}, format='json')
+        self.assertEqual(response.status_code, status_code)
+        return response.data
+
+    def test_retry_is_replayed(self):
+        batch = [
+            {'action': 'add_task', 'payload': {'task_title': 'a'}, 'mutation_id': 'm1'},
+            {'action': 'add_task', 'payload': {'task_title': 'b'}, 'mutation_id': 'm2'},
+        ]
+        first = self.sync(batch)['results']
+        retry = self.sync(batch + [{'action': 'add_task', 'payload': {'task_title': 'c'}, 'mutation_id': 'm3'}])
+        self.assertEqual(Tasks.objects.filter(created_by=self.user).count(), 3)
+        self.assertEqual(
+            [(result['server_id'], result.get('replayed', False)) for result in retry['results']],
+            [(first[0]['server_id'], True), (first[1]['server_id'], True), (retry['results'][2]['server_id'], False)],
+        )
+        self.assertEqual(TaskCounters.objects.get(user=self.user).total, 3)
+
+    def test_failed_mutation_runs_again(self):
+        task = self.make_task()
+        batch = [{'action': 'bulk_update_date', 'payload': {'task_ids': [task.id]}, 'mutation_id': 'm1'}]
+        self.assertFalse(self.sync(batch)['results'][0]['success'])
+        batch[0]['payload']['due_date'] = str(self.today + timedelta(days=1))
+        result = self.sync(batch)['results'][0]
+        self.assertTrue(result['success'])
+        self.assertNotIn('replayed', result)
+
+    def test_ids_are_per_user(self):
+        batch = [{'action': 'add_task', 'payload': {'task_title': 'a'}, 'mutation_id': 'm1'}]
+        self.sync(batch)
+        self.client.force_authenticate(self.make_user('bob'))
+        self.assertNotIn('replayed', self.sync(batch)['results'][0])
+        self.assertEqual(Tasks.objects.count(), 2)
+
+    def test_duplicate_id_in_a_batch_is_applied_once(self):
+        mutation = {'action': 'add_task', 'payload': {'task_title': 'a'}, 'mutation_id': 'm1'}
+        self.assertEqual(self.sync([mutation, mutation])['processed'], 1)
+        self.assertEqual(Tasks.objects.count(), 1)
+
+    def test_too_long_id(self):
+        self.sync([{'action': 'add_task', 'payload': {'task_title': 'a'}, 'mutation_id': 'x' * 65}], 400)
+        self.assertFalse(Tasks.objects.exists())
+
+    def test_concurrent_retry_reads_the_stored_results(self):
+        # the first attempt doesn't see the results the other request stores meanwhile
+        ProcessedMutation.objects.create(
+            user=self.user, mutation_id='m1', result={'action': 'add_task', 'success': True, 'server_id': 99}
+        )
+        processed_results = idempotency.processed_results
+        with mock.patch(
+            'tasks.utils.idempotency.processed_results', side_effect=[{}, processed_results(self.user.id, [{'mutation_id': 'm1'}])]
+        ):
+            result = self.sync([{'action': 'add_task', 'payload': {'task_title': 'a'}, 'mutation_id': 'm1'}])['results'][0]
+        self.assertEqual((result['server_id'], result['replayed']), (99, True))
+        self.assertFalse(Tasks.objects.exists())
+        # the counters were rolled back with the tasks
+        self.assertEqual(get_task_counts(self.user)[0], 0)
+
+    def test_prune_old_results(self):
+        self.sync([{'action': 'add_task', 'payload': {'task_title': 'a'}, 'mutation_id': 'm1'}])
+        self.sync([{'action': 'add_task', 'payload': {'task_title': 'b'}, 'mutation_id': 'm2'}])
+        ProcessedMutation.objects.filter(mutation_id='m1').update(
+            created_at=timezone.now() - idempotency.processed_mutation_ttl() - timedelta(hours=1)
+        )
+        call_command('prune_sync_records', stdout=io.StringIO())
+        self.assertEqual(list(ProcessedMutation.objects.values_list('mutation_id', flat=True)), ['m2'])
+
+
+# Set-based routine application
+
+class ApplyRoutinesTests(TasksTestCase):
+    """apply_user_routines creates one task per due routine and day, with a fixed number of queries"""
+
+    # a Monday
+    day = date(2025, 3, 10)
+
+    def make_routine(self, routine_type, routines_dates, user=None, **fields):
+        return Routines.objects.create(
+            created_by=user or self.user, routines_title=f'{routine_type} {routines_dates}',
+            routine_type=routine_type, routines_dates=routines_dates, **fields
+        )
+
+    def test_due_routines(self):
+        due = [
+            self.make_routine('weekly', ['monday', 'friday']),
+            self.make_routine('monthly', ['10']),
+            self.make_routine('yearly', ['03-10']),
+        ]
+        self.make_routine('weekly', ['tuesday'])
+        self.make_routine('monthly', ['11'])
+        self.make_routine('yearly', ['10-03'])
+        self.make_routine('weekly', ['monday'], status=False)
+        self.make_routine('weekly', ['monday'], user=self.make_user('bob'))
+
+        tasks = apply_user_routines(self.user, self.day)
+        self.assertEqual(
+            sorted((task.source_routine_id, task.occurrence_date, task.task_title) for task in tasks),
+            [(routine.id, self.day, routine.routines_title) for routine in due],
+        )
+        self.assertEqual(Tasks.objects.count(), 3)
+        self.assertEqual(
+            set(Routines.objects.filter(last_applied__isnull=False).values_list('id', flat=True)),
+            {routine.id for routine in due},
+        )
+        counters = TaskCounters.objects.values(*COUNTER_FIELDS).get(user=self.user)
+        self.assertEqual(counters, count_tasks([self.user.id], self.today)[self.user.id])
+
+    def test_one_task_per_routine_and_day(self):
+        routine = self.make_routine('weekly', ['monday'])
+        self.assertEqual(len(apply_user_routines(self.user, self.day)), 1)
+        self.assertEqual(apply_user_routines(self.user, self.day), [])
+        self.assertEqual(apply_user_routines(self.user, self.day, manually=True), [])
+        Routines.objects.filter(id=routine.id).update(last_applied=None)
+        self.assertEqual(apply_user_routines(self.user, self.day), [])
+        self.assertEqual(len(apply_user_routines(self.user, self.day + timedelta(days=7))), 1)
+        self.assertEqual(Tasks.objects.filter(source_routine=routine).count(), 2)
+
+    def test_routines_saved_before_compiling(self):
+        routine = self.make_routine('monthly', ['10'])
+        Routines.objects.filter(id=routine.id).update(monthday_mask=0, schedule_version=0)
+        self.assertEqual([task.source_routine_id for task in apply_user_routines(self.user, self.day)], [routine.id])
+
+    def test_queries_dont_grow_with_the_routines(self):
+        def apply(routines, day):
+            for n in range(routines):
+                self.make_routine('weekly', [DAY_NAMES[day.weekday()]])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(apply_user_routines(self.user, day)), routines)
+            Routines.objects.all().delete()
+            return len(queries)
+
+        # the first apply also creates the counters and the day's stats rows
+        apply(1, self.day - timedelta(days=1))
+        self.assertEqual(apply(2, self.day), apply(20, self.day + timedelta(days=1)))
+
+    def test_apply_view(self):
+        self.make_routine('weekly', DAY_NAMES)
+        response = self.client.post('/api/apply_routines/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(Tasks.objects.values_list('occurrence_date', flat=True)), [self.today]
+        )
+
+
+# Nightly routine materialization
+
+class MaterializeRoutinesTests(TasksTestCase):
+    """The materialize_routines command creates everyone's routine tasks in resumable user id ranges"""
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self.user] + [self.make_user(name) for name in ('bob', 'carol', 'dave')]
+        for user in self.users[:3]:
+            Routines.objects.create(
+                created_by=user, routines_title='daily', routine_type='weekly', routines_dates=DAY_NAMES
+            )
+        self.day = self.today + timedelta(days=1)
+
+    def materialize(self, *args):
+        out = io.StringIO()
+        call_command('materialize_routines', f'--date={self.day}', '--chunk-size=2', *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_run(self):
+        self.materialize()
+        self.assertEqual(
+            sorted(Tasks.objects.values_list('created_by', 'occurrence_date')),
+            [(user.id, self.day) for user in self.users[:3]],
+        )
+        run = RoutineMaterialization.objects.get(target_date=self.day)
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(
+            sorted(run.chunks.values_list('first_user_id', flat=True)), [first for first, last in user_id_ranges(2)]
+        )
+        self.assertEqual(run.chunks.aggregate(users=Sum('users'), tasks=Sum('tasks_created')), {'users': 3, 'tasks': 3})
+        self.assertIn('were materialized', self.materialize())
+
+    def test_resume(self):
+        run = RoutineMaterialization.objects.create(target_date=self.day, chunk_size=2)
+        first_range = user_id_ranges(2)[0]
+        MaterializedChunk.objects.create(run=run, first_user_id=first_range[0])
+        self.materialize()
+        # the users of the range recorded done were left alone
+        self.assertFalse(Tasks.objects.filter(created_by_id__lte=first_range[1]).exists())
+        self.assertTrue(Tasks.objects.filter(created_by_id__gt=first_range[1]).exists())
+        self.materialize('--restart')
+        self.assertEqual(Tasks.objects.count(), 3)
+
+    def test_apply_twice(self):
+        run = RoutineMaterialization.objects.create(target_date=self.day, chunk_size=1000)
+        self.assertEqual(materialize_range(run.id, self.day, 1, 1000), (3, 3))
+        self.assertEqual(materialize_range(run.id, self.day, 1, 1000), (3, 0))
+        self.assertEqual(run.chunks.count(), 1)
+
+    def test_users_past_the_day_get_their_own(self):
+        yesterday = self.today - timedelta(days=1)
+        run = RoutineMaterialization.objects.create(target_date=yesterday, chunk_size=1000)
+        materialize_range(run.id, yesterday, self.user.id, self.user.id)
+        self.assertEqual(list(Tasks.objects.values_list('occurrence_date', flat=True)), [self.today])
+
+    def test_default_day(self):
+        call_command('materialize_routines', stdout=io.StringIO())
+        self.assertTrue(RoutineMaterialization.objects.filter(target_date=timezone.localdate()).exists())
+
+    @override_settings(ROUTINES_MATERIALIZED=True)
+    def test_page_views_skip_a_materialized_day(self):
+        self.assertFalse(routines_materialized(self.day))
+        self.materialize()
+        self.assertTrue(routines_materialized(self.day))
+
+
+# Compiled routine schedules
+
+class RoutineScheduleTests(TasksTestCase):
+    """The schedule columns match a date in SQL exactly like routine_matches does in Python"""
+
+    def make_routine(self, routine_type, routines_dates):
+        return Routines.objects.create(
+            created_by=self.user, routines_title='r', routine_type=routine_type, routines_dates=routines_dates
+        )
+
+    def test_compile_schedule(self):
+        self.assertEqual(compile_schedule('weekly', ['monday', 'sunday', 'someday']), (0b1000001, 0, set()))
+        self.assertEqual(compile_schedule('monthly', ['1', '31', '32', 'x']), (0, (1 << 30) | 1, set()))
+        self.assertEqual(compile_schedule('yearly', ['02-29', '12-31', '13-01', '1-1', 5]), (0, 0, {229, 1231}))
+        # routines_dates saved as a string by old clients
+        self.assertEqual(compile_schedule('weekly', 'Monday Friday'), (0b10001, 0, set()))
+        self.assertEqual(compile_schedule('daily', ['monday']), (0, 0, set()))
+
+    def test_filter_matches_routine_matches(self):
+        routines = [
+            self.make_routine('weekly', ['tuesday', 'saturday']),
+            self.make_routine('monthly', ['1', '15', '29', '31']),
+            self.make_routine('yearly', ['01-01', '02-29', '07-15']),
+            self.make_routine('weekly', []),
+            self.make_routine('daily', ['monday']),
+        ]
+        day = date(2024, 1, 1)
+        while day.year == 2024:
+            self.assertEqual(
+                set(Routines.objects.filter(due_on_filter(day)).values_list('id', flat=True)),
+                {routine.id for routine in routines if routine_matches(routine, day)},
+                day,
+            )
+            day += timedelta(days=1)
+
+    def test_save_recompiles(self):
+        routine = self.make_routine('yearly', ['01-01'])
+        routine.routines_dates = ['03-04']
+        routine.save(update_fields=['routines_dates'])
+        self.assertEqual(list(routine.yearly_days.values_list('month_day', flat=True)), [304])
+        routine.routine_type = 'weekly'
+        routine.routines_dates = ['friday']
+        routine.save()
+        routine.refresh_from_db()
+        self.assertEqual((routine.weekday_mask, routine.yearly_days.count()), (0b10000, 0))
+
+    def test_compile_command(self):
+        stale = self.make_routine('monthly', ['5'])
+        compiled = self.make_routine('weekly', ['monday'])
+        Routines.objects.filter(id=stale.id).update(monthday_mask=0, schedule_version=0)
+        updated_at = Routines.objects.get(id=stale.id).updated_at
+        out = io.StringIO()
+        call_command('compile_routine_schedules', '--chunk-size=1', stdout=out)
+        self.assertIn('1 routine(s)', out.getvalue())
+        stale.refresh_from_db()
+        self.assertEqual(
+            (stale.monthday_mask, stale.schedule_version, stale.updated_at), (1 << 4, SCHEDULE_VERSION, updated_at)
+        )
+        call_command('compile_routine_schedules', '--all', stdout=out)
+        self.assertIn('2 routine(s)', out.getvalue())
+        self.assertEqual(Routines.objects.get(id=compiled.id).weekday_mask, 1)
+
+
+# One task per routine and day
+
+class RoutineOccurrenceTests(TasksTestCase):
+    """The (source_routine, occurrence_date) constraint and what apply_user_routines records"""
+
+    day = date(2025, 3, 10)
+
+    def setUp(self):
+        super().setUp()
+        self.routines = [
+            Routines.objects.create(
+                created_by=self.user, routines_title=f'r{n}', routine_type='weekly', routines_dates=DAY_NAMES
+            )
+            for n in range(2)
+        ]
+
+    def test_constraint(self):
+        self.make_task(source_routine=self.routines[0], occurrence_date=self.day)
+        self.make_task(source_routine=None, occurrence_date=self.day)
+        self.make_task(source_routine=None, occurrence_date=self.day)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.make_task(source_routine=self.routines[0], occurrence_date=self.day)
+
+    def test_only_the_written_rows_are_recorded(self):
+        # another writer creates the first routine's task between the probe and the insert
+        bulk_create = Tasks.objects.bulk_create
+        def racing_bulk_create(tasks, **kwargs):
+            self.make_task(source_routine=self.routines[0], occurrence_date=self.day, due_date=day_start(self.day))
+            return bulk_create(tasks, **kwargs)
+
+        get_task_counts(self.user)
+        with mock.patch.object(Tasks.objects, 'bulk_create', side_effect=racing_bulk_create):
+            tasks = apply_user_routines(self.user, self.day)
+        self.assertEqual(
+            [(task.source_routine_id, task.task_title) for task in tasks], [(self.routines[1].id, 'r1')]
+        )
+        self.assertIsNotNone(tasks[0].id)
+        self.assertEqual(Tasks.objects.filter(source_routine=self.routines[0]).count(), 1)
+        # the racing row is its writer's to count
+        self.assertEqual(TaskCounters.objects.get(user=self.user).total, 1)
+
+    def test_manual_apply_after_a_deleted_task(self):
+        tasks = apply_user_routines(self.user, self.day, manually=True)
+        Tasks.objects.filter(id=tasks[0].id).delete()
+        self.assertEqual(
+            [task.source_routine_id for task in apply_user_routines(self.user, self.day, manually=True)],
+            [self.routines[0].id],
+        )
+        self.assertEqual(Tasks.objects.count(), 2)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_manual_apply_locks_the_routines(self):
+        with CaptureQueriesContext(connection) as queries:
+            apply_user_routines(self.user, self.day, manually=True)
+        self.assertTrue(any(
+            'tasks_routines' in query['sql'] and 'FOR UPDATE' in query['sql'] for query in queries
+        ))
+
+    def test_link_routine_tasks(self):
+        for task_title, task_details, day in [
+            ('r0', 'Created from weekly routine: r0', self.day),
+            # a duplicate of the same day stays unlinked
+            ('r0', 'Created from weekly routine: r0', self.day),
+            ('r1', 'Created from weekly routine: r1', self.day + timedelta(days=1)),
+            ('r1', 'Created from monthly routine: r1', self.day),
+        ]:
+            self.make_task(task_title=task_title, task_details=task_details, due_date=day_start(day))
+        out = io.StringIO()
+        call_command('link_routine_tasks', stdout=out)
+        self.assertIn('Linked 2 task(s)', out.getvalue())
+        self.assertEqual(
+            [(task.source_routine_id, task.occurrence_date) for task in Tasks.objects.order_by('id')],
+            [
+                (self.routines[0].id, self.day),
+                (None, None),
+                (self.routines[1].id, self.day + timedelta(days=1)),
+                (None, None),
+            ],
+        )
+        # the linked days aren't created again
+        self.assertEqual(
+            [task.source_routine_id for task in apply_user_routines(self.user, self.day)], [self.routines[1].id]
+        )
+
+
+# Due date ranges
+
+class DueDateRangeTests(TasksTestCase):
+    """The range filters select the same tasks the due_date__date casts did"""
+
+    def setUp(self):
+        super().setUp()
+        start = day_start(self.today)
+        instants = [
+            start - timedelta(days=1),
+            start - timedelta(microseconds=1),
+            start,
+            start + timedelta(hours=23, minutes=59, seconds=59, microseconds=999999),
+            start + timedelta(days=1),
+            start + timedelta(days=7),
+            start + timedelta(days=8) - timedelta(microseconds=1),
+            start + timedelta(days=8),
+        ]
+        for due_date in instants:
+            for status in (False, True):
+                self.make_task(due_date=due_date, status=status)
+
+    def ids(self, query):
+        return set(Tasks.objects.filter(query).values_list('id', flat=True))
+
+    def test_today(self):
+        self.assertEqual(
+            self.ids(today_tasks_filter(self.today)),
+            self.ids(Q(due_date__date=self.today) | Q(due_date__date__lt=self.today, status=False)),
+        )
+        self.assertEqual(len(self.ids(today_tasks_filter(self.today))), 6)
+
+    def test_next_week(self):
+        self.assertEqual(
+            self.ids(next_week_tasks_filter(self.today)),
+            self.ids(Q(due_date__date__gte=self.today, due_date__date__lte=self.today + timedelta(days=7))),
+        )
+        self.assertEqual(len(self.ids(next_week_tasks_filter(self.today))), 10)
+
+    def test_day_window(self):
+        start, end, week_end = day_window(self.today)
+        self.assertEqual(
+            (start.tzinfo, end - start, week_end - start), (dt_timezone.utc, timedelta(days=1), timedelta(days=8))
+        )
+        self.assertEqual(start.date(), self.today)
+
+
+# The user's own day
+
+class UserTimeTests(TasksTestCase):
+    """Today is the day of the user's time zone, not the server's"""
+
+    # the same instant is 2025-03-11 in Kiritimati (UTC+14) and 2025-03-09 in Pago Pago (UTC-11)
+    now = datetime(2025, 3, 10, 10, 30, tzinfo=dt_timezone.utc)
+
+    def at(self, now):
+        stack = ExitStack()
+        stack.enter_context(mock.patch('django.utils.timezone.now', return_value=now))
+        stack.enter_context(mock.patch.dict(user_time._local_days, clear=True))
+        return stack
+
+    def test_user_today(self):
+        with self.at(self.now):
+            for name, day in (('Pacific/Kiritimati', 11), ('UTC', 10), ('Pacific/Pago_Pago', 9), ('Mars/Olympus', 10)):
+                self.user.timezone = name
+                self.assertEqual(user_today(self.user), date(2025, 3, day), name)
+
+    def test_the_day_changes_at_local_midnight(self):
+        self.user.timezone = 'Pacific/Kiritimati'
+        midnight = datetime(2025, 3, 10, 10, 0, tzinfo=dt_timezone.utc)
+        with self.at(midnight - timedelta(microseconds=1)) as stack:
+            self.assertEqual(user_today(self.user), date(2025, 3, 10))
+            stack.enter_context(mock.patch('django.utils.timezone.now', return_value=midnight))
+            self.assertEqual(user_today(self.user), date(2025, 3, 11))
+
+    def test_pages_use_the_user_day(self):
+        User.objects.filter(id=self.user.id).update(timezone='Pacific/Kiritimati')
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+        local_today = date(2025, 3, 11)
+        due_today = self.make_task(task_title='today', due_date=day_start(local_today))
+        self.make_task(task_title='utc today, done', due_date=day_start(local_today - timedelta(days=1)), status=True)
+        with self.at(self.now):
+            response = self.client.get('/api/tasks/today_tasks/')
+            self.assertEqual([task['id'] for task in response.data['user_tasks']], [due_today.id])
+            self.client.post(f'/api/tasks/task_complete/{due_today.id}/')
+        self.assertEqual(Tasks.objects.get(id=due_today.id).done_date.date(), local_today)
+
+    def test_profile_timezone(self):
+        response = self.client.put('/api/profile/update/', {'timezone': 'Africa/Cairo'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['timezone'], 'Africa/Cairo')
+        for name in ('Nowhere/City', '../etc/passwd', 'x' * 65):
+            response = self.client.put('/api/profile/update/', {'timezone': name}, format='json')
+            self.assertEqual(response.status_code, 400, name)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.timezone, 'Africa/Cairo')
+        self.assertEqual(self.client.get('/api/profile/').data['timezone'], 'Africa/Cairo')
+
+    def test_model_validation(self):
+        self.user.timezone = 'Nowhere/City'
+        with self.assertRaises(ValidationError):
+            self.user.full_clean()
+
+
+# Task search
+
+class SearchTests(TasksTestCase):
+    """tasks/search/ finds the user's tasks by the words of their title or details"""
+
+    def setUp(self):
+        super().setUp()
+        self.work = Category.objects.create(user=self.user, name='work')
+        self.matches = [
+            self.make_task(
+                task_title=f'Quarterly report {n}', status=n % 2 == 0, category=self.work if n < 5 else None
+            )
+            for n in range(25)
+        ]
+        self.matches.append(self.make_task(task_title='Send it', task_details='the REPORT for the quarterly review'))
+        self.make_task(task_title='Quarterly budget')
+        self.make_task(user=self.make_user('bob'), task_title='Quarterly report')
+
+    def search(self, status_code=200, **params):
+        response = self.client.get('/api/tasks/search/', params)
+        self.assertEqual(response.status_code, status_code, response.data)
+        return response.data
+
+    def test_pages(self):
+        found, cursor = [], None
+        while True:
+            page = self.search(q='quarterly report', **({'cursor': cursor} if cursor else {}))
+            self.assertLessEqual(len(page['user_tasks']), page['per_page'])
+            found += [task['id'] for task in page['user_tasks']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(found), sorted(task.id for task in self.matches))
+        self.assertEqual(len(found), len(set(found)))
+
+    def test_filters(self):
+        completed = self.search(q='report', status='completed')['user_tasks']
+        self.assertEqual({task['id'] for task in completed}, {task.id for task in self.matches if task.status})
+        in_work = self.search(q='report', category='work', status='pending')['user_tasks']
+        self.assertEqual({task['id'] for task in in_work}, {self.matches[1].id, self.matches[3].id})
+        self.assertEqual(self.search(q='nothing like it')['user_tasks'], [])
+
+    def test_bad_requests(self):
+        for params in (
+            {},
+            {'q': '  '},
+            {'q': 'x' * 201},
+            {'q': 'report', 'status': 'done'},
+            {'q': 'report', 'cursor': 'not-a-cursor'},
+            {'q': 'report', 'cursor': encode_search_cursor(1, 'x')},
+        ):
+            self.search(400, **params)
+
+    @skipUnless(connection.vendor == 'postgresql', 'ts_rank needs PostgreSQL')
+    def test_pages_of_equal_rank(self):
+        # the same title ranks the same, so only the id orders the pages; ts_rank's real
+        # must compare equal to the rank in the cursor or rows are skipped or repeated
+        tied = [self.make_task(task_title='Dentist appointment') for _ in range(45)]
+        found, ranks, cursor = [], set(), None
+        while True:
+            page = self.search(q='dentist', **({'cursor': cursor} if cursor else {}))
+            found += [task['id'] for task in page['user_tasks']]
+            ranks |= {task['rank'] for task in page['user_tasks']}
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(ranks), 1)
+        self.assertEqual(found, sorted((task.id for task in tied), reverse=True))
+
+    def test_cursor(self):
+        self.assertEqual(decode_search_cursor(encode_search_cursor(0.5, 7)), (0.5, 7))
+        self.assertIsNone(decode_search_cursor(encode_search_cursor(True, 7)))
+
+
+# Autocomplete
+
+class AutocompleteTests(TasksTestCase):
+    """tasks/autocomplete/ suggests the user's own titles and categories"""
+
+    def setUp(self):
+        super().setUp()
+        recent_suggestions.forget(self.user.id)
+        for title, count in (('Write the report', 1), ('Water the plants', 3), ('Rewrite notes', 1), ('Call mom', 1)):
+            for _ in range(count):
+                self.make_task(task_title=title)
+        self.make_task(user=self.make_user('bob'), task_title='Wash the car')
+
+    def suggest(self, status_code=200, **params):
+        response = self.client.get('/api/tasks/autocomplete/', params)
+        self.assertEqual(response.status_code, status_code, response.data)
+        return response.data.get('suggestions')
+
+    def test_titles(self):
+        # the prefixes first, the most used first among them
+        self.assertEqual(self.suggest(q='wr'), ['Write the report', 'Rewrite notes'])
+        self.assertEqual(self.suggest(q='w'), ['Water the plants', 'Write the report', 'Rewrite notes'])
+        self.assertEqual(self.suggest(q='w', limit='1'), ['Water the plants'])
+        self.assertEqual(self.suggest(q='w', limit='oops'), self.suggest(q='w'))
+
+    def test_categories_fold(self):
+        for name, uses in (('Work', 2), ('work ', 1), ('Workout', 0)):
+            category = Category.objects.create(user=self.user, name=name)
+            for _ in range(uses):
+                self.make_task(category=category)
+        self.assertEqual(self.suggest(q='WOR', field='category'), ['Work', 'Workout'])
+
+    def test_repeats_are_answered_from_memory(self):
+        self.suggest(q='wa')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest(q='WA'), ['Water the plants'])
+
+    def test_a_write_forgets_the_suggestions(self):
+        self.assertEqual(self.suggest(q='wa'), ['Water the plants'])
+        self.client.post('/api/tasks/add_task/', {'task_title': 'Walk the dog'}, format='json')
+        self.assertEqual(self.suggest(q='wa'), ['Water the plants', 'Walk the dog'])
+
+    def test_bad_requests(self):
+        self.suggest(400, q='')
+        self.suggest(400, q='x' * 101)
+        self.suggest(400, q='wa', field='details')
+
+
+# Categories
+
+class CategoryTests(TasksTestCase):
+    """Categories are per-user rows the tasks and routines reference by id"""
+
+    def setUp(self):
+        super().setUp()
+        self.work = Category.objects.create(user=self.user, name='work')
+        self.home = Category.objects.create(user=self.user, name='home')
+        for status in (False, False, True):
+            self.make_task(category=self.work, status=status)
+        self.make_task(category=self.home, status=True)
+        self.routine = Routines.objects.create(created_by=self.user, routines_title='r', category=self.home)
+        Category.objects.create(user=self.make_user('bob'), name='work')
+
+    def test_facets(self):
+        response = self.client.get('/api/tasks/categories/')
+        self.assertEqual(
+            [(category['name'], category['total'], category['pending']) for category in response.data['categories']],
+            [('home', 1, 0), ('work', 3, 2)],
+        )
+
+    def test_writes_resolve_the_names(self):
+        self.client.post('/api/tasks/add_task/', {'task_title': 'a', 'task_category': ' work '}, format='json')
+        self.client.post('/api/tasks/add_task/', {'task_title': 'b', 'task_category': 'garden'}, format='json')
+        self.client.post('/api/tasks/add_task/', {'task_title': 'c', 'task_category': 'garden'}, format='json')
+        self.assertEqual(Tasks.objects.get(task_title='a').category, self.work)
+        self.assertEqual(Category.objects.filter(user=self.user, name='garden').count(), 1)
+        self.assertEqual(Tasks.objects.filter(category__name='garden').count(), 2)
+
+    def test_rename(self):
+        since = self.age()
+        response = self.client.post(f'/api/tasks/categories/{self.work.id}/rename/', {'name': ' office '}, format='json')
+        self.assertEqual(response.data['category'], {'id': self.work.id, 'name': 'office'})
+        page = self.client.get('/api/tasks/all_tasks/').data['user_tasks']
+        self.assertEqual(sorted({task['task_category'] for task in page}), ['home', 'office'])
+        # the rename reaches the clients as the category row, not as its tasks
+        pull = self.client.get('/api/tasks/sync/pull/', {'cursor': since}).data
+        self.assertEqual(([category['name'] for category in pull['categories']], pull['tasks']), (['office'], []))
+
+    def test_rename_to_an_existing_name_merges(self):
+        response = self.client.post(f'/api/tasks/categories/{self.home.id}/rename/', {'name': 'work'}, format='json')
+        self.assertEqual(response.data['category']['id'], self.work.id)
+        self.assertFalse(Category.objects.filter(id=self.home.id).exists())
+        self.assertEqual(Tasks.objects.filter(category=self.work).count(), 4)
+        self.routine.refresh_from_db()
+        self.assertEqual(self.routine.category, self.work)
+        self.assertTrue(Tombstone.objects.filter(record_type='category', record_id=self.home.id).exists())
+
+    def test_rename_errors(self):
+        response = self.client.post(f'/api/tasks/categories/{self.work.id}/rename/', {'name': '  '}, format='json')
+        self.assertEqual(response.status_code, 400)
+        other = Category.objects.get(user__username='bob')
+        response = self.client.post(f'/api/tasks/categories/{other.id}/rename/', {'name': 'mine'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_link_categories(self):
+        legacy = [
+            self.make_task(task_category='Work'),
+            self.make_task(task_category=' Work '),
+            self.make_task(task_category='work'),
+            self.make_task(task_category='   '),
+        ]
+        Routines.objects.create(created_by=self.user, routines_title='r2', routine_category='Work')
+        out = io.StringIO()
+        call_command('link_categories', stdout=out)
+        self.assertIn('Linked 5', out.getvalue())
+        self.assertEqual(
+            [(task.category.name if task.category else None, task.task_category) for task in
+             Tasks.objects.filter(id__in=[task.id for task in legacy]).order_by('id')],
+            [('Work', ''), ('Work', ''), ('work', ''), (None, '')],
+        )
+        self.assertEqual(Routines.objects.get(routines_title='r2').category.name, 'Work')
+        call_command('link_categories', stdout=out)
+        self.assertIn('Linked 0', out.getvalue())
+
+
+# Daily task stats
+
+class DailyStatsTests(TasksTestCase):
+    """The rollup rows kept by every write equal the ones rebuilt from the tasks"""
+
+    def stats_rows(self):
+        return sorted(
+            (row.day, row.category_id or 0, row.created, row.completed, row.overdue)
+            for row in DailyTaskStats.objects.filter(user=self.user)
+            if row.created or row.completed or row.overdue
+        )
+
+    def assertStatsMatchRebuild(self):
+        kept = self.stats_rows()
+        rebuild_daily_stats(self.user.id)
+        self.assertEqual(kept, self.stats_rows())
+
+    def add_task(self, days, category='general'):
+        response = self.client.post('/api/tasks/add_task/', {
+            'task_title': 'task', 'task_category': category, 'due_date': str(self.today + timedelta(days=days)),
+        }, format='json')
+        return response.data['task']['id']
+
+    def test_writes_keep_the_stats(self):
+        ids = [self.add_task(days, category) for days, category in ((-3, 'work'), (-1, ''), (0, 'work'), (2, 'home'))]
+        self.assertStatsMatchRebuild()
+        self.client.post(f'/api/tasks/task_complete/{ids[0]}/', format='json')
+        self.assertStatsMatchRebuild()
+        self.client.post(f'/api/tasks/task_complete/{ids[0]}/', format='json')
+        self.assertStatsMatchRebuild()
+        self.client.patch(f'/api/tasks/update_task/{ids[1]}/', {
+            'task_category': 'home', 'due_date': str(self.today - timedelta(days=5)),
+        }, format='json')
+        self.assertStatsMatchRebuild()
+        self.client.post('/api/tasks/multiple_task_complete/', {'task_ids': ids[1:]}, format='json')
+        self.assertStatsMatchRebuild()
+        self.client.patch('/api/tasks/multiple_update_task_dates/', {
+            'task_ids': ids, 'due_date': str(self.today - timedelta(days=2)),
+        }, format='json')
+        self.assertStatsMatchRebuild()
+        self.client.patch(
+            '/api/tasks/multiple_update_task_category/', {'task_ids': ids[:2], 'task_category': 'work'}, format='json'
+        )
+        self.assertStatsMatchRebuild()
+        self.client.post('/api/tasks/sync/', {'mutations': [
+            {'action': 'add_task', 'payload': {'task_title': 's', 'task_category': 'home'}},
+            {'action': 'toggle_complete', 'task_id': ids[2]},
+            {'action': 'delete_task', 'task_id': ids[3]},
+        ]}, format='json')
+        self.assertStatsMatchRebuild()
+        home = Category.objects.get(user=self.user, name='home')
+        self.client.post(f'/api/tasks/categories/{home.id}/rename/', {'name': 'work'}, format='json')
+        self.assertStatsMatchRebuild()
+        self.client.delete('/api/tasks/multiple_delete_task/', {'task_ids': ids[:2]}, format='json')
+        self.assertStatsMatchRebuild()
+
+    def test_first_write_builds_the_history(self):
+        self.make_task(due_date=day_start(self.today - timedelta(days=1)))
+        self.assertFalse(DailyTaskStats.objects.exists())
+        self.add_task(0)
+        self.assertEqual(sum(row.created for row in DailyTaskStats.objects.filter(user=self.user)), 2)
+
+    def test_endpoint(self):
+        work = [self.add_task(days, 'work') for days in (-2, -1, 0)]
+        self.add_task(-1, 'home')
+        self.client.post(f'/api/tasks/task_complete/{work[0]}/', format='json')
+
+        week = self.client.get('/api/tasks/stats/').data
+        self.assertEqual((week['start'], week['end']), (str(self.today - timedelta(days=6)), str(self.today)))
+        self.assertEqual(len(week['series']), 7)
+        # the one completed late is overdue on its due day, today's pending one isn't yet
+        self.assertEqual(week['totals'], {'created': 4, 'completed': 1, 'overdue': 3})
+        self.assertEqual(
+            [(category['name'], category['created']) for category in week['categories']], [('home', 1), ('work', 3)]
+        )
+        work_only = self.client.get('/api/tasks/stats/', {'period': 'month', 'category': 'work'}).data
+        self.assertEqual((len(work_only['series']), work_only['totals']['created']), (30, 3))
+        year = self.client.get('/api/tasks/stats/', {'period': 'year'}).data
+        self.assertEqual(len(year['series']), 12)
+        self.assertEqual(year['series'][-1]['date'], str(self.today.replace(day=1)))
+        self.assertEqual(self.client.get('/api/tasks/stats/', {'period': 'decade'}).status_code, 400)
+
+    def test_period_start(self):
+        self.assertEqual(period_start('year', date(2025, 3, 10)), date(2024, 4, 1))
+        self.assertEqual(period_start('year', date(2025, 12, 31)), date(2025, 1, 1))
+        self.assertEqual(period_start('week', date(2025, 3, 1)), date(2025, 2, 23))
+
+
+# Task archive
+
+class ArchiveTests(TasksTestCase):
+    """Archiving moves old completed tasks out of Tasks without changing any count"""
+
+    def setUp(self):
+        super().setUp()
+        long_ago = timezone.now() - timedelta(days=200)
+        self.old = [
+            self.make_task(task_title=f'old {n}', status=True, due_date=long_ago, done_date=long_ago)
+            for n in range(15)
+        ]
+        # completed long ago but due recently, or still pending: they stay
+        self.make_task(task_title='done early', status=True, due_date=day_start(self.today), done_date=long_ago)
+        self.make_task(task_title='forgotten', status=False, due_date=long_ago)
+        for n in range(23):
+            self.make_task(task_title=f'task {n}', due_date=day_start(self.today + timedelta(days=n % 3)))
+        self.make_task(user=self.make_user('bob'), task_title='bob', status=True, due_date=long_ago, done_date=long_ago)
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_tasks', '--chunk-size=4', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        self.assertIn('16 task(s)', self.archive('--dry-run'))
+        self.assertFalse(TaskArchive.objects.exists())
+
+    def test_counts_and_stats_stay(self):
+        counters = get_task_counts(self.user)
+        rebuild_daily_stats(self.user.id)
+        stats = sorted(
+            DailyTaskStats.objects.filter(user=self.user).values_list('day', 'created', 'completed', 'overdue')
+        )
+        self.assertIn('Archived 16 task(s)', self.archive())
+
+        self.assertEqual(
+            set(TaskArchive.objects.filter(created_by=self.user).values_list('id', flat=True)),
+            {task.id for task in self.old},
+        )
+        self.assertFalse(Tasks.objects.filter(id__in=[task.id for task in self.old]).exists())
+        self.assertEqual(get_task_counts(self.user), counters)
+        self.assertEqual(
+            TaskCounters.objects.values(*COUNTER_FIELDS).get(user=self.user),
+            count_tasks([self.user.id], self.today)[self.user.id],
+        )
+        rebuild_daily_stats(self.user.id)
+        self.assertEqual(
+            sorted(DailyTaskStats.objects.filter(user=self.user).values_list('day', 'created', 'completed', 'overdue')),
+            stats,
+        )
+        self.assertEqual(self.client.get('/api/tasks/all_tasks/').data['total_number_tasks'], 40)
+
+    def test_pages_with_the_archive(self):
+        self.archive()
+        ids, cursor, pages = [], '', 0
+        while cursor is not None:
+            data = self.client.get('/api/tasks/all_tasks/', {'include_archived': 'true', 'cursor': cursor}).data
+            ids += [task['id'] for task in data['user_tasks']]
+            cursor = data['pagination']['next_cursor']
+            pages += 1
+        # 25 tasks on two pages, then 15 archived ones on one
+        self.assertEqual(pages, 3)
+        self.assertEqual(set(ids[-15:]), {task.id for task in self.old})
+        self.assertEqual(len(set(ids)), 40)
+
+        # back from the first archived page to the last (full) page of tasks
+        first_archived = self.client.get(
+            '/api/tasks/all_tasks/', {'include_archived': '1', 'cursor': ARCHIVE_CURSOR_PREFIX}
+        ).data
+        self.assertTrue(all('archived_at' in task for task in first_archived['user_tasks']))
+        previous = self.client.get(
+            '/api/tasks/all_tasks/', {'include_archived': '1', 'cursor': first_archived['pagination']['prev_cursor']}
+        ).data
+        self.assertEqual([task['id'] for task in previous['user_tasks']], ids[5:25])
+        self.assertEqual(previous['pagination']['next_cursor'], ARCHIVE_CURSOR_PREFIX)
+        self.assertIsNotNone(previous['pagination']['prev_cursor'])
+
+        without = self.client.get('/api/tasks/all_tasks/', {'page': 2}).data
+        self.assertEqual((without['pagination']['num_pages'], len(without['user_tasks'])), (2, 5))
+        numbered = self.client.get('/api/tasks/all_tasks/', {'page': 2, 'include_archived': 'yes'}).data
+        self.assertEqual([task['id'] for task in numbered['user_tasks']], ids[20:40])
+
+    def test_export_includes_the_archive(self):
+        self.archive()
+        response = self.client.get('/api/tasks/export/', {'file_type': 'ndjson'})
+        titles = [json.loads(line)['title'] for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(titles), 40)
+        self.assertIn('old 0', titles)
+
+
+# Tasks table partitioning
+
+class PartitionCommandTests(TasksTestCase):
+    """partition_tasks only runs when asked for a number of partitions or a revert"""
+
+    def test_explicit_opt_in(self):
+        for args in ((), ('--partitions=4', '--revert')):
+            with self.assertRaises(CommandError):
+                call_command('partition_tasks', *args, stdout=io.StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'the Tasks table is only partitioned on PostgreSQL')
+class TaskPartitionTests(TransactionTestCase):
+    """
+    Partitioning a populated Tasks table and turning it back keeps its rows, ids, foreign
+    keys and constraints. A TransactionTestCase: the rebuild ALTERs tables that the rows
+    written in the same transaction have deferred foreign key checks pending on.
+    """
+
+    day = date(2025, 3, 10)
+
+    def setUp(self):
+        self.addCleanup(self.unpartition)
+        self.users = [User.objects.create_user(username=f'user{n}', password='x') for n in range(6)]
+        self.routines = {}
+        for user in self.users:
+            category = Category.objects.create(user=user, name='work')
+            routine = self.routines[user.id] = Routines.objects.create(
+                created_by=user, routines_title='r', routine_type='weekly', routines_dates=DAY_NAMES
+            )
+            for n in range(10):
+                Tasks.objects.create(
+                    created_by=user, task_title=f'{user.username} {n}', category=category if n % 2 else None,
+                    due_date=day_start(self.day + timedelta(days=n)),
+                )
+            Tasks.objects.create(created_by=user, task_title='r', source_routine=routine, occurrence_date=self.day)
+
+    def unpartition(self):
+        with connection.cursor() as cursor:
+            partitioned = tasks_partitions(cursor)
+        if partitioned:
+            rebuild_tasks_table(0)
+
+    def rows(self):
+        return list(Tasks.objects.order_by('id').values_list(
+            'id', 'created_by_id', 'task_title', 'category_id', 'due_date', 'source_routine_id', 'occurrence_date'
+        ))
+
+    def definitions(self):
+        """The foreign keys and indexes of the table, apart from the partition key the unique ones get"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                [Tasks._meta.db_table],
+            )
+            foreign_keys = sorted(row[0] for row in cursor.fetchall())
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [Tasks._meta.db_table])
+            indexes = sorted(row[0] for row in cursor.fetchall())
+        return foreign_keys, indexes
+
+    def partition_sizes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass", [Tasks._meta.db_table]
+            )
+            sizes = []
+            for (partition,) in cursor.fetchall():
+                cursor.execute(f"SELECT count(*) FROM {partition}")
+                sizes.append(cursor.fetchone()[0])
+        return sizes
+
+    def assertConstraintsHold(self):
+        user = self.users[0]
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tasks.objects.create(
+                created_by=user, task_title='again', source_routine=self.routines[user.id], occurrence_date=self.day
+            )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tasks.objects.create(created_by_id=max(u.id for u in self.users) + 100, task_title='nobody')
+
+    def test_partition_and_revert(self):
+        rows, definitions = self.rows(), self.definitions()
+        out = io.StringIO()
+
+        call_command('partition_tasks', '--partitions=4', stdout=out)
+        with connection.cursor() as cursor:
+            self.assertEqual(tasks_partitions(cursor), 4)
+        self.assertEqual(self.rows(), rows)
+        self.assertEqual(self.definitions(), definitions)
+        sizes = self.partition_sizes()
+        self.assertEqual((len(sizes), sum(sizes)), (4, len(rows)))
+        self.assertConstraintsHold()
+        # the ids go on from the old sequence
+        self.assertGreater(Tasks.objects.create(created_by=self.users[1], task_title='new').id, rows[-1][0])
+
+        call_command('partition_tasks', '--partitions=4', stdout=out)
+        self.assertIn('already has 4 partitions', out.getvalue())
+
+        rows = self.rows()
+        call_command('partition_tasks', '--revert', stdout=out)
+        with connection.cursor() as cursor:
+            self.assertEqual(tasks_partitions(cursor), 0)
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'tasks_routine_occurrence_unique'")
+            self.assertNotIn('created_by_id', cursor.fetchone()[0])
+        self.assertEqual(self.rows(), rows)
+        self.assertEqual(self.definitions(), definitions)
+        self.assertConstraintsHold()
+
+    def test_failed_rebuild_rolls_back(self):
+        rows, definitions = self.rows(), self.definitions()
+        with mock.patch('tasks.utils.task_partitions.install_search_trigger', side_effect=DatabaseError('boom')):
+            with self.assertRaises(DatabaseError):
+                rebuild_tasks_table(4)
+        with connection.cursor() as cursor:
+            self.assertEqual(tasks_partitions(cursor), 0)
+        self.assertEqual((self.rows(), self.definitions()), (rows, definitions))
+
+
+# Cached JWT users
+
+class CachedUserTests(TasksTestCase):
+    """The authentication reads a user's row once, and every process drops it when the user changes"""
+
+    def setUp(self):
+        super().setUp()
+        recent_users.clear()
+        self.token = AccessToken.for_user(self.user)
+        self.authentication = CachedJWTAuthentication()
+
+    def authenticate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.authentication.get_user(self.token)
+
+    def in_another_process(self, write):
+        """Run write as another process would: this process keeps its entry, only the shared stamp changes"""
+        key = str(self.user.id)
+        entry = recent_users._users[key]
+        with self.captureOnCommitCallbacks(execute=True):
+            write(User.objects.get(id=self.user.id))
+        recent_users._users[key] = entry
+
+    def test_hit_skips_the_query(self):
+        self.assertEqual(self.authenticate().username, 'alice')
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.id, user.username, user.timezone), (self.user.id, 'alice', 'UTC'))
+        # every request gets its own instance
+        self.assertIsNot(user, self.authenticate())
+
+    def test_save_drops_the_entry(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.timezone = 'Africa/Cairo'
+            self.user.save()
+        self.assertEqual(self.authenticate().timezone, 'Africa/Cairo')
+
+    def test_other_processes_refuse_a_deactivated_user(self):
+        self.authenticate()
+        def deactivate(user):
+            user.is_active = False
+            user.save()
+        self.in_another_process(deactivate)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_other_processes_read_a_new_password(self):
+        self.authenticate()
+        def change_password(user):
+            user.set_password('Another-pass-456')
+            user.save()
+        self.in_another_process(change_password)
+        self.assertTrue(self.authenticate().check_password('Another-pass-456'))
+
+    def test_evicted_stamp_reads_the_row(self):
+        self.authenticate()
+        caches['default'].clear()
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_deleted_user(self):
+        self.authenticate()
+        self.in_another_process(lambda user: user.delete())
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_requests(self):
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(self.client.get('/api/profile/').status_code, 200)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        # a write past the signals is only seen when the entry expires
+        self.assertEqual(self.client.get('/api/profile/').status_code, 200)
+        restamp_user(str(self.user.id))
+        self.assertEqual(self.client.get('/api/profile/').status_code, 401)
+
+
+# Refresh token blacklist
+
+class TokenBlacklistTests(TasksTestCase):
+    """Replays of blacklisted refresh tokens are refused from memory, the others by the table"""
+
+    def setUp(self):
+        super().setUp()
+        revoked_tokens.clear()
+
+    def refresh(self, token, status_code=200):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/refresh/', {'refresh': str(token)}, format='json')
+        self.assertEqual(response.status_code, status_code)
+        return response.data
+
+    def test_replay_is_refused_from_memory(self):
+        token = RefreshToken.for_user(self.user)
+        self.assertIn('refresh', self.refresh(token))
+        with self.assertNumQueries(0):
+            self.refresh(token, 401)
+
+    def test_unknown_jti_asks_the_table(self):
+        token = RefreshToken.for_user(self.user)
+        revoked_tokens.contains('load')
+        # blacklisted by another process: this one never hears of it
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+        self.assertFalse(revoked_tokens.contains(token['jti']))
+        self.refresh(token, 401)
+
+    def test_lazy_load(self):
+        tokens = [RefreshToken.for_user(self.user) for _ in range(3)]
+        for token in tokens[:2]:
+            BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+        with self.assertNumQueries(1):
+            self.assertTrue(revoked_tokens.contains(tokens[0]['jti']))
+        with self.assertNumQueries(0):
+            self.assertEqual([revoked_tokens.contains(token['jti']) for token in tokens], [True, True, False])
+
+    def test_rolled_back_blacklisting_is_forgotten(self):
+        token = CachedRefreshToken.for_user(self.user)
+        revoked_tokens.contains('load')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                token.blacklist()
+                raise DatabaseError('rolled back')
+        self.assertFalse(revoked_tokens.contains(token['jti']))
+
+    def test_lru(self):
+        tokens = RevokedTokens(max_tokens=2)
+        tokens._loaded = True
+        later = timezone.now() + timedelta(hours=1)
+        for jti in ('a', 'b'):
+            tokens.add(jti, later)
+        tokens.contains('a')
+        tokens.add('c', later)
+        tokens.add('expired', timezone.now() - timedelta(seconds=1))
+        self.assertEqual([tokens.contains(jti) for jti in ('a', 'b', 'c', 'expired')], [False, False, True, False])
+
+    def test_logout(self):
+        token = RefreshToken.for_user(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/logout/', {'refresh': str(token)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            self.refresh(token, 401)
+        self.assertEqual(self.client.post('/api/auth/logout/', {'refresh': str(token)}, format='json').status_code, 400)
+
+    def test_prune_expired_tokens(self):
+        expired = timezone.now() - timedelta(days=1)
+        live = RefreshToken.for_user(self.user)
+        for n in range(5):
+            outstanding = OutstandingToken.objects.create(
+                user=self.user, jti=f'old{n}', token='x', created_at=expired - timedelta(days=30), expires_at=expired
+            )
+            if n % 2:
+                BlacklistedToken.objects.create(token=outstanding)
+        out = io.StringIO()
+        call_command('prune_expired_tokens', '--dry-run', stdout=out)
+        self.assertIn('5 expired tokens', out.getvalue())
+        self.assertEqual(OutstandingToken.objects.count(), 6)
+        call_command('prune_expired_tokens', '--chunk-size=2', stdout=out)
+        self.assertIn('Deleted 5 expired tokens (2 blacklisted)', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
@@ -1,8 +1,12 @@
 from django.urls import path, include
 
 from .main import routine_managment
+from .main import category_managment
 from .main import task_managment
+from .main import task_stats
 from .main import sync
+from .main import export_data
+from .main import import_data
 from . import views
 from .auth import login, register, logout, google_auth, forget_password, profile
 
@@ -47,6 +51,9 @@ urlpatterns = [
     path('tasks/today_tasks/', task_managment.today_tasks, name='today_tasks'),
     path('tasks/all_tasks/', task_managment.all_tasks, name='all_tasks'),
     path('tasks/next_week_tasks/', task_managment.next_week_tasks, name='next_week_tasks'),
+    path('tasks/search/', task_managment.search_tasks, name='search_tasks'),
+    path('tasks/autocomplete/', task_managment.autocomplete, name='autocomplete'),
+    path('tasks/stats/', task_stats.task_stats, name='task_stats'),
 
     path('tasks/add_task/', task_managment.add_task, name='add_task'),
     path('tasks/update_task/<int:task_id>/', task_managment.update_task, name='update_task'),
@@ -59,8 +66,17 @@ urlpatterns = [
     path('tasks/multiple_update_task_dates/', task_managment.multiple_update_task_dates, name='multiple_update_task_dates'),
     path('tasks/multiple_update_task_category/', task_managment.multiple_update_task_category, name='multiple_update_task_category'),
 
+    # Categories with their task counts, and renaming (or merging) one
+    path('tasks/categories/', category_managment.show_categories, name='show_categories'),
+    path('tasks/categories/<int:category_id>/rename/', category_managment.rename_category_view, name='rename_category'),
+
+    # Full account export (streamed NDJSON / CSV) and bulk import
+    path('tasks/export/', export_data.export_data, name='export_data'),
+    path('tasks/import/', import_data.import_data, name='import_data'),
+
     # Offline sync endpoint made by anti gravity AI from google
     path('tasks/sync/', sync.sync_mutations, name='sync_mutations'),
+    path('tasks/sync/pull/', sync.sync_pull, name='sync_pull'),
 
     # Routine management URLs
     path('routines/', routine_managment.show_routines, name='show_routines'),
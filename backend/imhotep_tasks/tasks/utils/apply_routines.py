@@ -1,76 +1,121 @@
-from django.db.models import Q
-from django.utils import timezone
-from datetime import datetime, timedelta
-from ..models import Tasks, Routines
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.lookups import GreaterThan
+from ..models import Tasks, Routines, RoutineYearlyDay
+from . import task_changes
+from .routine_schedule import DAY_NAMES, SCHEDULE_VERSION, month_day, routine_dates_list
 
-def apply_routines(request, target_date, manually=False):
+def _details_prefix(routine):
+    return f"Created from {routine.routine_type} routine:"
+
+def routine_matches(routine, target_date):
+    """Whether the routine creates a task on target_date, from routines_dates"""
+    routine_dates = routine_dates_list(routine.routines_dates)
+
+    if routine.routine_type == 'weekly':
+        # Weekly routines: check if current day name is in routine_dates
+        return DAY_NAMES[target_date.weekday()] in routine_dates
+    elif routine.routine_type == 'monthly':
+        # Monthly routines: check if current day of month is in routine_dates
+        return str(target_date.day) in routine_dates
+    elif routine.routine_type == 'yearly':
+        # Yearly routines: check if current MM-DD is in routine_dates
+        return target_date.strftime('%m-%d') in routine_dates
+    return False
+
+def due_on_filter(target_date):
+    """The routines whose compiled schedule falls on target_date (a mask is 0 for the other types)"""
+    return (
+        Q(GreaterThan(F('weekday_mask').bitand(1 << target_date.weekday()), 0))
+        | Q(GreaterThan(F('monthday_mask').bitand(1 << (target_date.day - 1)), 0))
+        | Q(Exists(RoutineYearlyDay.objects.filter(routine=OuterRef('pk'), month_day=month_day(target_date))))
+    )
+
+def apply_user_routines(user, target_date, manually=False):
     """
-    Apply routines for the given target date.
-    Supports weekly, monthly, and yearly routine types.
+    Create the tasks of the user's active routines that fall on target_date.
+    Reads the routines due that date with one query, then locks the ones to apply, probes for
+    their tasks of that date and writes the new tasks and last_applied with one bulk query each.
+    Unless manually triggered, a routine applied that day is skipped; a routine never gets
+    two tasks for the same day.
+    Returns the tasks actually created.
     """
-    # Get current date information
-    current_weekday = target_date.weekday()
-    day_names = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-    current_day_name = day_names[current_weekday]
-    current_day_of_month = target_date.day
-    current_date_str = target_date.strftime('%m-%d')  # MM-DD format for yearly routines
-    
-    #get all active routines for the user
-    active_routines = Routines.objects.filter(
-        created_by=request.user,
-        status=True
-    )
-    
-    #check each routine to see if it should create a task today
-    for routine in active_routines:
-        should_create_task = False
-        
-        # Handle routines_dates as a list (JSONField)
-        routine_dates = routine.routines_dates
-        if not isinstance(routine_dates, list):
-            # Fallback for old data that might be stored as string
-            routine_dates = str(routine_dates).lower().split() if routine_dates else []
-        
-        # Check if routine applies to current day based on routine type
-        last_applied_date = routine.last_applied.date() if routine.last_applied else None
-        target_date_only = target_date.date() if hasattr(target_date, 'date') else target_date
-        
-        # Check if a task already exists for this routine on this date
-        existing_task = Tasks.objects.filter(
-            created_by=request.user,
-            task_title=routine.routines_title,
-            due_date__date=target_date_only,
-            task_details__startswith=f"Created from {routine.routine_type} routine:"
-        ).exists()
-        
-        # Skip if already applied today or task already exists (unless manually triggered)
-        if (last_applied_date == target_date_only or existing_task) and not manually:
-            continue
-            
-        if routine.routine_type == 'weekly':
-            # Weekly routines: check if current day name is in routine_dates
-            if current_day_name in routine_dates:
-                should_create_task = True
-                
-        elif routine.routine_type == 'monthly':
-            # Monthly routines: check if current day of month is in routine_dates
-            if str(current_day_of_month) in routine_dates:
-                should_create_task = True
-                
-        elif routine.routine_type == 'yearly':
-            # Yearly routines: check if current MM-DD is in routine_dates
-            if current_date_str in routine_dates:
-                should_create_task = True
-        
-        if should_create_task:
-            # create task from routine using date only
-            Tasks.objects.create(
+    target_date_only = target_date.date() if hasattr(target_date, 'date') else target_date
+
+    #get the active routines that fall on the date; the ones not compiled yet are checked here
+    routines = [
+        routine
+        for routine in Routines.objects.filter(created_by=user, status=True).filter(
+            due_on_filter(target_date_only) | Q(schedule_version__lt=SCHEDULE_VERSION)
+        ).order_by('id')
+        if routine.schedule_version == SCHEDULE_VERSION or routine_matches(routine, target_date_only)
+    ]
+
+    if not manually:
+        routines = [
+            routine for routine in routines
+            if not (routine.last_applied and routine.last_applied.date() == target_date_only)
+        ]
+    if not routines:
+        return []
+
+    with transaction.atomic():
+        # lock the routines, manual applies included: a concurrent apply for the same user
+        # waits here, then finds them applied or their tasks created
+        applied = {
+            routine_id
+            for routine_id, last_applied in Routines.objects.select_for_update().filter(
+                id__in=[routine.id for routine in routines]
+            ).values_list('id', 'last_applied')
+            if last_applied and last_applied.date() == target_date_only
+        }
+        if not manually:
+            routines = [routine for routine in routines if routine.id not in applied]
+
+        # the routines whose task of the date exists already (a manual apply, a deleted last_applied...)
+        existing = set(Tasks.objects.filter(
+            source_routine__in=[routine.id for routine in routines],
+            occurrence_date=target_date_only,
+        ).values_list('source_routine_id', flat=True))
+        routines = [routine for routine in routines if routine.id not in existing]
+        if not routines:
+            return []
+
+        # create task from routine using date only
+        tasks = [
+            Tasks(
                 task_title=routine.routines_title,
-                task_details=f"Created from {routine.routine_type} routine: {routine.routines_title}",
+                task_details=f"{_details_prefix(routine)} {routine.routines_title}",
                 due_date=target_date,
-                created_by=request.user,
+                created_by=user,
                 status=False,
-                task_category=routine.routine_category or "general",
+                category_id=routine.category_id,
+                source_routine=routine,
+                occurrence_date=target_date_only,
             )
+            for routine in routines
+        ]
+        for routine in routines:
             routine.last_applied = target_date_only
-            routine.save()
+        task_changes.touch(routines)
+
+        # the unique (source_routine, occurrence_date) constraint is the last word on duplicates;
+        # with ignore_conflicts the rows get no ids and the conflicting ones aren't written, so
+        # read back the rows written by this insert (a row that won the race is older) and record
+        # only those
+        Tasks.objects.bulk_create(tasks, ignore_conflicts=True)
+        tasks = list(Tasks.objects.filter(
+            source_routine__in=[routine.id for routine in routines],
+            occurrence_date=target_date_only,
+            creation_date__gte=tasks[0].creation_date,
+        ).order_by('id'))
+        Routines.objects.bulk_update(routines, ['last_applied', 'updated_at'])
+        task_changes.record_task_changes(user.id, after=[task_changes.task_snapshot(task) for task in tasks])
+    return tasks
+
+def apply_routines(request, target_date, manually=False):
+    """
+    Apply routines for the given target date.
+    Supports weekly, monthly, and yearly routine types.
+    """
+    return apply_user_routines(request.user, target_date, manually)
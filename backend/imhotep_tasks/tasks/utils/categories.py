@@ -0,0 +1,101 @@
+"""
+The per-user Category table behind task and routine categories.
+
+Clients still send and receive a category as its name (task_category / routine_category);
+the writes resolve the names to Category rows, creating the missing ones, and the reads
+join the name back. Renaming a category updates its row only, and every task and routine
+in it reads the new name.
+"""
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from ..models import Category, Routines, TaskArchive, Tasks
+from .daily_stats import merge_category_stats
+from .data_version import bump_data_version
+from .delta_sync import record_deletions
+
+MAX_CATEGORY_LENGTH = 200
+
+def clean_category_name(name):
+    """The stored form of a category name; '' means no category"""
+    if name is None:
+        return ''
+    return str(name).strip()[:MAX_CATEGORY_LENGTH]
+
+def resolve_categories(user_id, names):
+    """Return {name: Category} for the (clean) names, creating the user's missing categories"""
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    categories = {c.name: c for c in Category.objects.filter(user_id=user_id, name__in=names)}
+    missing = names - categories.keys()
+    if missing:
+        # a concurrent write may create some of them first, read them back either way
+        Category.objects.bulk_create([Category(user_id=user_id, name=name) for name in missing], ignore_conflicts=True)
+        categories.update({c.name: c for c in Category.objects.filter(user_id=user_id, name__in=missing)})
+    return categories
+
+def resolve_category(user_id, name):
+    """The user's Category named name (cleaned), or None for no category"""
+    name = clean_category_name(name)
+    return resolve_categories(user_id, [name]).get(name)
+
+def category_names(objects):
+    """{category_id: name} for the tasks or routines, reading the ones not already loaded in one query"""
+    names, missing = {}, set()
+    for obj in objects:
+        if obj.category_id is None:
+            continue
+        category = obj._meta.get_field('category').get_cached_value(obj, None)
+        if category is not None:
+            names[category.id] = category.name
+        else:
+            missing.add(obj.category_id)
+    if missing - names.keys():
+        names.update(Category.objects.filter(id__in=missing - names.keys()).values_list('id', 'name'))
+    return names
+
+def category_facets(user_id):
+    """
+    Every category of the user with its total and pending task counts, one grouped query.
+    The total includes the archived tasks (all completed), counted by a subquery per category.
+    """
+    archived = TaskArchive.objects.filter(category=OuterRef('pk')).order_by().values('category').annotate(
+        count=Count('id')
+    ).values('count')
+    return list(
+        Category.objects.filter(user_id=user_id).annotate(
+            total=Count('tasks') + Coalesce(Subquery(archived), 0),
+            pending=Count('tasks', filter=Q(tasks__status=False)),
+        ).order_by('name').values('id', 'name', 'total', 'pending')
+    )
+
+def rename_category(category, name):
+    """
+    Rename the category. When the user already has a category with that name the two are
+    merged: the tasks and routines move to the existing one and this one is deleted.
+    Returns the category the tasks and routines are in afterwards.
+    """
+    with transaction.atomic():
+        target = Category.objects.select_for_update().filter(
+            user_id=category.user_id, name=name
+        ).exclude(id=category.id).first()
+        if target is None:
+            category.name = name
+            category.save(update_fields=['name'])
+            bump_data_version(category.user_id)
+            return category
+
+        # the data version row lock keeps the user's task writes out until the merge commits
+        bump_data_version(target.user_id)
+        # a merge is the one change of a category that moves rows; they get a new updated_at
+        # so the delta sync sends them with their new category_id
+        now = timezone.now()
+        Tasks.objects.filter(category=category).update(category=target, updated_at=now)
+        Routines.objects.filter(category=category).update(category=target, updated_at=now)
+        TaskArchive.objects.filter(category=category).update(category=target)
+        merge_category_stats(category.user_id, category.id, target.id)
+        record_deletions(category.user_id, 'category', [category.id])
+        category.delete()
+        return target
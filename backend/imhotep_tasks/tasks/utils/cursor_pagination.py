@@ -0,0 +1,72 @@
+"""
+Keyset (cursor) pagination.
+
+A cursor is an opaque token holding the ordering values of the row at the edge of a page
+and the direction to read in. The next page is read with a range predicate on those values
+instead of an OFFSET, so with an index matching the ordering every page costs the same as
+the first one. The ordering must be ascending and end with a unique field (the id).
+"""
+import base64
+import json
+from django.db.models import F
+from django.db.models.fields.tuple_lookups import Tuple, TupleGreaterThan, TupleLessThan
+
+def _row_value(row, field):
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+def encode_cursor(row, ordering, direction):
+    values = []
+    for field in ordering:
+        value = _row_value(row, field)
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+    raw = json.dumps({'k': values, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, queryset, ordering):
+    """Return (values, direction), or None when the cursor is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        direction = data['d']
+        if direction not in ('next', 'prev') or len(data['k']) != len(ordering):
+            return None
+        opts = queryset.model._meta
+        values = [opts.get_field(field).to_python(value) for field, value in zip(ordering, data['k'])]
+    except Exception:
+        return None
+    return values, direction
+
+def keyset_filter(ordering, values, direction='next'):
+    # a row value comparison, (a, b, c) > (x, y, z), which the database can seek to in the index
+    lookup = TupleGreaterThan if direction == 'next' else TupleLessThan
+    return lookup(Tuple(*(F(field) for field in ordering)), values)
+
+def paginate_by_cursor(queryset, ordering, cursor=None, per_page=20):
+    """
+    Read one page of the queryset after (or before) the cursor.
+    Returns (rows, next_cursor, prev_cursor); a cursor is None when there is no page that way.
+    """
+    decoded = decode_cursor(cursor, queryset, ordering)
+    queryset = queryset.order_by(*ordering)
+
+    if decoded is None:
+        rows = list(queryset[:per_page + 1])
+        has_next, has_prev = len(rows) > per_page, False
+        rows = rows[:per_page]
+    else:
+        values, direction = decoded
+        if direction == 'next':
+            rows = list(queryset.filter(keyset_filter(ordering, values, 'next'))[:per_page + 1])
+            has_next, has_prev = len(rows) > per_page, True
+            rows = rows[:per_page]
+        else:
+            reverse = [f'-{field}' for field in ordering]
+            rows = list(queryset.filter(keyset_filter(ordering, values, 'prev')).order_by(*reverse)[:per_page + 1])
+            has_next, has_prev = True, len(rows) > per_page
+            rows = rows[:per_page][::-1]
+
+    next_cursor = encode_cursor(rows[-1], ordering, 'next') if rows and has_next else None
+    prev_cursor = encode_cursor(rows[0], ordering, 'prev') if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
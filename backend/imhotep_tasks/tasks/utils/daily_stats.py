@@ -0,0 +1,198 @@
+"""
+Daily rollups of the task history (DailyTaskStats) and the series of the tasks/stats/ endpoint.
+
+For every user, day and category a row counts the tasks created that day, the tasks completed
+that day and the tasks due that day that weren't completed by it (overdue). record_task_changes
+applies every task write to them from the same snapshots as the counters, so a week, a month
+or a year of history is a range read of at most a few hundred rows.
+
+The creation day is the user's day (their time zone). The completion and due days are
+calendar days stored at midnight UTC (see user_time.py). A user's rows are built from their
+tasks, archived ones included, once (rebuild_daily_stats): by the backfill_task_stats command, by their first
+task write or stats read, and again when they change time zone.
+"""
+from collections import Counter, defaultdict
+from datetime import date, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from ..models import DailyTaskStats, TaskArchive, Tasks, TaskCounters, User
+from .data_version import bump_data_version
+from .user_time import user_timezone
+
+STAT_FIELDS = ('created', 'completed', 'overdue')
+STATS_PERIODS = ('week', 'month', 'year')
+
+def _user_zone(user_id):
+    return ZoneInfo(user_timezone(User.objects.only('id', 'timezone').get(id=user_id)))
+
+def _add_outcome(delta, snapshot, sign):
+    # what a task counts for besides its creation: its completion day and, when it wasn't
+    # completed by its due day, that day
+    done_date, due_date = snapshot.done_date, snapshot.due_date
+    if snapshot.status and done_date is not None:
+        delta[(done_date, snapshot.category_id, 'completed')] += sign
+    if due_date is not None and (not snapshot.status or (done_date is not None and done_date > due_date)):
+        delta[(due_date, snapshot.category_id, 'overdue')] += sign
+
+def _add_rows(user_id, rows):
+    """Add {(day, category_id): {field: count}} to the user's rows, creating the missing ones"""
+    existing = {
+        (row.day, row.category_id): row
+        for row in DailyTaskStats.objects.filter(user_id=user_id, day__in={day for day, _ in rows})
+    }
+    to_create, to_update = [], []
+    for (day, category_id), changes in rows.items():
+        row = existing.get((day, category_id))
+        if row is None:
+            to_create.append(DailyTaskStats(user_id=user_id, day=day, category_id=category_id, **changes))
+            continue
+        for field, value in changes.items():
+            setattr(row, field, getattr(row, field) + value)
+        to_update.append(row)
+    DailyTaskStats.objects.bulk_create(to_create)
+    DailyTaskStats.objects.bulk_update(to_update, STAT_FIELDS)
+
+def _rebuild(user_id):
+    zone, utc = _user_zone(user_id), dt_timezone.utc
+    rows = defaultdict(Counter)
+    # the archived tasks (see task_archive.py) have the same columns
+    for model in (Tasks, TaskArchive):
+        tasks = model.objects.filter(created_by_id=user_id).order_by()
+        grouped = (
+            ('created', tasks.annotate(day=TruncDate('creation_date', tzinfo=zone))),
+            ('completed', tasks.filter(status=True, done_date__isnull=False).annotate(day=TruncDate('done_date', tzinfo=utc))),
+            ('overdue', tasks.filter(due_date__isnull=False).annotate(
+                day=TruncDate('due_date', tzinfo=utc), done_day=TruncDate('done_date', tzinfo=utc),
+            ).filter(Q(status=False) | Q(done_day__gt=F('day')))),
+        )
+        for field, queryset in grouped:
+            for day, category_id, count in queryset.values_list('day', 'category_id').annotate(count=Count('id')):
+                rows[(day, category_id)][field] += count
+
+    DailyTaskStats.objects.filter(user_id=user_id).delete()
+    DailyTaskStats.objects.bulk_create([
+        DailyTaskStats(user_id=user_id, day=day, category_id=category_id, **counts)
+        for (day, category_id), counts in rows.items()
+    ])
+
+def rebuild_daily_stats(user_id):
+    """Recount the user's rows from the Tasks and TaskArchive tables, three grouped queries each"""
+    with transaction.atomic():
+        # the task writes lock the counters row, lock it first so they wait for the rebuild;
+        # a new row has no bucket day, its counts are recounted by its first read
+        counters, _ = TaskCounters.objects.select_for_update().get_or_create(user_id=user_id)
+        _rebuild(user_id)
+        TaskCounters.objects.filter(pk=counters.pk).update(daily_stats_built=True)
+        # the cached stats pages are stale
+        bump_data_version(user_id)
+
+def ensure_daily_stats(user_id):
+    if not TaskCounters.objects.filter(user_id=user_id, daily_stats_built=True).exists():
+        rebuild_daily_stats(user_id)
+
+def apply_stat_changes(counters, before, after):
+    """
+    Apply a task write to the user's rows, given the snapshots (see task_changes.task_snapshot)
+    the write removed and added. record_task_changes calls it with the user's counters row,
+    locked by task_counters.apply_task_changes, so the user's writes don't interleave here.
+    """
+    user_id = counters.user_id
+    delta = Counter()
+    for snapshot in after:
+        _add_outcome(delta, snapshot, 1)
+    for snapshot in before:
+        _add_outcome(delta, snapshot, -1)
+
+    # an update leaves the creation where it was unless it changes the category
+    created_before = Counter((s.creation_date, s.category_id) for s in before if s.creation_date)
+    created_after = Counter((s.creation_date, s.category_id) for s in after if s.creation_date)
+    moved = [(created_after - created_before, 1), (created_before - created_after, -1)]
+    if any(created for created, _ in moved):
+        zone = ZoneInfo(user_timezone(counters.user))
+        for created, sign in moved:
+            for (moment, category_id), count in created.items():
+                delta[(timezone.localtime(moment, zone).date(), category_id, 'created')] += sign * count
+
+    rows = defaultdict(dict)
+    for (day, category_id, field), value in delta.items():
+        if value:
+            rows[(day, category_id)][field] = value
+    if not rows:
+        return
+
+    if not counters.daily_stats_built:
+        # the user's history was never rolled up, build it all now (this write included)
+        _rebuild(user_id)
+        TaskCounters.objects.filter(pk=counters.pk).update(daily_stats_built=True)
+        return
+    _add_rows(user_id, rows)
+
+def merge_category_stats(user_id, source_id, target_id):
+    """Move the rows of a category merged into another one (see categories.rename_category)"""
+    source = DailyTaskStats.objects.filter(user_id=user_id, category_id=source_id)
+    rows = {(row.day, target_id): {field: getattr(row, field) for field in STAT_FIELDS} for row in source}
+    source.delete()
+    if rows:
+        _add_rows(user_id, rows)
+
+def period_start(period, today):
+    """The first day of the week (7 days), month (30 days) or year (12 months) ending today"""
+    if period == 'week':
+        return today - timedelta(days=6)
+    if period == 'month':
+        return today - timedelta(days=29)
+    year, month = divmod(today.year * 12 + today.month - 1 - 11, 12)
+    return date(year, month + 1, 1)
+
+def stats_series(user_id, period, today, category=None):
+    """
+    The created / completed / overdue counts of the period ending today: per day for a
+    week or a month, per month for a year, with the totals per category.
+    Overdue only counts the days before today, today's tasks can still be completed.
+    """
+    start = period_start(period, today)
+    rows = DailyTaskStats.objects.filter(user_id=user_id, day__gte=start, day__lte=today)
+    if category is not None:
+        rows = rows.filter(category__name=category)
+    sums = {
+        'created': Sum('created'),
+        'completed': Sum('completed'),
+        'overdue': Sum('overdue', filter=Q(day__lt=today)),
+    }
+
+    if period == 'year':
+        bucket = lambda day: day.replace(day=1)
+        buckets = []
+        month = start
+        while month <= today:
+            buckets.append(month)
+            month = (month + timedelta(days=31)).replace(day=1)
+    else:
+        bucket = lambda day: day
+        buckets = [start + timedelta(days=offset) for offset in range((today - start).days + 1)]
+
+    counts = {day: Counter() for day in buckets}
+    for row in rows.values('day').annotate(**sums).order_by():
+        counts[bucket(row['day'])].update({field: row[field] or 0 for field in STAT_FIELDS})
+
+    categories = [
+        {
+            'id': row['category_id'],
+            'name': row['category__name'] or '',
+            **{field: row[field] or 0 for field in STAT_FIELDS},
+        }
+        for row in rows.values('category_id', 'category__name').annotate(**sums).order_by('category__name')
+    ]
+    return {
+        'start': start.isoformat(),
+        'end': today.isoformat(),
+        'series': [
+            {'date': day.isoformat(), **{field: counts[day][field] for field in STAT_FIELDS}}
+            for day in buckets
+        ],
+        'totals': {field: sum(counts[day][field] for day in buckets) for field in STAT_FIELDS},
+        'categories': categories,
+    }
@@ -0,0 +1,26 @@
+"""
+A per-user data version, bumped by every write to the user's tasks or routines.
+
+Read endpoints tag their responses with an ETag derived from it, and cache their payloads
+under it (see response_cache.py), so any write invalidates all of the user's pages at once.
+"""
+import hashlib
+from django.db.models import F
+from django.utils.http import quote_etag
+from ..models import UserDataVersion
+from .user_time import user_today
+
+def bump_data_version(user_id):
+    if UserDataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1):
+        return
+    _, created = UserDataVersion.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+    if not created:
+        UserDataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+
+def get_data_version(user_id):
+    return UserDataVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+def make_etag(request, version):
+    # the user's date is part of the tag because the today / next week pages change at their midnight on their own
+    raw = f"{request.user.id}:{version}:{user_today(request.user)}:{request.get_full_path()}"
+    return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
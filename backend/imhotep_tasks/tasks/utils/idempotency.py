@@ -0,0 +1,49 @@
+"""
+Idempotency keys for the offline sync.
+
+A client can send a mutation_id with each mutation. The result of a mutation with an id is
+stored in the transaction that applied it, so when the client retries the batch (after a
+timeout, say) the mutation gets its stored result back and the Tasks table isn't touched.
+The unique (user, mutation_id) constraint makes a retry that races the original request
+wait for it and fail its insert; the caller rolls back and reads the stored results.
+"""
+from datetime import timedelta
+from django.conf import settings
+from ..models import ProcessedMutation
+
+MAX_MUTATION_ID_LENGTH = 64
+
+def processed_mutation_ttl():
+    return timedelta(days=getattr(settings, 'SYNC_PROCESSED_MUTATION_TTL_DAYS', 7))
+
+def mutation_id(mutation):
+    value = mutation.get('mutation_id')
+    return str(value) if value not in (None, '') else None
+
+def invalid_mutation_id(mutations):
+    """Return the first mutation_id that can't be stored, or None"""
+    for mutation in mutations:
+        value = mutation_id(mutation)
+        if value is not None and len(value) > MAX_MUTATION_ID_LENGTH:
+            return value
+    return None
+
+def processed_results(user_id, mutations):
+    """Return {mutation_id: stored result} for the mutations processed before"""
+    ids = {mutation_id(mutation) for mutation in mutations} - {None}
+    if not ids:
+        return {}
+    return dict(
+        ProcessedMutation.objects.filter(user_id=user_id, mutation_id__in=ids).values_list('mutation_id', 'result')
+    )
+
+def remember_results(user_id, mutations, results):
+    """
+    Store the results of the mutations that have an id, inside the transaction that applied them.
+    Failed mutations changed nothing, they aren't stored so a retry runs them again.
+    """
+    ProcessedMutation.objects.bulk_create([
+        ProcessedMutation(user_id=user_id, mutation_id=mutation_id(mutation), result=result)
+        for mutation, result in zip(mutations, results)
+        if mutation_id(mutation) is not None and result['success']
+    ])
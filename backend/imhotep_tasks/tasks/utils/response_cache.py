@@ -0,0 +1,103 @@
+"""
+Per-user versioned response cache for the hot read endpoints.
+
+The serialized payload of a page is cached under a key built from the user, the user's
+data version (the generation number bumped by every write), the current date and the
+request path. A write bumps the version, so every cached page of that user stops being
+addressed at once and simply ages out of the cache.
+
+Any Django cache backend works (local memory, file, ...), see PAGE_CACHE_ALIAS.
+"""
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from .data_version import get_data_version, make_etag
+from .user_time import user_today
+
+STATS_KEY = "tasks:page_cache:stats:{view}:{kind}"
+
+# the names of the views using the cache, for the stats
+CACHED_VIEWS = []
+
+def _cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+def _page_key(request, view_name, version):
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    return f"tasks:page_cache:{request.user.id}:{version}:{user_today(request.user)}:{view_name}:{path}"
+
+def _count(view_name, kind):
+    cache = _cache()
+    key = STATS_KEY.format(view=view_name, kind=kind)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+def page_cache_stats():
+    """Return {view_name: {'hits': n, 'misses': n}} for every cached view"""
+    cache = _cache()
+    return {
+        view_name: {
+            kind: cache.get(STATS_KEY.format(view=view_name, kind=kind), 0)
+            for kind in ('hits', 'misses')
+        }
+        for view_name in CACHED_VIEWS
+    }
+
+def reset_page_cache_stats():
+    _cache().delete_many([
+        STATS_KEY.format(view=view_name, kind=kind)
+        for view_name in CACHED_VIEWS
+        for kind in ('hits', 'misses')
+    ])
+
+def cached_on_data_version(view_func):
+    """
+    Serve a read endpoint from the user's data version. Goes under @permission_classes.
+    - If-None-Match still matching the version: 304 Not Modified, the view doesn't run
+    - a cached payload for this version and path: returned as is, the view doesn't run
+    - otherwise the view runs and its payload is cached, unless something wrote while it ran
+    """
+    view_name = view_func.__name__
+    CACHED_VIEWS.append(view_name)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        version = get_data_version(request.user.id)
+        etag = make_etag(request, version)
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            client_etags = parse_etags(if_none_match)
+            if etag in client_etags or '*' in client_etags:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        key = _page_key(request, view_name, version)
+        payload = _cache().get(key)
+        if payload is not None:
+            _count(view_name, 'hits')
+            response = Response(payload, status=status.HTTP_200_OK)
+        else:
+            _count(view_name, 'misses')
+            response = view_func(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+            # when something wrote while the view ran (apply_routines, another request) the
+            # payload can't be pinned to a version: don't cache or tag it, the next call will
+            if get_data_version(request.user.id) != version:
+                return response
+            _cache().set(key, response.data, getattr(settings, 'PAGE_CACHE_TIMEOUT', 300))
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return wrapper
@@ -0,0 +1,71 @@
+"""
+Nightly materialization of the routine tasks of every user (the materialize_routines command).
+
+The users are split into fixed ranges of user ids. Each range is materialized on its own
+(possibly in another process) with apply_user_routines and recorded as a MaterializedChunk,
+so an interrupted run resumes with the ranges it hadn't finished. Applying a range twice
+is harmless, apply_user_routines skips the routines already applied that day.
+
+With ROUTINES_MATERIALIZED on, the page views skip apply_routines once the run of the day
+finished, and a routine written during the day is applied right away instead.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from ..models import MaterializedChunk, RoutineMaterialization, User
+from .apply_routines import apply_user_routines
+from .user_time import user_today
+
+MATERIALIZED_KEY = "tasks:routines_materialized:{date}"
+
+def user_id_ranges(chunk_size):
+    """Split the user ids into (first_id, last_id) ranges of chunk_size ids"""
+    max_id = User.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    return [(first_id, first_id + chunk_size - 1) for first_id in range(1, max_id + 1, chunk_size)]
+
+def materialize_range(run_id, target_date, first_user_id, last_user_id):
+    """
+    Create the target_date routine tasks of the users in the id range and record the range as done.
+    A user whose own day is already past target_date (a time zone ahead of the run's) gets the
+    tasks of their day instead: target_date is behind them and their page views ask for that day.
+    Returns (users, tasks_created).
+    """
+    users = User.objects.filter(
+        id__range=(first_user_id, last_user_id), routines__status=True
+    ).distinct().order_by('id')
+
+    user_count = tasks_created = 0
+    for user in users:
+        tasks_created += len(apply_user_routines(user, max(target_date, user_today(user))))
+        user_count += 1
+
+    MaterializedChunk.objects.update_or_create(
+        run_id=run_id,
+        first_user_id=first_user_id,
+        defaults={'users': user_count, 'tasks_created': tasks_created},
+    )
+    return user_count, tasks_created
+
+def routines_materialized(target_date):
+    """Whether the page views can skip apply_routines for target_date"""
+    if not getattr(settings, 'ROUTINES_MATERIALIZED', False):
+        return False
+
+    key = MATERIALIZED_KEY.format(date=target_date)
+    materialized = cache.get(key)
+    if materialized is None:
+        materialized = RoutineMaterialization.objects.filter(
+            target_date=target_date, finished_at__isnull=False
+        ).exists()
+        # until the run finishes, look again every minute
+        cache.set(key, materialized, 60 * 60 * 48 if materialized else 60)
+    return materialized
+
+def apply_written_routine(user):
+    """
+    After a routine is added or changed: when today's routines were materialized already
+    the page views won't apply it, so apply it now.
+    """
+    today = user_today(user)
+    if routines_materialized(today):
+        apply_user_routines(user, today)
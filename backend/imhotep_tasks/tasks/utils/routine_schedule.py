@@ -0,0 +1,50 @@
+"""
+Compiled routine schedules.
+
+routines_dates is a JSON list of weekday names, day-of-month strings or MM-DD strings.
+Routines.save() compiles it into columns the database can match a date against:
+- weekday_mask: bit n set for DAY_NAMES[n], weekly routines
+- monthday_mask: bit d - 1 set for day d of the month, monthly routines
+- a RoutineYearlyDay row per MM-DD, stored as month * 100 + day, yearly routines
+so the routines due on a date are one SQL predicate (see apply_routines.due_on_filter).
+
+Rows saved before the columns existed keep schedule_version 0 until the
+compile_routine_schedules command runs, and are matched in Python meanwhile.
+"""
+SCHEDULE_VERSION = 1
+
+DAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def routine_dates_list(routine_dates):
+    # Handle routines_dates as a list (JSONField)
+    if isinstance(routine_dates, list):
+        return routine_dates
+    # Fallback for old data that might be stored as string
+    return str(routine_dates).lower().split() if routine_dates else []
+
+def month_day(target_date):
+    return target_date.month * 100 + target_date.day
+
+def compile_schedule(routine_type, routine_dates):
+    """Return (weekday_mask, monthday_mask, yearly month_days) for a routine"""
+    routine_dates = routine_dates_list(routine_dates)
+    weekday_mask = monthday_mask = 0
+    yearly_days = set()
+
+    if routine_type == 'weekly':
+        for index, day_name in enumerate(DAY_NAMES):
+            if day_name in routine_dates:
+                weekday_mask |= 1 << index
+    elif routine_type == 'monthly':
+        for day in range(1, 32):
+            if str(day) in routine_dates:
+                monthday_mask |= 1 << (day - 1)
+    elif routine_type == 'yearly':
+        for value in routine_dates:
+            # the same MM-DD strings strftime('%m-%d') produces
+            if isinstance(value, str) and len(value) == 5 and value[2] == '-' and value.replace('-', '', 1).isdigit():
+                month, day = int(value[:2]), int(value[3:])
+                if 1 <= month <= 12 and 1 <= day <= 31:
+                    yearly_days.add(month * 100 + day)
+
+    return weekday_mask, monthday_mask, yearly_days
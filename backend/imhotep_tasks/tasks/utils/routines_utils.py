@@ -0,0 +1,26 @@
+from .categories import category_names
+
+# the columns a serialized routine needs, for querysets read with .values(*ROUTINE_FIELDS)
+ROUTINE_FIELDS = (
+    'id', 'routines_title', 'routines_dates', 'routine_type', 'category_id', 'category__name', 'status', 'created_by_id'
+)
+
+# Helper serializer for a routine row read with .values(*ROUTINE_FIELDS)
+def serialize_routine_row(row):
+    return {
+        "id": row["id"],
+        "routines_title": row["routines_title"],
+        "routines_dates": row["routines_dates"],
+        "routine_type": row["routine_type"],
+        "routine_category": row["category__name"] or "general",
+        "category_id": row["category_id"],
+        "status": row["status"],
+        "created_by": row["created_by_id"],
+    }
+
+# Helper serializer for Routines
+def serialize_routine(routine):
+    return serialize_routine_row({
+        **{field: getattr(routine, field) for field in ROUTINE_FIELDS if field != 'category__name'},
+        'category__name': category_names([routine]).get(routine.category_id),
+    })
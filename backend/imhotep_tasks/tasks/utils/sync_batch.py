@@ -0,0 +1,225 @@
+"""
+Set-based execution of a sync_mutations batch.
+
+Every task the batch references is loaded (and locked) with one query, the mutations are
+applied in order to those objects in memory, and the result is written back with one
+bulk_create, one bulk_update and one DELETE, with a single record_task_changes call, all in
+one transaction.
+
+A mutation that fails validation (unknown task, missing field, ...) leaves the in-memory
+state untouched and only fails its own result, as if it ran in a savepoint. When the final
+write itself fails, the caller rolls back and falls back to running the mutations one by one.
+"""
+from django.db import transaction
+from ..models import Tasks
+from . import task_changes
+from .categories import clean_category_name, resolve_categories
+from .tasks_managements_utils import _parse_date_input, serialize_task
+from .user_time import user_today
+
+# the actions a batch can hold, each one a _Batch handler
+ACTIONS = (
+    'add_task',
+    'update_task',
+    'delete_task',
+    'toggle_complete',
+    'bulk_delete',
+    'bulk_complete',
+    'bulk_update_date',
+    'bulk_update_category',
+)
+
+def _task_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _task_ids(payload):
+    task_ids = payload.get('task_ids', [])
+    if not isinstance(task_ids, list):
+        raise ValueError('task_ids must be a list')
+    return task_ids
+
+def referenced_task_ids(mutations):
+    """Every task id the batch touches, so they can be loaded with one query"""
+    ids = set()
+    for mutation in mutations:
+        ids.add(_task_id(mutation.get('task_id')))
+        payload = mutation.get('payload')
+        if isinstance(payload, dict) and isinstance(payload.get('task_ids'), list):
+            ids.update(_task_id(task_id) for task_id in payload['task_ids'])
+    ids.discard(None)
+    return ids
+
+class _Batch:
+    def __init__(self, user, tasks):
+        self.user = user
+        self.tasks = {task.id: task for task in tasks}
+        self.before = {task.id: task_changes.task_snapshot(task) for task in tasks}
+        self.created = []
+        self.changed_fields = {}
+        self.deleted = set()
+        self.categories = {}
+
+    def category(self, name):
+        # the batch's categories by name, each one resolved (or created) once
+        name = clean_category_name(name)
+        if name and name not in self.categories:
+            self.categories.update(resolve_categories(self.user.id, [name]))
+        return self.categories.get(name)
+
+    def find(self, task_id):
+        task = self.tasks.get(_task_id(task_id))
+        return task if task is not None and task.id not in self.deleted else None
+
+    def get(self, task_id):
+        task = self.find(task_id)
+        if task is None:
+            raise ValueError(f'Task {task_id} not found')
+        return task
+
+    def change(self, task, **fields):
+        for field, value in fields.items():
+            setattr(task, field, value)
+        self.changed_fields.setdefault(task.id, set()).update(fields)
+
+    # the handlers mirror the ones in main/sync.py; each one validates everything before it changes anything
+
+    def add_task(self, payload, task_id):
+        today = user_today(self.user)
+        task = Tasks(
+            task_title=payload.get('task_title', ''),
+            task_details=payload.get('task_details'),
+            due_date=_parse_date_input(payload.get('due_date')) or today,
+            created_by=self.user,
+            category=self.category(payload.get('task_category', 'general')),
+        )
+        self.created.append(task)
+        # the id only exists after the insert, the result is filled in by execute()
+        return task
+
+    def update_task(self, payload, task_id):
+        task = self.get(task_id)
+        fields = {
+            field: payload[field]
+            for field in ('task_title', 'task_details')
+            if field in payload
+        }
+        if 'task_category' in payload:
+            fields['category'] = self.category(payload['task_category'])
+        if 'due_date' in payload and payload['due_date'] is not None:
+            parsed = _parse_date_input(payload['due_date'])
+            if parsed:
+                fields['due_date'] = parsed
+        self.change(task, **fields)
+        return {'task': serialize_task(task)}
+
+    def delete_task(self, payload, task_id):
+        task = self.find(task_id)
+        if task is None:
+            # Already deleted — that's fine
+            return {'message': 'Task already deleted'}
+        self.deleted.add(task.id)
+        return {'message': 'Task deleted'}
+
+    def toggle_complete(self, payload, task_id):
+        task = self.get(task_id)
+        task_status = not task.status
+        self.change(task, status=task_status, done_date=user_today(self.user) if task_status else None)
+        return {'task': serialize_task(task)}
+
+    def bulk_delete(self, payload, task_id):
+        tasks = [task for task in map(self.find, _task_ids(payload)) if task is not None]
+        self.deleted.update(task.id for task in tasks)
+        return {'deleted_count': len({task.id for task in tasks})}
+
+    def bulk_complete(self, payload, task_id):
+        task_ids = _task_ids(payload)
+        for task in {task.id: task for task in map(self.find, task_ids) if task is not None}.values():
+            task_status = not task.status
+            self.change(task, status=task_status, done_date=user_today(self.user) if task_status else None)
+        return {'updated_count': len(task_ids)}
+
+    def bulk_update_date(self, payload, task_id):
+        task_ids = _task_ids(payload)
+        due_date_raw = payload.get('due_date')
+        if not due_date_raw:
+            raise ValueError('due_date is required')
+        parsed = _parse_date_input(due_date_raw)
+        if parsed is None:
+            raise ValueError(f'Invalid due_date: {due_date_raw}')
+        for task in filter(None, map(self.find, task_ids)):
+            self.change(task, due_date=parsed)
+        return {'updated_count': len(task_ids)}
+
+    def bulk_update_category(self, payload, task_id):
+        task_ids = _task_ids(payload)
+        category = (payload.get('task_category', '') or '').strip().lower()
+        if not category:
+            raise ValueError('task_category is required')
+        category = self.category(category)
+        for task in filter(None, map(self.find, task_ids)):
+            self.change(task, category=category)
+        return {'updated_count': len(task_ids)}
+
+    def write(self):
+        Tasks.objects.bulk_create(self.created)
+
+        updated = [self.tasks[task_id] for task_id in self.changed_fields if task_id not in self.deleted]
+        if updated:
+            fields = set().union(*(self.changed_fields[task.id] for task in updated))
+            task_changes.touch(updated)
+            Tasks.objects.bulk_update(updated, [*fields, 'updated_at'])
+
+        if self.deleted:
+            Tasks.objects.filter(id__in=self.deleted, created_by=self.user).delete()
+
+        touched = self.changed_fields.keys() | self.deleted
+        task_changes.record_task_changes(
+            self.user.id,
+            [self.before[task_id] for task_id in touched],
+            [task_changes.task_snapshot(task) for task in updated + self.created],
+        )
+
+def execute(user, mutations):
+    """
+    Run the (deduplicated, sorted) mutations as one set-based batch.
+    Returns the per-mutation results in the sync_mutations format.
+    A database error while writing propagates, with nothing written.
+    """
+    with transaction.atomic():
+        # with their category, the results serialize it; only the tasks are locked
+        tasks = Tasks.objects.select_for_update(of=('self',)).select_related('category').filter(
+            created_by=user, id__in=referenced_task_ids(mutations)
+        )
+        batch = _Batch(user, list(tasks))
+        results = []
+        created = []
+
+        for mutation in mutations:
+            action = mutation.get('action', '')
+            payload = mutation.get('payload', {})
+            task_id = mutation.get('task_id')
+            entry = {'action': action, 'task_id': task_id}
+
+            try:
+                if not isinstance(payload, dict):
+                    raise ValueError('payload must be an object')
+                if action not in ACTIONS:
+                    raise ValueError(f'Unknown action: {action}')
+                result = getattr(batch, action)(payload, task_id)
+            except Exception as e:
+                results.append({**entry, 'success': False, 'error': str(e)})
+                continue
+
+            if isinstance(result, Tasks):
+                created.append((len(results), result))
+                result = {}
+            results.append({**entry, 'success': True, **result})
+
+        batch.write()
+
+    for index, task in created:
+        results[index].update({'task': serialize_task(task), 'server_id': task.id})
+    return results
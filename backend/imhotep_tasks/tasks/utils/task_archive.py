@@ -0,0 +1,120 @@
+"""
+The cold archive of old completed tasks (TaskArchive).
+
+Completed tasks are rarely looked at again a few weeks after they were done, but they would
+stay in Tasks forever, growing every index and the all tasks sort. The archive_tasks command
+moves the ones done and due more than TASK_ARCHIVE_AFTER_DAYS ago to TaskArchive, keeping
+their ids. Being completed and long past due they are out of the today / next week buckets for
+good, so of the counters only total and completed count them (count_tasks reads both tables),
+and the daily stats are rebuilt from both tables; moving a task changes neither.
+
+Archived tasks are read only. all_tasks lists them after the tasks with include_archived,
+reading the archive only once the pages get past the last task. The export includes them;
+the search, the autocomplete and the delta sync pull don't.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from ..models import Tasks, TaskArchive
+from .cursor_pagination import encode_cursor, paginate_by_cursor
+from .data_version import bump_data_version
+
+ARCHIVE_FIELDS = (
+    'id', 'created_by_id', 'task_title', 'task_details', 'creation_date', 'category_id', 'due_date', 'status', 'done_date'
+)
+# cursors of the archived pages start with it; the cursor of the first one is the prefix alone
+ARCHIVE_CURSOR_PREFIX = 'a.'
+# the cursor of the last page of tasks, the page before the first archived one
+LAST_TASKS_CURSOR = 't.last'
+
+def archive_age():
+    return timedelta(days=getattr(settings, 'TASK_ARCHIVE_AFTER_DAYS', 90))
+
+def archivable_tasks(cutoff):
+    """The completed tasks done and due before cutoff"""
+    return Tasks.objects.filter(status=True, done_date__lt=cutoff, due_date__lt=cutoff)
+
+def archive_tasks(queryset):
+    """Move the tasks of the queryset to the archive in one transaction, returns how many moved"""
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().order_by('id').values(*ARCHIVE_FIELDS))
+        if not rows:
+            return 0
+        now = timezone.now()
+        TaskArchive.objects.bulk_create([TaskArchive(archived_at=now, **row) for row in rows])
+        Tasks.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        # the counts don't change, the all tasks pages do
+        for user_id in sorted({row['created_by_id'] for row in rows}):
+            bump_data_version(user_id)
+    return len(rows)
+
+def archived_counts(user_ids):
+    """{user_id: archived tasks} for the users, every one of them completed"""
+    return dict(
+        TaskArchive.objects.filter(created_by_id__in=user_ids).order_by()
+        .values('created_by').annotate(count=Count('id')).values_list('created_by', 'count')
+    )
+
+class TasksThenArchive:
+    """
+    The rows of the tasks queryset followed by the rows of the archived one, for Paginator.
+    The archive is only read by the pages past the last task.
+    """
+
+    def __init__(self, tasks, archived):
+        self.tasks = tasks
+        self.archived = archived
+        self._tasks_count = None
+
+    def tasks_count(self):
+        if self._tasks_count is None:
+            self._tasks_count = self.tasks.count()
+        return self._tasks_count
+
+    def count(self):
+        return self.tasks_count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        split = self.tasks_count()
+        rows = list(self.tasks[start:min(stop, split)]) if start < split else []
+        if stop > split:
+            rows += list(self.archived[max(start - split, 0):stop - split])
+        return rows
+
+def paginate_with_archive(tasks, archived, ordering, cursor=None, per_page=20):
+    """
+    paginate_by_cursor over the tasks followed by the archived tasks. The next page of the last
+    page of tasks is the first archived one, whose previous page is the last page of tasks.
+    Returns (rows, next_cursor, prev_cursor).
+    """
+    if cursor is not None and cursor.startswith(ARCHIVE_CURSOR_PREFIX):
+        rows, next_cursor, prev_cursor = paginate_by_cursor(
+            archived, ordering, cursor[len(ARCHIVE_CURSOR_PREFIX):], per_page
+        )
+        return (
+            rows,
+            next_cursor and ARCHIVE_CURSOR_PREFIX + next_cursor,
+            ARCHIVE_CURSOR_PREFIX + prev_cursor if prev_cursor else LAST_TASKS_CURSOR,
+        )
+
+    if cursor == LAST_TASKS_CURSOR:
+        # the last page is the first one read backwards
+        reverse = [f'-{field}' for field in ordering]
+        rows = list(tasks.order_by(*reverse)[:per_page + 1])
+        has_prev = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        prev_cursor = encode_cursor(rows[0], ordering, 'prev') if rows and has_prev else None
+        return rows, ARCHIVE_CURSOR_PREFIX, prev_cursor
+
+    rows, next_cursor, prev_cursor = paginate_by_cursor(tasks, ordering, cursor, per_page)
+    if next_cursor is None and archived.exists():
+        next_cursor = ARCHIVE_CURSOR_PREFIX
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,61 @@
+"""
+Every task write goes through record_task_changes, so everything derived from the
+Tasks table (the counters, the daily stats, the user's data version, the sync tombstones)
+is updated in the same transaction.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from django.db import transaction
+from django.utils import timezone
+from . import daily_stats, task_counters
+from .data_version import bump_data_version
+from .delta_sync import record_deletions
+from .task_suggestions import recent_suggestions
+
+TaskSnapshot = namedtuple('TaskSnapshot', ('id', 'due_date', 'status', 'category_id', 'creation_date', 'done_date'))
+
+# due and done dates are calendar days stored at midnight UTC (see user_time.py)
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.astimezone(dt_timezone.utc).date() if timezone.is_aware(value) else value.date()
+    return value
+
+# the parts of a task that the derived data depends on; take it before task.delete(), which clears the id
+def task_snapshot(task):
+    return TaskSnapshot(
+        task.id, _as_date(task.due_date), bool(task.status), task.category_id, task.creation_date, _as_date(task.done_date)
+    )
+
+# snapshots of every task in a queryset, reading only the needed columns
+def queryset_snapshots(queryset):
+    return [
+        TaskSnapshot(task_id, _as_date(due_date), bool(task_status), category_id, creation_date, _as_date(done_date))
+        for task_id, due_date, task_status, category_id, creation_date, done_date in queryset.values_list(
+            'id', 'due_date', 'status', 'category_id', 'creation_date', 'done_date'
+        )
+    ]
+
+# bulk_update doesn't go through save(), so the bulk paths stamp updated_at with this
+# and add 'updated_at' to the updated fields (tasks and routines alike)
+def touch(objects):
+    now = timezone.now()
+    for obj in objects:
+        obj.updated_at = now
+
+def record_task_changes(user_id, before=(), after=()):
+    """
+    Record a task write for the user.
+    before/after are the snapshots of the tasks removed and added by the write
+    (a create only has after, a delete only has before, an update has both).
+    Call it inside the transaction of the write so everything commits together.
+    """
+    before, after = list(before), list(after)
+    with transaction.atomic():
+        bump_data_version(user_id)
+        counters = task_counters.apply_task_changes(user_id, before, after)
+        if counters is not None:
+            daily_stats.apply_stat_changes(counters, before, after)
+        deleted_ids = {snapshot.id for snapshot in before} - {snapshot.id for snapshot in after}
+        record_deletions(user_id, 'task', deleted_ids)
+    # this process's autocomplete entries of the user may miss the written titles and categories
+    recent_suggestions.forget(user_id)
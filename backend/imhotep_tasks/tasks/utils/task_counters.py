@@ -0,0 +1,124 @@
+from collections import Counter
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, F, Q
+from ..models import Tasks, TaskCounters
+from .task_archive import archived_counts
+from .task_filters import today_tasks_filter, next_week_tasks_filter
+from .user_time import user_today
+
+COUNTER_FIELDS = (
+    'total',
+    'completed',
+    'today_total',
+    'today_completed',
+    'next_week_total',
+    'next_week_completed',
+)
+
+def count_tasks(user_ids, today):
+    """
+    Recount the counters of the users with one grouped query over their tasks, and one over
+    their archived tasks, which are all completed and out of the day buckets.
+    Returns {user_id: {field: count}}.
+    """
+    today_q = today_tasks_filter(today)
+    next_week_q = next_week_tasks_filter(today)
+    rows = Tasks.objects.filter(created_by_id__in=user_ids).order_by().values('created_by').annotate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status=True)),
+        today_total=Count('id', filter=today_q),
+        today_completed=Count('id', filter=today_q & Q(status=True)),
+        next_week_total=Count('id', filter=next_week_q),
+        next_week_completed=Count('id', filter=next_week_q & Q(status=True)),
+    )
+    counts = {row.pop('created_by'): row for row in rows}
+    for user_id, archived in archived_counts(user_ids).items():
+        user_counts = counts.setdefault(user_id, dict.fromkeys(COUNTER_FIELDS, 0))
+        user_counts['total'] += archived
+        user_counts['completed'] += archived
+    return counts
+
+def _rebuild(counters, today):
+    counts = count_tasks([counters.user_id], today).get(counters.user_id, {})
+    for field in COUNTER_FIELDS:
+        setattr(counters, field, counts.get(field, 0))
+    counters.bucket_date = today
+    counters.save()
+
+def _locked_counters(user_id, today=None):
+    """
+    Lock the user's counters row for the rest of the transaction.
+    A missing row, or one whose day buckets were counted for another day than the user's
+    today, is rebuilt from the Tasks table; the second value tells the caller it already
+    reflects the table.
+    """
+    # the user comes along for its time zone, only the counters row is locked
+    counters, created = TaskCounters.objects.select_for_update(of=('self',)).select_related(
+        'user'
+    ).get_or_create(user_id=user_id)
+    today = today or user_today(counters.user)
+    if created or counters.bucket_date != today:
+        _rebuild(counters, today)
+        return counters, True
+    return counters, False
+
+def _add_snapshot(delta, snapshot, bucket_date, sign):
+    due_date, task_status = snapshot.due_date, snapshot.status
+    delta['total'] += sign
+    if task_status:
+        delta['completed'] += sign
+    if due_date is None:
+        return
+
+    if due_date == bucket_date or (due_date < bucket_date and not task_status):
+        delta['today_total'] += sign
+        if task_status:
+            delta['today_completed'] += sign
+
+    if bucket_date <= due_date <= bucket_date + timedelta(days=7):
+        delta['next_week_total'] += sign
+        if task_status:
+            delta['next_week_completed'] += sign
+
+def apply_task_changes(user_id, before, after):
+    """
+    Apply a task write to the user's counters, given the snapshots
+    (see task_changes.task_snapshot) the write removed and added.
+    Returns the locked counters row (with its user), or None when the write changed nothing.
+    """
+    if Counter(before) == Counter(after):
+        return None
+
+    with transaction.atomic():
+        counters, rebuilt = _locked_counters(user_id)
+        if rebuilt:
+            return counters
+
+        delta = Counter()
+        for snapshot in after:
+            _add_snapshot(delta, snapshot, counters.bucket_date, 1)
+        for snapshot in before:
+            _add_snapshot(delta, snapshot, counters.bucket_date, -1)
+
+        changes = {field: F(field) + value for field, value in delta.items() if value}
+        if changes:
+            TaskCounters.objects.filter(pk=counters.pk).update(**changes)
+        return counters
+
+def get_task_counts(user, url_call="all"):
+    """Return (total, completed, pending) for the page the request came from"""
+    today = user_today(user)
+    counters = TaskCounters.objects.filter(user_id=user.id).first()
+    if counters is None or counters.bucket_date != today:
+        with transaction.atomic():
+            counters, _ = _locked_counters(user.id, today)
+
+    if url_call == "today-tasks":
+        total, completed = counters.today_total, counters.today_completed
+    elif url_call == "next-week":
+        total, completed = counters.next_week_total, counters.next_week_completed
+    else:
+        total, completed = counters.total, counters.completed
+
+    return total, completed, total - completed
@@ -0,0 +1,25 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from django.db.models import Q
+
+# the first instant of the day; due dates are calendar days stored at midnight UTC (see user_time.py)
+# and are compared against instants rather than cast to dates (due_date__date) so the
+# (user, due_date) indexes serve them
+def day_start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+# (start of the day, start of the next day, end of the next seven days) for a user's today,
+# computed once per day for every user sharing it
+@lru_cache(maxsize=64)
+def day_window(today):
+    return day_start(today), day_start(today + timedelta(days=1)), day_start(today + timedelta(days=8))
+
+# tasks shown on the today page: due today, or overdue and still pending
+def today_tasks_filter(today):
+    start, end, _ = day_window(today)
+    return Q(due_date__gte=start, due_date__lt=end) | Q(due_date__lt=start, status=False)
+
+# tasks due within the next seven days, today included
+def next_week_tasks_filter(today):
+    start, _, week_end = day_window(today)
+    return Q(due_date__gte=start, due_date__lt=week_end)
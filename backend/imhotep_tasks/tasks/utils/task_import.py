@@ -0,0 +1,269 @@
+"""
+Bulk import of tasks and routines from NDJSON or CSV (the export format, see main/export_data.py).
+
+The input is parsed one line at a time, every row is validated on its own, and valid rows
+are inserted with bulk_create in batches, each batch in its own transaction together with
+its counter updates. Invalid rows don't stop the import, they end up in the error report.
+"""
+import csv
+import json
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils.dateparse import parse_datetime
+from ..models import Tasks, Routines
+from . import task_changes
+from .categories import clean_category_name, resolve_categories
+from .data_version import bump_data_version
+from .tasks_managements_utils import _parse_date_input
+from .user_time import user_today
+from .validate_yearly_dates import validate_yearly_dates
+
+IMPORT_FILE_TYPES = ('ndjson', 'csv')
+
+# the error report keeps the first errors only, so a broken file can't blow up the response
+MAX_REPORTED_ERRORS = 1000
+
+# other apps (and older exports) name the columns after the model fields
+KEY_ALIASES = {
+    'task_title': 'title',
+    'routines_title': 'title',
+    'task_details': 'details',
+    'task_category': 'category',
+    'routine_category': 'category',
+    'routines_dates': 'routine_dates',
+}
+
+TRUE_VALUES = ('true', '1', 'yes', 'y', 'done', 'completed')
+FALSE_VALUES = ('false', '0', 'no', 'n', '', 'pending')
+
+def default_batch_size():
+    return getattr(settings, 'TASK_IMPORT_BATCH_SIZE', 1000)
+
+def iter_rows(lines, file_type):
+    """
+    Parse the text lines of an import file incrementally.
+    Yields (row_number, record) where record is a dict, or a str describing why the row can't be parsed.
+    """
+    if file_type == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for row_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row_number, f"invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, "each line must be a JSON object"
+            continue
+        yield row_number, record
+
+def _normalize(record):
+    normalized = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        key = key.strip().lower()
+        normalized[KEY_ALIASES.get(key, key)] = value.strip() if isinstance(value, str) else value
+    return normalized
+
+def _parse_bool(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"status must be true or false, got: {value}")
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        parsed = _parse_date_input(value)
+        if parsed is None:
+            raise ValueError(f"invalid date: {value}")
+    return parsed
+
+def _parse_choice(record, key, default=''):
+    # a JSON line can hold any type, only a string names a choice
+    value = record.get(key) or default
+    if not isinstance(value, str):
+        raise ValueError(f"{key} must be a string, got: {value}")
+    return value.lower()
+
+def _check_length(record, key, max_length):
+    value = record.get(key)
+    if value is not None and len(str(value)) > max_length:
+        raise ValueError(f"{key} must be at most {max_length} characters")
+
+def _build_task(user, record, today):
+    title = record.get('title')
+    if not title:
+        raise ValueError("title is required")
+    _check_length(record, 'title', 200)
+    _check_length(record, 'details', 2000)
+    _check_length(record, 'category', 200)
+
+    due_date = record.get('due_date')
+    parsed_due_date = _parse_date_input(due_date) if due_date else today
+    if parsed_due_date is None:
+        raise ValueError(f"invalid due_date: {due_date}")
+
+    task_status = _parse_bool(record.get('status'), False)
+    done_date = _parse_datetime(record.get('done_date')) if task_status else None
+
+    task = Tasks(
+        task_title=title,
+        task_details=record.get('details') or None,
+        due_date=parsed_due_date,
+        status=task_status,
+        done_date=done_date or (today if task_status else None),
+        created_by=user,
+    )
+    # resolved to the Category with the rest of the batch, see _set_categories
+    task.category_name = clean_category_name(record.get('category') or 'general')
+    return task
+
+def _build_routine(user, record):
+    title = record.get('title')
+    if not title:
+        raise ValueError("title is required")
+    _check_length(record, 'title', 200)
+    _check_length(record, 'category', 100)
+
+    routine_type = _parse_choice(record, 'routine_type')
+    if routine_type not in ('yearly', 'monthly', 'weekly'):
+        raise ValueError("routine_type must be yearly, monthly, or weekly")
+
+    routine_dates = record.get('routine_dates')
+    if isinstance(routine_dates, str):
+        try:
+            routine_dates = json.loads(routine_dates)
+        except ValueError:
+            raise ValueError("routine_dates must be a JSON list")
+    if not isinstance(routine_dates, list) or not routine_dates:
+        raise ValueError("routine_dates must be a non-empty list")
+    if routine_type == 'yearly':
+        is_valid, error_msg = validate_yearly_dates(routine_dates)
+        if not is_valid:
+            raise ValueError(f"Invalid yearly dates: {error_msg}")
+
+    routine = Routines(
+        routines_title=title,
+        routine_type=routine_type,
+        routines_dates=routine_dates,
+        status=_parse_bool(record.get('status'), True),
+        created_by=user,
+    )
+    routine.category_name = clean_category_name(record.get('category') or 'general')
+    routine.compile_schedule()
+    return routine
+
+def _set_categories(user, objects):
+    # the categories of a whole batch are read (or created) together
+    categories = resolve_categories(user.id, {obj.category_name for obj in objects})
+    for obj in objects:
+        obj.category = categories.get(obj.category_name)
+
+class _ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported_tasks = 0
+        self.imported_routines = 0
+        self.failed_rows = 0
+        self.errors = []
+
+    def fail(self, row_number, error):
+        self.failed_rows += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': error})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported_tasks': self.imported_tasks,
+            'imported_routines': self.imported_routines,
+            'failed_rows': self.failed_rows,
+            'errors': self.errors,
+            'errors_truncated': self.failed_rows > len(self.errors),
+        }
+
+def _flush_tasks(user, batch, report):
+    tasks = [task for _, task in batch]
+    try:
+        with transaction.atomic():
+            _set_categories(user, tasks)
+            Tasks.objects.bulk_create(tasks)
+            task_changes.record_task_changes(user.id, after=[task_changes.task_snapshot(t) for t in tasks])
+    except DatabaseError as e:
+        for row_number, _ in batch:
+            report.fail(row_number, f"database error: {e}")
+        return
+    report.imported_tasks += len(tasks)
+
+def _flush_routines(user, batch, report):
+    routines = [routine for _, routine in batch]
+    try:
+        with transaction.atomic():
+            _set_categories(user, routines)
+            Routines.objects.bulk_create(routines)
+            Routines.store_yearly_days(routines)
+            bump_data_version(user.id)
+    except DatabaseError as e:
+        for row_number, _ in batch:
+            report.fail(row_number, f"database error: {e}")
+        return
+    report.imported_routines += len(routines)
+
+def import_rows(user, rows, batch_size=None):
+    """
+    Validate and insert the rows yielded by iter_rows for the user.
+    Returns the report: row / import / failure counts and the per-row errors.
+    """
+    batch_size = batch_size or default_batch_size()
+    today = user_today(user)
+    report = _ImportReport()
+    task_batch, routine_batch = [], []
+
+    for row_number, record in rows:
+        report.rows += 1
+        if isinstance(record, str):
+            report.fail(row_number, record)
+            continue
+
+        record = _normalize(record)
+        try:
+            record_type = _parse_choice(record, 'type', 'task')
+            if record_type == 'task':
+                task_batch.append((row_number, _build_task(user, record, today)))
+            elif record_type == 'routine':
+                routine_batch.append((row_number, _build_routine(user, record)))
+            else:
+                raise ValueError(f"unknown type: {record_type}")
+        except ValueError as e:
+            report.fail(row_number, str(e))
+
+        if len(task_batch) >= batch_size:
+            _flush_tasks(user, task_batch, report)
+            task_batch = []
+        if len(routine_batch) >= batch_size:
+            _flush_routines(user, routine_batch, report)
+            routine_batch = []
+
+    if task_batch:
+        _flush_tasks(user, task_batch, report)
+    if routine_batch:
+        _flush_routines(user, routine_batch, report)
+
+    return report.as_dict()
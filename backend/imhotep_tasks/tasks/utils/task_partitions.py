@@ -0,0 +1,180 @@
+"""
+Hash partitioning of the Tasks table by user (PostgreSQL 13+ only).
+
+Every task query is scoped by created_by, so with tasks_tasks partitioned by
+HASH (created_by_id) a user's queries only read the partition of that user, VACUUM and
+the index maintenance run per partition, and a heavy user's writes only bloat the indexes
+of their own partition.
+
+The partitioning lives in the database only, Django keeps seeing one tasks_tasks table.
+The partition_tasks command converts the table (partition_tasks --partitions N) and back
+(--revert). It's never run on its own: the table is locked while its rows are copied, and
+afterwards the migrations must respect the partitioning (see Tasks.Meta). Both ways rebuild tasks_tasks in one
+transaction: the table is renamed, a new one is created LIKE it, the rows are copied over,
+the indexes, foreign keys, id sequence and search trigger are recreated on the new table
+and the old one is dropped.
+
+PostgreSQL requires the primary key and the unique indexes of a partitioned table to contain
+the partition key, so the primary key becomes (id, created_by_id) and created_by_id is added
+to the unique indexes (the tasks of a routine all belong to its user, so
+tasks_routine_occurrence_unique keeps its meaning); --revert takes it out again. The ids
+still come from one sequence, so id alone stays unique and the ORM keeps using it as the
+primary key. Nothing may reference tasks_tasks by foreign key, the rebuild refuses to run
+if something does.
+"""
+import re
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from ..models import Tasks
+from .task_search import install_search_trigger
+
+TASKS_TABLE = Tasks._meta.db_table
+PARTITION_KEY = 'created_by_id'
+OLD_TABLE = f'{TASKS_TABLE}_old'
+ID_SEQUENCE = f'{TASKS_TABLE}_id_seq'
+
+# the column list of an index definition (... USING btree (a, b) ...) or of a
+# unique constraint definition (UNIQUE (a, b))
+_COLUMNS = re.compile(r'(USING \w+ \(|^UNIQUE \()([^()]*)\)')
+
+def partitioning_supported(db=connection):
+    return db.vendor == 'postgresql'
+
+def tasks_partitions(cursor):
+    """The number of partitions of the Tasks table, 0 when it's a plain table"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [TASKS_TABLE])
+    if cursor.fetchone()[0] != 'p':
+        return 0
+    cursor.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = %s::regclass", [TASKS_TABLE])
+    return cursor.fetchone()[0]
+
+def _with_partition_key(definition, partitioned):
+    """The unique index or constraint definition with created_by_id added to (or taken out of) its columns"""
+    def columns(match):
+        names = [name.strip() for name in match.group(2).split(',')]
+        if partitioned and PARTITION_KEY not in names:
+            names.append(PARTITION_KEY)
+        elif not partitioned and len(names) > 1 and names[-1] == PARTITION_KEY:
+            names.pop()
+        return f"{match.group(1)}{', '.join(names)})"
+    return _COLUMNS.sub(columns, definition, count=1)
+
+def _indexes(cursor):
+    # (name, index definition, unique, primary, constraint definition or None)
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(ix.indexrelid), ix.indisunique, ix.indisprimary, pg_get_constraintdef(c.oid)
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        LEFT JOIN pg_constraint c ON c.conindid = ix.indexrelid AND c.conrelid = ix.indrelid
+        WHERE ix.indrelid = %s::regclass
+    """, [TASKS_TABLE])
+    return cursor.fetchall()
+
+def _foreign_keys(cursor):
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TASKS_TABLE],
+    )
+    return cursor.fetchall()
+
+def _referencing_tables(cursor):
+    cursor.execute(
+        "SELECT DISTINCT conrelid::regclass::text FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'",
+        [TASKS_TABLE],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def _id_sequence(cursor):
+    """(the sequence of the id column, whether it's an identity column, the next id)"""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TASKS_TABLE])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT attidentity <> '' FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'", [TASKS_TABLE]
+    )
+    identity = cursor.fetchone()[0]
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {TASKS_TABLE}")
+    next_id = cursor.fetchone()[0]
+    if sequence:
+        cursor.execute(f"SELECT last_value + CASE WHEN is_called THEN 1 ELSE 0 END FROM {sequence}")
+        next_id = max(next_id, cursor.fetchone()[0])
+    return sequence, identity, next_id
+
+def rebuild_tasks_table(partitions, using=DEFAULT_DB_ALIAS):
+    """
+    Rebuild tasks_tasks hash partitioned by user in partitions partitions, or as a plain
+    table for 0, keeping its rows, indexes, foreign keys and ids.
+    """
+    partitioned = partitions > 0
+    db = connections[using]
+    with transaction.atomic(using=using), db.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {TASKS_TABLE} IN ACCESS EXCLUSIVE MODE")
+        referencing = _referencing_tables(cursor)
+        if referencing:
+            raise ValueError(f"{', '.join(referencing)} reference {TASKS_TABLE}, it can't be rebuilt")
+
+        # everything the new table needs, read before the old one gives up the names
+        indexes = _indexes(cursor)
+        foreign_keys = _foreign_keys(cursor)
+        sequence, identity, next_id = _id_sequence(cursor)
+        cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass", [TASKS_TABLE])
+        old_partitions = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(f"ALTER TABLE {TASKS_TABLE} RENAME TO {OLD_TABLE}")
+        for partition in old_partitions:
+            cursor.execute(f"ALTER TABLE {partition} RENAME TO {partition}_old")
+        for name, _ in foreign_keys:
+            cursor.execute(f'ALTER TABLE {OLD_TABLE} DROP CONSTRAINT "{name}"')
+        for name, _, _, _, constraint in indexes:
+            if constraint is not None:
+                cursor.execute(f'ALTER TABLE {OLD_TABLE} DROP CONSTRAINT "{name}"')
+            else:
+                cursor.execute(f'DROP INDEX "{name}"')
+        if identity:
+            cursor.execute(f"ALTER TABLE {OLD_TABLE} ALTER COLUMN id DROP IDENTITY")
+        elif sequence:
+            cursor.execute(f"ALTER TABLE {OLD_TABLE} ALTER COLUMN id DROP DEFAULT")
+            cursor.execute(f"DROP SEQUENCE {sequence}")
+
+        partition_by = f" PARTITION BY HASH ({PARTITION_KEY})" if partitioned else ""
+        cursor.execute(
+            f"CREATE TABLE {TASKS_TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)"
+            f"{partition_by}"
+        )
+        for remainder in range(partitions):
+            cursor.execute(
+                f"CREATE TABLE {TASKS_TABLE}_p{remainder} PARTITION OF {TASKS_TABLE} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+        if partitioned:
+            # identity columns of partitioned tables need PostgreSQL 17, a sequence default works everywhere
+            cursor.execute(f"CREATE SEQUENCE {ID_SEQUENCE} START WITH {next_id} OWNED BY {TASKS_TABLE}.id")
+            cursor.execute(f"ALTER TABLE {TASKS_TABLE} ALTER COLUMN id SET DEFAULT nextval('{ID_SEQUENCE}')")
+        else:
+            cursor.execute(
+                f"ALTER TABLE {TASKS_TABLE} ALTER COLUMN id "
+                f"ADD GENERATED BY DEFAULT AS IDENTITY (SEQUENCE NAME {ID_SEQUENCE} START WITH {next_id})"
+            )
+
+        # the rows go in before the indexes and the search trigger, their search_vector is copied as is
+        cursor.execute(f"INSERT INTO {TASKS_TABLE} SELECT * FROM {OLD_TABLE}")
+
+        for name, definition, unique, primary, constraint in indexes:
+            if primary:
+                key = f"id, {PARTITION_KEY}" if partitioned else "id"
+                cursor.execute(f'ALTER TABLE {TASKS_TABLE} ADD CONSTRAINT "{name}" PRIMARY KEY ({key})')
+            elif constraint is not None:
+                if unique:
+                    constraint = _with_partition_key(constraint, partitioned)
+                cursor.execute(f'ALTER TABLE {TASKS_TABLE} ADD CONSTRAINT "{name}" {constraint}')
+            else:
+                # the indexes of a partitioned table are defined ON ONLY it
+                definition = definition.replace(' ON ONLY ', ' ON ', 1)
+                if unique:
+                    definition = _with_partition_key(definition, partitioned)
+                cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {TASKS_TABLE} ADD CONSTRAINT "{name}" {definition}')
+
+        install_search_trigger(using)
+        cursor.execute(f"DROP TABLE {OLD_TABLE}")
+    with db.cursor() as cursor:
+        cursor.execute(f"ANALYZE {TASKS_TABLE}")
@@ -0,0 +1,108 @@
+"""
+Full-text search over the task titles and details (the tasks/search/ endpoint).
+
+On PostgreSQL every task keeps a tsvector of its title (weight A) and details (weight B)
+in Tasks.search_vector. A trigger fills it on every insert and on every update of the
+title or details, so the bulk paths (bulk_create, bulk_update, import) keep it right too.
+A GIN index on it serves the matches. The trigger and the index are installed after
+every migrate (install_search_trigger), and the index_task_search command fills the
+rows written before the trigger existed.
+
+Results are ranked with ts_rank (cast to double precision, the type of the cursor's rank)
+and paginated by cursor on (rank, id), both descending.
+Other databases (SQLite in development) match the words with icontains instead and
+order by id only.
+"""
+import base64
+import json
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+from django.db.models.fields.tuple_lookups import Tuple, TupleLessThan
+from ..models import Tasks
+
+# the text search configuration; 'simple' doesn't stem, so it works for any language
+SEARCH_CONFIG = 'simple'
+MAX_QUERY_LENGTH = 200
+SEARCH_PAGE_SIZE = 20
+
+SEARCH_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION tasks_tasks_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.task_title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.task_details, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_tasks_search_vector ON tasks_tasks;
+CREATE TRIGGER tasks_tasks_search_vector
+    BEFORE INSERT OR UPDATE OF task_title, task_details ON tasks_tasks
+    FOR EACH ROW EXECUTE FUNCTION tasks_tasks_search_vector();
+
+CREATE INDEX IF NOT EXISTS tasks_search_vector_gin ON tasks_tasks USING gin (search_vector);
+"""
+
+def search_supported(db=connection):
+    return db.vendor == 'postgresql'
+
+def install_search_trigger(using, **kwargs):
+    """post_migrate handler: (re)create the search_vector trigger and its GIN index"""
+    db = connections[using]
+    if not search_supported(db):
+        return
+    with db.cursor() as cursor:
+        cursor.execute(SEARCH_TRIGGER_SQL)
+
+def encode_search_cursor(rank, task_id):
+    raw = json.dumps([rank, task_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_search_cursor(cursor):
+    """Return (rank, id), or None when the cursor is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, task_id = json.loads(raw)
+        if not isinstance(rank, (int, float)) or isinstance(rank, bool) or not isinstance(task_id, int):
+            return None
+    except Exception:
+        return None
+    return float(rank), task_id
+
+def search_queryset(user_id, text):
+    """The user's tasks matching text, annotated with their rank"""
+    queryset = Tasks.objects.filter(created_by_id=user_id)
+    if search_supported():
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+        # ts_rank is a real; as a double it reads back exactly as the float in the cursor, so
+        # the (rank, id) comparison neither skips nor repeats the rows of an equal rank
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        return queryset.filter(search_vector=query).annotate(rank=rank)
+
+    words = Q()
+    for word in text.split():
+        words &= Q(task_title__icontains=word) | Q(task_details__icontains=word)
+    return queryset.filter(words).annotate(rank=Value(0.0, output_field=FloatField()))
+
+def search_tasks(user_id, text, fields, task_status=None, category=None, cursor=None, limit=SEARCH_PAGE_SIZE):
+    """
+    One page of the user's tasks matching text, best match first.
+    cursor is the decoded (rank, id) of the last row of the previous page.
+    Returns (rows, next_cursor): the rows read with .values(*fields, 'rank').
+    """
+    queryset = search_queryset(user_id, text)
+    if task_status is not None:
+        queryset = queryset.filter(status=task_status)
+    if category is not None:
+        queryset = queryset.filter(category__name=category)
+    if cursor is not None:
+        queryset = queryset.filter(TupleLessThan(Tuple(F('rank'), F('id')), list(cursor)))
+
+    rows = list(queryset.order_by('-rank', '-id').values(*fields, 'rank')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1]['rank'], rows[-1]['id'])
+    return rows, next_cursor
@@ -0,0 +1,146 @@
+"""
+Autocomplete of task titles and categories (the tasks/autocomplete/ endpoint).
+
+A suggestion is one of the user's own titles or categories: the ones starting with what
+was typed come first, then the ones close to it (pg_trgm word similarity, so "wrok"
+still finds "work"). Categories differing only in case or surrounding spaces are
+suggested once, in their most used spelling.
+
+On PostgreSQL the pg_trgm extension and trigram GIN indexes on the task titles and
+the category names are installed after every migrate (install_trigram_indexes). Other
+databases (SQLite in development) only match prefixes and substrings.
+
+Typing sends a burst of requests, so every process keeps the last suggestions of each
+user for a few seconds (RecentSuggestions) and answers the repeats from memory.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, connections
+from django.db.models import Case, Count, FloatField, IntegerField, Max, Q, Value, When
+from ..models import Category, Tasks
+
+# field: (model, its user column, the suggested column, the count of its uses)
+SUGGESTION_FIELDS = {
+    'title': (Tasks, 'created_by_id', 'task_title', Count('id')),
+    'category': (Category, 'user_id', 'name', Count('tasks')),
+}
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 20
+MAX_PREFIX_LENGTH = 100
+# shorter text has too few trigrams to be compared, it's only matched as a prefix
+MIN_FUZZY_LENGTH = 3
+
+TRIGRAM_INDEXES_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS tasks_title_trgm ON tasks_tasks USING gin (task_title gin_trgm_ops)",
+    # the categories moved to their own table
+    "DROP INDEX IF EXISTS tasks_category_trgm",
+    "CREATE INDEX IF NOT EXISTS category_name_trgm ON tasks_category USING gin (name gin_trgm_ops)",
+]
+
+def trigrams_supported(db=connection):
+    return db.vendor == 'postgresql'
+
+def install_trigram_indexes(using, **kwargs):
+    """post_migrate handler: the pg_trgm extension and the trigram indexes"""
+    db = connections[using]
+    if not trigrams_supported(db):
+        return
+    with db.cursor() as cursor:
+        for statement in TRIGRAM_INDEXES_SQL:
+            cursor.execute(statement)
+
+
+class RecentSuggestions:
+    """
+    A small in-process LRU of the suggestions recently returned to each user,
+    keyed by (field, typed text, limit). A task write forgets the user's entries in the
+    process that made it; the other processes catch up when the entries expire (ttl seconds).
+    """
+
+    def __init__(self, max_users=1000, per_user=32, ttl=30):
+        self.max_users = max_users
+        self.per_user = per_user
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None or key not in entries:
+                return None
+            expires, suggestions = entries[key]
+            if expires < time.monotonic():
+                del entries[key]
+                return None
+            self._users.move_to_end(user_id)
+            entries.move_to_end(key)
+            return suggestions
+
+    def set(self, user_id, key, suggestions):
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                entries = self._users[user_id] = OrderedDict()
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_id)
+            entries[key] = (time.monotonic() + self.ttl, suggestions)
+            entries.move_to_end(key)
+            if len(entries) > self.per_user:
+                entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+recent_suggestions = RecentSuggestions()
+
+def _query_suggestions(user_id, field, text, limit):
+    model, user_column, column, uses = SUGGESTION_FIELDS[field]
+    prefix = Q(**{f'{column}__istartswith': text})
+    similarity = Value(0.0, output_field=FloatField())
+    if not trigrams_supported():
+        matches = prefix | Q(**{f'{column}__icontains': text})
+    elif len(text) >= MIN_FUZZY_LENGTH:
+        # the word similarity of a 3+ letter prefix is at least 0.75, over the 0.6 threshold,
+        # so the trigram match covers the prefixes too and the GIN index serves it alone
+        matches = Q(**{f'{column}__trigram_word_similar': text})
+        similarity = TrigramWordSimilarity(text, column)
+    else:
+        matches = prefix
+
+    rows = model.objects.filter(**{user_column: user_id}).filter(matches).values(column).annotate(
+        prefix=Max(Case(When(prefix, then=1), default=0, output_field=IntegerField())),
+        similarity=Max(similarity),
+        uses=uses,
+    ).order_by('-prefix', '-similarity', '-uses', column)
+    # a few more than asked, some can fold into one below
+    return list(rows[:limit * 3])
+
+def suggest(user_id, field, text, limit=DEFAULT_SUGGESTIONS):
+    """The user's titles or categories (field) matching text, best first"""
+    key = (field, text.casefold(), limit)
+    suggestions = recent_suggestions.get(user_id, key)
+    if suggestions is not None:
+        return suggestions
+
+    column = SUGGESTION_FIELDS[field][2]
+    suggestions, seen = [], set()
+    for row in _query_suggestions(user_id, field, text, limit):
+        value = row[column] or ''
+        folded = value.strip().casefold()
+        # spellings folding to the same text rank alike and come by use, the most used one is kept
+        if not folded or folded in seen:
+            continue
+        seen.add(folded)
+        suggestions.append(value.strip() if field == 'category' else value)
+        if len(suggestions) == limit:
+            break
+
+    recent_suggestions.set(user_id, key, suggestions)
+    return suggestions
@@ -1,21 +1,50 @@
-from datetime import date, timedelta, datetime as _datetime
+from datetime import date
 from django.utils.dateparse import parse_datetime
-from ..models import Tasks
-from django.db.models import Q
-from django.utils import timezone
+from ..models import Tasks, TaskArchive
+from . import task_counters
+from .categories import category_names
+from .task_filters import today_tasks_filter, next_week_tasks_filter
 
-# Helper serializer for Tasks
-def serialize_task(task):
-    return {
-        "id": task.id,
-        "task_title": task.task_title,
-        "task_details": getattr(task, "task_details", None),
-        "due_date": task.due_date.isoformat() if getattr(task, "due_date", None) else None,
-        "task_category": task.task_category or "",
-        "status": bool(task.status),
-        "done_date": task.done_date.isoformat() if getattr(task, "done_date", None) else None,
-        "created_by": getattr(task.created_by, "id", None),
+# the columns a serialized task needs, for querysets read with .values(*TASK_FIELDS)
+TASK_FIELDS = (
+    'id', 'task_title', 'task_details', 'due_date', 'category_id', 'category__name', 'status', 'done_date', 'created_by_id'
+)
+
+# the archived tasks (see task_archive.py) are read with the same columns and the day they were archived
+ARCHIVED_TASK_FIELDS = (*TASK_FIELDS, 'archived_at')
+
+# Helper serializer for a task row read with .values(*TASK_FIELDS) (or ARCHIVED_TASK_FIELDS)
+def serialize_task_row(row):
+    due_date = row["due_date"]
+    done_date = row["done_date"]
+    task = {
+        "id": row["id"],
+        "task_title": row["task_title"],
+        "task_details": row["task_details"],
+        "due_date": due_date.isoformat() if due_date else None,
+        "task_category": row["category__name"] or "",
+        "category_id": row["category_id"],
+        "status": bool(row["status"]),
+        "done_date": done_date.isoformat() if done_date else None,
+        "created_by": row["created_by_id"],
     }
+    if "archived_at" in row:
+        task["archived_at"] = row["archived_at"].isoformat()
+    return task
+
+# Helper serializer for Tasks, reading the category names not loaded with them in one query
+def serialize_tasks(tasks):
+    names = category_names(tasks)
+    return [
+        serialize_task_row({
+            **{field: getattr(task, field) for field in TASK_FIELDS if field != 'category__name'},
+            'category__name': names.get(task.category_id),
+        })
+        for task in tasks
+    ]
+
+def serialize_task(task):
+    return serialize_tasks([task])[0]
 
 # Helper: parse date-like input to date
 def _parse_date_input(value):
@@ -37,42 +66,30 @@ def _parse_date_input(value):
             pass
     return None
 
-# updated counts based on the url it called from
-def tasks_count(url_call="all", request=None):
-    today = timezone.now().date()
-
-    #if the url call is for today tasks
-    if url_call == "today-tasks":
-        user_tasks_qs = Tasks.objects.filter(
-            created_by=request.user
-        ).filter(
-            Q(due_date__date=today) |
-            Q(due_date__date__lt=today, status=False)
-        ).order_by('status', 'due_date').all()
+# the order of every tasks page; the id makes it total so it can be paginated by cursor
+TASKS_ORDERING = ('status', 'due_date', 'id')
 
-        completed = user_tasks_qs.filter(status=True).count()
-        total = user_tasks_qs.count()
-        pending = total - completed
+# the querysets behind each tasks page, shared by the views and the counts (their plans are checked in tests.py)
+def today_tasks_queryset(user, today):
+    return Tasks.objects.filter(
+        created_by=user
+    ).filter(
+        today_tasks_filter(today)
+    ).order_by(*TASKS_ORDERING)
 
-    #for the next week
-    elif url_call == "next-week": 
-        week_later = today + timedelta(days=7)
-        user_tasks_qs = Tasks.objects.filter(
-            created_by=request.user,
-            due_date__date__gte=today,
-            due_date__date__lte=week_later
-        ).order_by('status', 'due_date').all()
+def next_week_tasks_queryset(user, today):
+    return Tasks.objects.filter(
+        created_by=user
+    ).filter(
+        next_week_tasks_filter(today)
+    ).order_by(*TASKS_ORDERING)
 
-        completed = user_tasks_qs.filter(status=True).count()
-        total = user_tasks_qs.count()
-        pending = total - completed
+def all_tasks_queryset(user):
+    return Tasks.objects.filter(created_by=user).order_by(*TASKS_ORDERING)
 
-    # for all of the tasks (show all) or if it's not passed
-    elif url_call == "all":
-        user_tasks_qs = Tasks.objects.filter(created_by=request.user)
+def archived_tasks_queryset(user):
+    return TaskArchive.objects.filter(created_by=user).order_by(*TASKS_ORDERING)
 
-        completed = user_tasks_qs.filter(status=True).count()
-        total = user_tasks_qs.count()
-        pending = total - completed
-
-    return total, completed, pending
\ No newline at end of file
+# updated counts based on the url it called from, read from the user's task counters
+def tasks_count(url_call="all", request=None):
+    return task_counters.get_task_counts(request.user, url_call)
@@ -0,0 +1,109 @@
+"""
+The refresh token blacklist: an in-process front for the revocation checks and the purge.
+
+With ROTATE_REFRESH_TOKENS and BLACKLIST_AFTER_ROTATION every auth/token/refresh/ call
+blacklists the token it was given, and logout blacklists one more, so OutstandingToken and
+BlacklistedToken grow with every session. An expired token is refused on its exp claim alone,
+so its rows serve nothing: the prune_expired_tokens command deletes them (the blacklisted
+row goes with its outstanding one), which bounds the tables by the live sessions.
+
+A blacklisted token stays blacklisted until it expires, so a process can remember the jtis it
+saw blacklisted without ever being wrong (RevokedTokens): the ones it blacklisted itself and,
+read on its first check, the most recent ones of the table. CachedRefreshToken refuses those
+without a query, a replayed rotated token costs nothing.
+
+Only those replays are sped up. A jti it doesn't know, which is every legitimate refresh (a
+rotated token is used once), may have been blacklisted by another process since, so it still
+costs the indexed lookup of the table. Remembering the "not blacklisted" answers, even for a
+few seconds, would let a token rotated on one process be replayed on another meanwhile.
+"""
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class RevokedTokens:
+    """
+    A bounded in-process LRU of blacklisted jtis with their expiry, filled from the
+    table once (on the first check) and by every blacklisting made in the process.
+    """
+
+    def __init__(self, max_tokens=10000):
+        self.max_tokens = max_tokens
+        self._tokens = OrderedDict()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        rows = (
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            .order_by('-blacklisted_at')
+            .values_list('token__jti', 'token__expires_at')[:self.max_tokens]
+        )
+        # oldest first, so the newest ones are the last evicted
+        for jti, expires_at in reversed(list(rows)):
+            self.add(jti, expires_at)
+
+    def contains(self, jti):
+        if not self._loaded:
+            with self._lock:
+                load, self._loaded = not self._loaded, True
+            if load:
+                self._load()
+        with self._lock:
+            expires_at = self._tokens.get(jti)
+            if expires_at is None:
+                return False
+            if expires_at <= timezone.now():
+                # refused on its exp claim from now on
+                del self._tokens[jti]
+                return False
+            self._tokens.move_to_end(jti)
+            return True
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._tokens[jti] = expires_at
+            self._tokens.move_to_end(jti)
+            if len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._loaded = False
+
+
+revoked_tokens = RevokedTokens(max_tokens=getattr(settings, 'TOKEN_BLACKLIST_CACHE_SIZE', 10000))
+
+def remember_blacklisted(sender, instance, created, **kwargs):
+    """post_save handler of BlacklistedToken"""
+    if created:
+        # a blacklisting rolled back must not be remembered
+        jti, expires_at = instance.token.jti, instance.token.expires_at
+        transaction.on_commit(lambda: revoked_tokens.add(jti, expires_at))
+
+def expired_tokens(now=None):
+    """The outstanding tokens past their expiry, deleting one deletes its blacklisted row"""
+    return OutstandingToken.objects.filter(expires_at__lte=now or timezone.now())
+
+
+class CachedRefreshToken(RefreshToken):
+    """RefreshToken checking revoked_tokens before the blacklist table"""
+
+    def check_blacklist(self):
+        if revoked_tokens.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+        super().check_blacklist()
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
@@ -0,0 +1,141 @@
+"""
+JWT authentication resolving the user from a short lived in-process cache.
+
+simplejwt's JWTAuthentication reads the user row on every request, though the views only
+need its id, username and time zone. CachedJWTAuthentication keeps the rows it read for
+AUTH_USER_CACHE_TTL seconds (RecentUsers, at most AUTH_USER_CACHE_SIZE users per process)
+and builds the request's user from them, so most requests skip that query.
+
+Saving or deleting a user (profile update, email change, password change or reset,
+deactivation in the admin, ...) forgets them in the process that did it and, once the write
+commits, gives them a new stamp in the shared Django cache (forget_cached_user, connected in
+apps.py; AUTH_USER_CACHE_ALIAS). Every entry keeps the stamp it was read under and a hit
+compares it with the shared one, so the other processes drop a changed user on their next
+request: a hit costs one cache read instead of the user query. That takes a cache shared by
+the processes (CACHE_BACKEND); with the local memory default the other processes only
+catch up when their entry expires. Every request gets its own User instance, a view
+changing request.user never changes the cached row.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from ..models import User
+
+# the columns a user is cached and rebuilt with, in the order User() takes them
+USER_FIELDS = [field.attname for field in User._meta.concrete_fields]
+
+
+class RecentUsers:
+    """
+    A small in-process LRU of the user rows recently read by the authentication,
+    keyed by their id, each kept ttl seconds with the user's stamp it was read under.
+    """
+
+    def __init__(self, max_users=10000, ttl=30):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, stamp):
+        """A new User built from the cached row, None when it's not cached, expired or stamped otherwise"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            expires, entry_stamp, db, values = entry
+            if expires < time.monotonic() or entry_stamp != stamp:
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+        return User.from_db(db, USER_FIELDS, values)
+
+    def set(self, user_id, user, stamp):
+        if self.ttl <= 0:
+            return
+        values = tuple(getattr(user, field) for field in USER_FIELDS)
+        with self._lock:
+            self._users[user_id] = (time.monotonic() + self.ttl, stamp, user._state.db, values)
+            self._users.move_to_end(user_id)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+recent_users = RecentUsers(
+    max_users=getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 30),
+)
+
+STAMP_KEY = "tasks:auth_user:stamp:{user_id}"
+
+def _shared_cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+def _cache_key(user_id):
+    # the claim holds the id as the token was issued with it, an int or a string
+    return str(user_id)
+
+def user_stamp(key, create=False):
+    """The user's stamp in the shared cache; None when it has none (or was evicted) unless create"""
+    cache = _shared_cache()
+    stamp = cache.get(STAMP_KEY.format(user_id=key))
+    if stamp is None and create:
+        cache.add(STAMP_KEY.format(user_id=key), uuid.uuid4().hex, timeout=None)
+        stamp = cache.get(STAMP_KEY.format(user_id=key))
+    return stamp
+
+def restamp_user(key):
+    _shared_cache().set(STAMP_KEY.format(user_id=key), uuid.uuid4().hex, timeout=None)
+
+def forget_cached_user(sender, instance, using=None, **kwargs):
+    """post_save / post_delete handler of User"""
+    key = _cache_key(getattr(instance, api_settings.USER_ID_FIELD))
+    recent_users.forget(key)
+    # after the commit: a process reading the row before it would cache the old one under the new stamp
+    transaction.on_commit(lambda: restamp_user(key), using=using)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication reading the token's user from recent_users first"""
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            # raises the missing claim error
+            return super().get_user(validated_token)
+
+        key = _cache_key(user_id)
+        stamp = user_stamp(key)
+        user = recent_users.get(key, stamp) if stamp is not None else None
+        if user is None:
+            # the stamp is read before the row: a write committed in between restamps the user,
+            # and the entry is only dropped for nothing
+            stamp = stamp or user_stamp(key, create=True)
+            # reads the row and checks it's active and the token isn't revoked
+            user = super().get_user(validated_token)
+            recent_users.set(key, user, stamp)
+            return user
+
+        # only active users are cached, the token still has to match the password
+        if api_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
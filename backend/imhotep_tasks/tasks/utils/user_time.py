@@ -0,0 +1,57 @@
+"""
+The user's own calendar day.
+
+Due dates are calendar days: a task due on 2025-08-17 is stored at midnight UTC of that day,
+whatever the time zone of its user. What differs between users is which calendar day is
+"today", so every today / next week / routine computation asks user_today() for it instead
+of reading the server clock, and then filters the due dates by the instant ranges of that
+day (see task_filters.py).
+
+The local day of a time zone only changes at its midnight, so the day and the instant it
+ends are kept per time zone and reused by every request until then.
+"""
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+# {time zone name: (local day, the instant it ends)}
+_local_days = {}
+
+def valid_timezone(name):
+    """Whether name is an IANA time zone name (Africa/Cairo, America/New_York, UTC...)"""
+    if not isinstance(name, str) or not name or len(name) > 64:
+        return False
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+# the validator of User.timezone
+def validate_timezone(name):
+    if not valid_timezone(name):
+        raise ValidationError(f"{name} is not a valid time zone")
+
+def user_timezone(user):
+    name = getattr(user, 'timezone', None)
+    return name if valid_timezone(name) else settings.TIME_ZONE
+
+def local_today(tz_name):
+    """The current day in the time zone"""
+    now = timezone.now()
+    cached = _local_days.get(tz_name)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+
+    zone = ZoneInfo(tz_name)
+    today = timezone.localtime(now, zone).date()
+    # next local midnight; a zone skipping midnight for DST lands on the first instant after it
+    ends = timezone.make_aware(datetime.combine(today + timedelta(days=1), time.min), zone)
+    _local_days[tz_name] = (today, ends)
+    return today
+
+def user_today(user):
+    """The current day where the user is"""
+    return local_today(user_timezone(user))